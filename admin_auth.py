@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import hmac
+import os
+
+from fastapi import HTTPException, Request
+
+# Operational endpoints (the */stats routes) show pool, cache, queue and billing
+# state. They only answer "Authorization: Bearer $ADMIN_TOKEN" (or
+# "X-Admin-Token: ..."); without ADMIN_TOKEN they are switched off (404).
+
+ADMIN_TOKEN = (os.getenv("ADMIN_TOKEN") or "").strip()
+
+
+def require_admin(request: Request) -> None:
+    """
+    FastAPI dependency for admin-only routes.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    auth = (request.headers.get("authorization") or "").strip()
+    token = auth.split(" ", 1)[1].strip() if auth.lower().startswith("bearer ") else ""
+    token = token or (request.headers.get("x-admin-token") or "").strip()
+    if not token or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
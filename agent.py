@@ -1,8 +1,29 @@
 # agent.py — Gemini-based Bible AI (with conversation history support)
 
+import asyncio
+import hashlib
+import logging
 import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+
 from dotenv import load_dotenv
 from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types
+
+try:
+    import httpx
+except Exception:  # pragma: no cover - installed with google-genai
+    httpx = None
+
+import bible_search
+from answer_cache import AnswerCache, is_personal, normalize_question
+
+log = logging.getLogger(__name__)
 
 # Load env vars
 load_dotenv()
@@ -64,54 +85,1098 @@ Capabilities:
 """.strip()
 
 
-def run_bible_ai(prompt: str, lang: str = "auto", history: list | None = None) -> str:
-    """
-    Call Gemini and return plain text.
-    history: list of dicts like: { "role": "user"|"assistant", "content": "..." }
-    """
+GEMINI_MODEL_DEFAULT = "gemini-2.5-flash"
 
-    lang = (lang or "auto").strip().lower()
-    if lang not in ("auto", "en", "es"):
-        lang = "auto"
+# Concurrency for the async path: at most MAX_CONCURRENCY Gemini calls in flight
+# per worker, at most MAX_WAITING callers queued behind them.
+MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY") or "32")
+MAX_WAITING = int(os.getenv("GEMINI_MAX_WAITING") or "256")
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("GEMINI_QUEUE_TIMEOUT") or "15")
+CALL_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT") or "60")
+
+
+class ChatBusyError(RuntimeError):
+    """Too many chats queued, or waited too long for a free slot."""
+
+
+class ChatTimeoutError(RuntimeError):
+    """Gemini did not answer within CALL_TIMEOUT_SECONDS."""
+
+
+class ChatUnavailableError(RuntimeError):
+    """Gemini keeps failing (retries used up, or the circuit breaker is open)."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _models() -> list:
+    # GEMINI_MODEL="primary" or "primary,secondary"; the secondary is only used for hedging.
+    names = [m.strip() for m in (os.getenv("GEMINI_MODEL") or GEMINI_MODEL_DEFAULT).split(",") if m.strip()]
+    return names or [GEMINI_MODEL_DEFAULT]
+
+
+def _model() -> str:
+    return _models()[0]
+
+
+def _hedge_model() -> str | None:
+    names = _models()
+    return names[1] if len(names) > 1 else None
+
+
+# -----------------------------
+# Context budget
+# -----------------------------
+# Instead of resending SYSTEM_PROMPT + the last 30 raw messages every turn:
+# - SYSTEM_PROMPT goes out as a system instruction, or as provider-side cached
+#   content when Gemini accepts it (explicit caches have a minimum size; below it
+#   the stable prefix still benefits from implicit caching),
+# - the newest messages are sent verbatim up to CONTEXT_HISTORY_TOKENS,
+# - older messages are folded into a short rolling summary kept in the caller's
+#   `memory` dict and refreshed in the background after the reply.
+CONTEXT_HISTORY_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS") or "1200")
+CONTEXT_MIN_MESSAGES = int(os.getenv("CHAT_CONTEXT_MIN_MESSAGES") or "2")
+SUMMARY_BATCH = int(os.getenv("CHAT_SUMMARY_BATCH") or "2")
+SUMMARY_MAX_WORDS = 120
+
+CACHE_SYSTEM_PROMPT = (os.getenv("GEMINI_CACHE_SYSTEM_PROMPT") or "1").strip().lower() in ("1", "true", "yes", "on")
+SYSTEM_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL") or "3600")
+SYSTEM_CACHE_RETRY_SECONDS = 3600
+
+_SYSTEM_CACHE = {"name": None, "model": None, "expires": 0.0, "retry_after": 0.0}
+_BACKGROUND = set()
 
-    lang_rule = ""
+CONTEXT_STATS = {
+    "requests": 0,
+    "naive_tokens": 0,
+    "sent_tokens": 0,
+    "cached_system": 0,
+    "summaries": 0,
+    "summary_failures": 0,
+    "prompt_tokens_reported": 0,
+    "cached_tokens_reported": 0,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English/Spanish prose; good enough for budgeting
+    # without a count_tokens round trip.
+    return (len(text or "") + 3) // 4
+
+
+def _lang_rule(lang: str) -> str:
+    lang = (lang or "auto").strip().lower()
     if lang == "es":
-        lang_rule = "\nIMPORTANT: Respond ONLY in Spanish."
-    elif lang == "en":
-        lang_rule = "\nIMPORTANT: Respond ONLY in English."
+        return "IMPORTANT: Respond ONLY in Spanish."
+    if lang == "en":
+        return "IMPORTANT: Respond ONLY in English."
+    return ""
+
 
-    # Convert conversation history into a clean transcript
-    transcript = ""
+def _clean_history(history: list | None) -> list:
+    out = []
     if history and isinstance(history, list):
-        lines = []
-        for m in history[-30:]:
+        for m in history:
             role = (m.get("role") or "").strip().lower()
             content = (m.get("content") or "").strip()
-            if not content:
-                continue
-            if role == "assistant":
-                lines.append(f"Alyana: {content}")
-            else:
-                lines.append(f"User: {content}")
-        if lines:
-            transcript = "\n\nConversation so far:\n" + "\n".join(lines)
-
-    full_prompt = (
-        SYSTEM_PROMPT
-        + lang_rule
-        + (transcript or "")
-        + "\n\nUser says:\n"
-        + prompt.strip()
+            if content:
+                out.append(("assistant" if role == "assistant" else "user", content))
+    return out
+
+
+def _line(role: str, content: str) -> str:
+    return f"Alyana: {content}" if role == "assistant" else f"User: {content}"
+
+
+def naive_prompt_tokens(prompt: str, lang: str = "auto", history: list | None = None) -> int:
+    """
+    Size of the prompt as it used to be built: SYSTEM_PROMPT + last 30 messages + message.
+    """
+    lines = [_line(r, c) for r, c in _clean_history(history)[-30:]]
+    text = SYSTEM_PROMPT + _lang_rule(lang) + "\n\nConversation so far:\n" + "\n".join(lines) + "\n\nUser says:\n" + prompt
+    return estimate_tokens(text)
+
+
+def build_context(
+    prompt: str, lang: str = "auto", history: list | None = None, memory: dict | None = None, grounding: str = ""
+) -> dict:
+    """
+    Prompt contents (without SYSTEM_PROMPT) within the token budget, plus the
+    retrieved verses in `grounding` (see retrieve_grounding).
+    Returns {"contents", "pending", "verbatim", "naive_tokens"}; `pending` are
+    older messages not yet folded into memory["summary"].
+    """
+    prompt = (prompt or "").strip()
+    msgs = _clean_history(history)
+    naive = naive_prompt_tokens(prompt, lang, history)
+
+    # The caller usually pushes the new message before calling us; don't send it twice.
+    if msgs and msgs[-1] == ("user", prompt):
+        msgs = msgs[:-1]
+
+    split = len(msgs)
+    used = 0
+    while split > 0:
+        cost = estimate_tokens(msgs[split - 1][1]) + 3
+        if len(msgs) - split >= CONTEXT_MIN_MESSAGES and used + cost > CONTEXT_HISTORY_TOKENS:
+            break
+        used += cost
+        split -= 1
+    older, recent = msgs[:split], msgs[split:]
+
+    memory = memory if memory is not None else {}
+    summary = (memory.get("summary") or "").strip()
+
+    # Older messages after the last one already folded into the summary.
+    start = 0
+    last = memory.get("last")
+    if last:
+        for i in range(len(older) - 1, -1, -1):
+            if list(older[i]) == list(last):
+                start = i + 1
+                break
+    pending = older[start:]
+
+    parts = []
+    rule = _lang_rule(lang)
+    if rule:
+        parts.append(rule)
+    if summary:
+        parts.append("Summary of the earlier conversation:\n" + summary)
+    if recent:
+        parts.append("Conversation so far:\n" + "\n".join(_line(r, c) for r, c in recent))
+    if grounding:
+        parts.append(grounding)
+    parts.append("User says:\n" + prompt)
+
+    return {
+        "contents": "\n\n".join(parts),
+        "pending": pending,
+        "verbatim": len(recent),
+        "naive_tokens": naive,
+    }
+
+
+def _system_config(cache_name: str | None, **kwargs) -> types.GenerateContentConfig:
+    if cache_name:
+        return types.GenerateContentConfig(cached_content=cache_name, **kwargs)
+    return types.GenerateContentConfig(system_instruction=SYSTEM_PROMPT, **kwargs)
+
+
+def _cached_system_name() -> str | None:
+    c = _SYSTEM_CACHE
+    if c["name"] and c["model"] == _model() and time.time() < c["expires"] - 60:
+        return c["name"]
+    return None
+
+
+async def _system_cache_async() -> str | None:
+    """
+    Name of a provider-side cache holding SYSTEM_PROMPT, created on demand.
+    Failures (e.g. prompt below the model's minimum cache size) are remembered
+    for SYSTEM_CACHE_RETRY_SECONDS and we fall back to a plain system instruction.
+    """
+    if not CACHE_SYSTEM_PROMPT:
+        return None
+    name = _cached_system_name()
+    if name:
+        return name
+    c = _SYSTEM_CACHE
+    now = time.time()
+    if now < c["retry_after"]:
+        return None
+    c["retry_after"] = now + SYSTEM_CACHE_RETRY_SECONDS
+    try:
+        cache = await client.aio.caches.create(
+            model=_model(),
+            config=types.CreateCachedContentConfig(
+                system_instruction=SYSTEM_PROMPT,
+                ttl=f"{SYSTEM_CACHE_TTL_SECONDS}s",
+                display_name="alyana-system-prompt",
+            ),
+        )
+    except Exception as e:
+        log.warning("System prompt cache unavailable, using system_instruction: %r", e)
+        return None
+    c.update(name=cache.name, model=_model(), expires=now + SYSTEM_CACHE_TTL_SECONDS, retry_after=0.0)
+    log.info("System prompt cached as %s", cache.name)
+    return cache.name
+
+
+def _record_context(ctx: dict, cached_system: bool, response=None) -> None:
+    sent = estimate_tokens(ctx["contents"]) + (0 if cached_system else estimate_tokens(SYSTEM_PROMPT))
+    naive = ctx["naive_tokens"]
+    st = CONTEXT_STATS
+    st["requests"] += 1
+    st["naive_tokens"] += naive
+    st["sent_tokens"] += sent
+    st["cached_system"] += 1 if cached_system else 0
+
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        st["prompt_tokens_reported"] += int(getattr(usage, "prompt_token_count", 0) or 0)
+        st["cached_tokens_reported"] += int(getattr(usage, "cached_content_token_count", 0) or 0)
+
+    saved = 100.0 * (naive - sent) / naive if naive else 0.0
+    log.info(
+        "context: ~%d tokens (was ~%d, %.0f%% smaller), verbatim=%s pending_summary=%d cached_system=%s",
+        sent, naive, saved, ctx["verbatim"], len(ctx["pending"]), cached_system,
     )
 
-    response = client.models.generate_content(
-        model=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
-        contents=full_prompt,
+
+def _summary_prompt(summary: str, msgs: list) -> str:
+    return (
+        f"Update the running summary of a conversation between a user and Alyana, a Bible assistant. "
+        f"Keep it under {SUMMARY_MAX_WORDS} words. Keep the user's name, personal details they shared, "
+        f"their requests and concerns, verses discussed and the language they write in. Plain text only.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\n"
+        f"New messages:\n" + "\n".join(_line(r, c) for r, c in msgs)
     )
 
-    text = (response.text or "").strip()
+
+async def _fold_summary(memory: dict, msgs: list) -> None:
+    try:
+        async with LIMITER.slot():
+            response = await _call_gemini(
+                _summary_prompt(memory.get("summary") or "", msgs),
+                types.GenerateContentConfig(max_output_tokens=400),
+                time.monotonic() + CALL_TIMEOUT_SECONDS,
+            )
+        text = (getattr(response, "text", None) or "").strip()
+        if text:
+            memory["summary"] = text
+            memory["last"] = list(msgs[-1])
+            memory["folded"] = int(memory.get("folded") or 0) + len(msgs)
+            CONTEXT_STATS["summaries"] += 1
+    except Exception as e:
+        # Busy or failing: the messages stay pending and are retried next turn.
+        CONTEXT_STATS["summary_failures"] += 1
+        log.warning("Summary update skipped: %r", e)
+    finally:
+        memory["updating"] = False
+
+
+def schedule_summary(memory: dict | None, ctx: dict) -> None:
+    """
+    Fold ctx["pending"] into memory["summary"] in the background (one update at a time per conversation).
+    """
+    if memory is None or memory.get("updating") or len(ctx["pending"]) < SUMMARY_BATCH:
+        return
+    memory["updating"] = True
+    task = asyncio.get_running_loop().create_task(_fold_summary(memory, list(ctx["pending"])))
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+
+
+# -----------------------------
+# Grounding
+# -----------------------------
+# Before generation, the message is matched against the local full-text index
+# (bible_search, bm25) and the top RAG_TOP_K verses go into the prompt verbatim,
+# so the model quotes real text instead of recalling it. Queries that run past
+# RAG_BUDGET_MS are interrupted and the turn simply goes out ungrounded.
+RAG_ENABLED = (os.getenv("RAG_GROUNDING") or "1").strip().lower() in ("1", "true", "yes", "on")
+RAG_TOP_K = int(os.getenv("RAG_TOP_K") or "5")
+RAG_MAX_TERMS = int(os.getenv("RAG_MAX_TERMS") or "8")
+RAG_BUDGET_MS = float(os.getenv("RAG_BUDGET_MS") or "10")
+RAG_VERSE_CHARS = 280
+RAG_VERSIONS = {"en": "en_default", "es": "rvr1909"}
+
+_RAG_CONNS: dict = {}
+_RAG_LOCK = threading.Lock()
+RAG_STATS = {"queries": 0, "grounded": 0, "empty": 0, "aborted": 0, "no_index": 0, "ms_total": 0.0, "ms_max": 0.0}
+
+
+def _rag_connection(lang: str):
+    """
+    (connection, lock) for the search index of this language's translation, or None.
+    Reopened when the index file is rebuilt.
+    """
+    # Imported here so agent.py stays importable without the Bible router's data.
+    from bible_api import DB_MAP, data_dir
+
+    path = bible_search.index_path_for(data_dir() / DB_MAP[RAG_VERSIONS[lang]])
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    with _RAG_LOCK:
+        cur = _RAG_CONNS.get(lang)
+        if cur is not None and cur[2] == mtime:
+            return cur[0], cur[1]
+        if cur is not None:
+            cur[0].close()
+        con = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        _RAG_CONNS[lang] = (con, threading.Lock(), mtime)
+        return con, _RAG_CONNS[lang][1]
+
+
+def retrieve_verses(prompt: str, lang: str = "auto") -> list:
+    lang = lang if lang in RAG_VERSIONS else bible_search.guess_lang(prompt)
+    conn = _rag_connection(lang)
+    if conn is None:
+        RAG_STATS["no_index"] += 1
+        return []
+    con, lock = conn
+
+    t0 = time.perf_counter()
+    deadline = t0 + RAG_BUDGET_MS / 1000.0
+    verses = []
+    with lock:
+        con.set_progress_handler(lambda: 1 if time.perf_counter() > deadline else 0, 500)
+        try:
+            verses = bible_search.top_verses(con, prompt, limit=RAG_TOP_K, max_terms=RAG_MAX_TERMS)
+        except sqlite3.OperationalError:
+            RAG_STATS["aborted"] += 1
+        finally:
+            con.set_progress_handler(None, 0)
+
+    ms = (time.perf_counter() - t0) * 1000
+    RAG_STATS["queries"] += 1
+    RAG_STATS["ms_total"] += ms
+    RAG_STATS["ms_max"] = max(RAG_STATS["ms_max"], ms)
+    RAG_STATS["grounded" if verses else "empty"] += 1
+    return verses
+
+
+def retrieve_grounding(prompt: str, lang: str = "auto") -> str:
+    """
+    Compact prompt block with the best-matching verses, or "" when disabled / nothing matched.
+    """
+    if not RAG_ENABLED:
+        return ""
+    try:
+        verses = retrieve_verses(prompt, lang)
+    except Exception as e:
+        log.warning("Grounding skipped: %r", e)
+        return ""
+    if not verses:
+        return ""
+    lines = []
+    for v in verses:
+        text = v["text"] if len(v["text"]) <= RAG_VERSE_CHARS else v["text"][:RAG_VERSE_CHARS].rstrip() + "…"
+        lines.append(f"- {v['book']} {v['chapter']}:{v['verse']} — {text}")
+    return "Relevant verses from the local Bible (quote them exactly if you use them):\n" + "\n".join(lines)
+
+
+def retrieval_stats() -> dict:
+    st = dict(RAG_STATS)
+    st["ms_avg"] = round(st.pop("ms_total") / st["queries"], 3) if st["queries"] else 0.0
+    st["ms_max"] = round(st["ms_max"], 3)
+    st["enabled"] = RAG_ENABLED
+    st["top_k"] = RAG_TOP_K
+    st["budget_ms"] = RAG_BUDGET_MS
+    return st
+
+
+# -----------------------------
+# Answer cache
+# -----------------------------
+# Context-free questions ("verses about anxiety") are answered from ANSWER_CACHE.
+# A turn qualifies when the conversation has at most ANSWER_CACHE_MAX_PRIOR earlier
+# messages, no rolling summary, and nothing personal or emotional in it.
+ANSWER_CACHE_MAX_PRIOR = int(os.getenv("ANSWER_CACHE_MAX_PRIOR") or "0")
+# Bump when build_context's layout changes, so cached answers are not reused across it.
+PROMPT_FORMAT = "3"
+
+ANSWER_CACHE = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES") or "2000"),
+    max_bytes=int(float(os.getenv("ANSWER_CACHE_MAX_MB") or "16") * 1024 * 1024),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL") or str(7 * 24 * 3600)),
+    db_path=(os.getenv("ANSWER_CACHE_DB") or "").strip() or None,
+    enabled=(os.getenv("ANSWER_CACHE") or "1").strip().lower() in ("1", "true", "yes", "on"),
+)
+
+
+def prompt_version() -> str:
+    raw = "\x1f".join([PROMPT_FORMAT, _model(), SYSTEM_PROMPT])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def answer_cache_key(prompt: str, lang: str = "auto", history: list | None = None, memory: dict | None = None) -> str | None:
+    """
+    Cache key for this turn, or None if the answer must not come from (or go to) the cache.
+    """
+    if not ANSWER_CACHE.enabled:
+        return None
+    prompt = (prompt or "").strip()
+    msgs = _clean_history(history)
+    if msgs and msgs[-1] == ("user", prompt):
+        msgs = msgs[:-1]
+
+    if (memory or {}).get("summary") or len(msgs) > ANSWER_CACHE_MAX_PRIOR:
+        ANSWER_CACHE.record_skip("context")
+        return None
+    if is_personal(prompt) or any(is_personal(c) for r, c in msgs if r == "user"):
+        ANSWER_CACHE.record_skip("personal")
+        return None
+    if not normalize_question(prompt):
+        return None
+    return AnswerCache.key(prompt, lang, prompt_version())
+
+
+def _cached_answer(key: str | None, disk: bool = True) -> str | None:
+    if not key:
+        return None
+    hit = ANSWER_CACHE.get(key, disk=disk)
+    if hit is None:
+        return None
+    log.info("answer cache hit (saved ~%.0f ms, ~%d tokens)", hit.latency_ms, hit.tokens)
+    return hit.reply
+
+
+async def _cached_answer_async(key: str | None) -> str | None:
+    # the in-memory lookup stays on the loop; a sqlite lookup (ANSWER_CACHE_DB) goes to a thread
+    cached = _cached_answer(key, disk=False)
+    if cached is None and key and ANSWER_CACHE.on_disk:
+        cached = await asyncio.to_thread(_cached_answer, key)
+    return cached
+
+
+def _store_answer(key: str | None, text: str, t0: float, ctx: dict, response=None) -> None:
+    text = (text or "").strip()
+    if not key or not text:
+        return
+    usage = getattr(response, "usage_metadata", None)
+    tokens = int(getattr(usage, "total_token_count", 0) or 0) if usage is not None else 0
+    if not tokens:
+        tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(ctx["contents"]) + estimate_tokens(text)
+    ANSWER_CACHE.put(key, text, (time.perf_counter() - t0) * 1000, tokens)
+
+
+def _reply_text(response) -> str:
+    text = (getattr(response, "text", None) or "").strip()
     if not text:
         return "I’m here with you. Please try again."
-
     return text
 
+
+def run_bible_ai(prompt: str, lang: str = "auto", history: list | None = None, memory: dict | None = None) -> str:
+    """
+    Call Gemini and return plain text.
+    history: list of dicts like: { "role": "user"|"assistant", "content": "..." }
+    memory: per-conversation dict holding the rolling summary (read-only here;
+            the async entry points refresh it).
+    """
+    key = answer_cache_key(prompt, lang, history, memory)
+    cached = _cached_answer(key)
+    if cached is not None:
+        return cached
+
+    t0 = time.perf_counter()
+    ctx = build_context(prompt, lang, history, memory, retrieve_grounding(prompt, lang))
+    cache_name = _cached_system_name() if CACHE_SYSTEM_PROMPT else None
+    response = _call_gemini_sync(ctx["contents"], cache_name)
+    _record_context(ctx, bool(cache_name), response)
+    _store_answer(key, getattr(response, "text", None), t0, ctx, response)
+    return _reply_text(response)
+
+
+class ConcurrencyLimiter:
+    """
+    asyncio semaphore with a bounded wait queue, a wait timeout and counters.
+    """
+
+    def __init__(self, limit: int, max_waiting: int, wait_timeout: float):
+        self.limit = max(1, int(limit))
+        self.max_waiting = max(0, int(max_waiting))
+        self.wait_timeout = wait_timeout
+        self._sem = asyncio.Semaphore(self.limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        # Counted before the first await, so admission is decided in arrival order.
+        if self.in_flight + self.waiting >= self.limit + self.max_waiting:
+            self.rejected += 1
+            raise ChatBusyError("Too many chats in progress.")
+
+        t0 = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.wait_timeout)
+        except asyncio.TimeoutError:
+            self.queue_timeouts += 1
+            raise ChatBusyError("Timed out waiting for a free chat slot.")
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - t0
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._sem.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_timeouts": self.queue_timeouts,
+            "wait_ms_avg": round(self.wait_total * 1000 / self.completed, 2) if self.completed else 0.0,
+            "wait_ms_max": round(self.wait_max * 1000, 2),
+        }
+
+
+LIMITER = ConcurrencyLimiter(MAX_CONCURRENCY, MAX_WAITING, QUEUE_TIMEOUT_SECONDS)
+CALL_TIMEOUTS = 0
+
+
+# -----------------------------
+# Resilience
+# -----------------------------
+# Every Gemini call goes through _call_gemini (or _call_gemini_sync): each attempt
+# gets its own deadline (ATTEMPT_TIMEOUT_SECONDS, never past the call's
+# CALL_TIMEOUT_SECONDS), 429/5xx/timeouts are retried with full-jitter exponential
+# backoff, and a circuit breaker fails fast while Gemini is down instead of letting
+# every chat wait for its timeout. With a secondary model in GEMINI_MODEL
+# ("primary,secondary"), an async attempt still waiting after HEDGE_AFTER_SECONDS
+# is raced against the same request on the secondary model; the first answer wins.
+RETRIES = int(os.getenv("GEMINI_RETRIES") or "2")
+RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE") or "0.5")
+RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX") or "8")
+ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT") or "25")
+HEDGE_AFTER_SECONDS = float(os.getenv("GEMINI_HEDGE_AFTER_MS") or "4000") / 1000
+BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES") or "5")
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN") or "30")
+
+FALLBACK_MESSAGES = {
+    "en": "Alyana is having trouble reaching her answers right now. Please try again in a minute — "
+    "in the meantime you can still read and search the Bible.",
+    "es": "Alyana tiene problemas para responder en este momento. Inténtalo de nuevo en un minuto; "
+    "mientras tanto puedes seguir leyendo y buscando en la Biblia.",
+}
+
+RESILIENCE_STATS = {
+    "attempts": 0,
+    "retries": 0,
+    "retried_429": 0,
+    "retried_5xx": 0,
+    "retried_timeout": 0,
+    "retried_network": 0,
+    "gave_up": 0,
+    "hedged": 0,
+    "hedge_wins": 0,
+}
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker: opens after `failures` failed attempts in a row,
+    fails fast for `cooldown` seconds, then lets a single probe through (half-open).
+    Thread-safe, so the sync and async paths share one.
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.threshold = max(1, int(failures))
+        self.cooldown = float(cooldown)
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opens = 0
+        self.short_circuited = 0
+        self.successes = 0
+        self.failures = 0
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.cooldown
+
+    def rejecting(self) -> bool:
+        """is_open(), counted as a short circuit when True."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at < self.cooldown:
+                self.short_circuited += 1
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    self.short_circuited += 1
+                    return False
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open":
+                if self._probing:
+                    self.short_circuited += 1
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.successes += 1
+            self.consecutive = 0
+            self._probing = False
+            if self.state != "closed":
+                log.info("Gemini circuit breaker: closed")
+            self.state = "closed"
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.consecutive += 1
+            self._probing = False
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive >= self.threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.opens += 1
+                log.warning("Gemini circuit breaker: open for %gs after %d failures", self.cooldown, self.consecutive)
+
+    def release(self) -> None:
+        """The attempt ended without telling us anything about Gemini's health (cancelled, bad request)."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": "open" if self.is_open() else ("half_open" if self.state != "closed" else "closed"),
+            "consecutive_failures": self.consecutive,
+            "retry_after_seconds": round(self.retry_after(), 1),
+            "opens": self.opens,
+            "short_circuited": self.short_circuited,
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+BREAKER = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN_SECONDS)
+
+
+def fallback_message(prompt: str = "", lang: str = "auto") -> str:
+    if lang not in FALLBACK_MESSAGES:
+        lang = bible_search.guess_lang(prompt or "")
+    return FALLBACK_MESSAGES.get(lang, FALLBACK_MESSAGES["en"])
+
+
+def _retry_reason(e: BaseException) -> str | None:
+    """'429' / '5xx' / 'timeout' / 'network' for errors worth retrying, else None."""
+    if isinstance(e, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(e, genai_errors.APIError):
+        code = getattr(e, "code", None) or 0
+        if code == 429:
+            return "429"
+        if code >= 500:
+            return "5xx"
+        return None
+    if httpx is not None and isinstance(e, httpx.TimeoutException):
+        return "timeout"
+    if httpx is not None and isinstance(e, httpx.TransportError):
+        return "network"
+    return None
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt)))
+
+
+def _fail_fast() -> None:
+    # Checked before queueing for a slot, so callers aren't kept waiting just to be refused.
+    if BREAKER.rejecting():
+        raise ChatUnavailableError("Gemini circuit breaker is open.", BREAKER.retry_after())
+
+
+def _admit() -> None:
+    if not BREAKER.allow():
+        raise ChatUnavailableError("Gemini circuit breaker is open.", BREAKER.retry_after())
+
+
+def _failed_attempt(e: Exception, attempt: int, deadline: float) -> float | None:
+    """
+    Book-keeping for a failed attempt; the backoff delay before the next one,
+    or None when the error should be raised.
+    """
+    reason = _retry_reason(e)
+    if reason is None:
+        BREAKER.release()
+        return None
+    BREAKER.record_failure()
+    delay = _backoff(attempt)
+    if attempt >= RETRIES or time.monotonic() + delay >= deadline or BREAKER.is_open():
+        RESILIENCE_STATS["gave_up"] += 1
+        return None
+    RESILIENCE_STATS["retries"] += 1
+    RESILIENCE_STATS[f"retried_{reason}"] += 1
+    log.warning("Gemini attempt %d failed (%s: %r); retrying in %.2fs", attempt + 1, reason, e, delay)
+    return delay
+
+
+def _unavailable(e: Exception) -> Exception:
+    # Timeouts keep their own type (504); other retryable errors become "unavailable" (503).
+    reason = _retry_reason(e)
+    if reason in ("429", "5xx", "network"):
+        return ChatUnavailableError(f"Gemini unavailable: {e!r}", BREAKER.retry_after() or 5.0)
+    return e
+
+
+async def _aclose(upstream) -> None:
+    if upstream is not None and hasattr(upstream, "aclose"):
+        try:
+            await upstream.aclose()
+        except Exception:
+            pass
+
+
+async def _open(model: str, contents: str, config, stream: bool):
+    """
+    One upstream attempt: the response, or (stream, iterator, first chunk or None) for streams.
+    """
+    if not stream:
+        return await client.aio.models.generate_content(model=model, contents=contents, config=config)
+    upstream = await client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+    it = upstream.__aiter__()
+    try:
+        first = await it.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        await _aclose(upstream)
+        raise
+    return upstream, it, first
+
+
+async def _hedged_attempt(contents: str, config, hedge_config, stream: bool, timeout: float):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    primary = asyncio.ensure_future(_open(_model(), contents, config, stream))
+    tasks = {primary}
+    hedge = _hedge_model()
+    hedge_at = loop.time() + HEDGE_AFTER_SECONDS if hedge and HEDGE_AFTER_SECONDS < timeout else None
+    error = None
+    try:
+        while tasks:
+            until = min(deadline, hedge_at) if hedge_at is not None else deadline
+            done, _ = await asyncio.wait(tasks, timeout=max(0.0, until - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if hedge_at is not None and loop.time() >= hedge_at:
+                    hedge_at = None
+                    RESILIENCE_STATS["hedged"] += 1
+                    tasks.add(asyncio.ensure_future(_open(hedge, contents, hedge_config, stream)))
+                    continue
+                raise asyncio.TimeoutError()
+            for t in done:
+                tasks.discard(t)
+                if t.exception() is None:
+                    if t is not primary:
+                        RESILIENCE_STATS["hedge_wins"] += 1
+                    return t.result()
+                if error is None or t is primary:
+                    error = t.exception()
+            if hedge_at is not None:
+                # The primary failed before the hedge was due: let the retry loop decide.
+                break
+        raise error
+    finally:
+        for t in tasks:
+            t.cancel()
+        for t in tasks:
+            try:
+                result = await t
+            except BaseException:
+                continue
+            if stream:
+                await _aclose(result[0])
+
+
+async def _call_gemini(contents: str, config, deadline: float, stream: bool = False, hedge_config=None):
+    """
+    Retried, breaker-guarded, optionally hedged Gemini call that must finish by
+    `deadline` (time.monotonic()). Returns the response, or for streams
+    (stream, iterator, first chunk or None).
+    """
+    attempt = 0
+    while True:
+        _admit()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            BREAKER.release()
+            raise asyncio.TimeoutError()
+        RESILIENCE_STATS["attempts"] += 1
+        try:
+            result = await _hedged_attempt(
+                contents, config, hedge_config or config, stream, min(ATTEMPT_TIMEOUT_SECONDS, remaining)
+            )
+        except asyncio.CancelledError:
+            BREAKER.release()
+            raise
+        except Exception as e:
+            delay = _failed_attempt(e, attempt, deadline)
+            if delay is None:
+                raise _unavailable(e) from e
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        BREAKER.record_success()
+        return result
+
+
+def _call_gemini_sync(contents: str, cache_name: str | None):
+    """
+    Blocking twin of _call_gemini for run_bible_ai: same deadlines, retries and
+    breaker, no hedging. The per-attempt deadline is the HTTP timeout.
+    """
+    deadline = time.monotonic() + CALL_TIMEOUT_SECONDS
+    attempt = 0
+    while True:
+        _admit()
+        remaining = deadline - time.monotonic()
+        timeout_ms = int(min(ATTEMPT_TIMEOUT_SECONDS, remaining) * 1000)
+        if timeout_ms <= 0:
+            BREAKER.release()
+            raise ChatTimeoutError(f"Gemini did not answer within {CALL_TIMEOUT_SECONDS:g}s.")
+        RESILIENCE_STATS["attempts"] += 1
+        try:
+            response = client.models.generate_content(
+                model=_model(),
+                contents=contents,
+                config=_system_config(cache_name, http_options=types.HttpOptions(timeout=timeout_ms)),
+            )
+        except Exception as e:
+            delay = _failed_attempt(e, attempt, deadline)
+            if delay is None:
+                if _retry_reason(e) == "timeout":
+                    raise ChatTimeoutError(f"Gemini did not answer within {CALL_TIMEOUT_SECONDS:g}s.") from e
+                raise _unavailable(e) from e
+            attempt += 1
+            time.sleep(delay)
+            continue
+        BREAKER.record_success()
+        return response
+
+
+def resilience_stats() -> dict:
+    st = dict(RESILIENCE_STATS)
+    st["breaker"] = BREAKER.stats()
+    st["hedge_model"] = _hedge_model()
+    st["hedge_after_ms"] = round(HEDGE_AFTER_SECONDS * 1000)
+    st["attempt_timeout_seconds"] = ATTEMPT_TIMEOUT_SECONDS
+    st["max_retries"] = RETRIES
+    return st
+
+
+# -----------------------------
+# Single-flight
+# -----------------------------
+# Identical prompts (same mode, language and normalized contents) that arrive while
+# one is already in flight share that upstream call: the first caller starts a
+# producer task, later callers subscribe to its chunks. The producer is cancelled
+# only when every subscriber has gone away.
+_INFLIGHT: dict = {}
+COALESCE_STATS = {"upstream_calls": 0, "joined": 0, "abandoned": 0}
+
+
+class _Flight:
+    __slots__ = ("key", "chunks", "done", "error", "waiters", "task", "_changed")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.waiters = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def changed(self) -> asyncio.Event:
+        return self._changed
+
+    def leave(self) -> None:
+        self.waiters -= 1
+        if self.waiters <= 0 and not self.done and self.task is not None:
+            COALESCE_STATS["abandoned"] += 1
+            if _INFLIGHT.get(self.key) is self:
+                _INFLIGHT.pop(self.key, None)
+            self.task.cancel()
+
+
+def _flight_key(mode: str, lang: str, ctx: dict) -> str:
+    raw = "\x1f".join([mode, prompt_version(), (lang or "auto").lower(), normalize_question(ctx["contents"])])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _produce(flight: _Flight, ctx: dict, answer_key: str | None, stream: bool) -> None:
+    global CALL_TIMEOUTS
+    t0 = time.perf_counter()
+    upstream = None
+    last = None
+    try:
+        cache_name = await _system_cache_async()
+        async with LIMITER.slot():
+            COALESCE_STATS["upstream_calls"] += 1
+            config = _system_config(cache_name)
+            # the provider-side cache belongs to the primary model; a hedge sends the prompt inline
+            hedge_config = _system_config(None) if cache_name else config
+            deadline = time.monotonic() + CALL_TIMEOUT_SECONDS
+            if stream:
+                upstream, it, chunk = await _call_gemini(ctx["contents"], config, deadline, True, hedge_config)
+                while chunk is not None:
+                    last = chunk
+                    text = getattr(chunk, "text", None) or ""
+                    if text:
+                        flight.chunks.append(text)
+                        flight.notify()
+                    try:
+                        chunk = await asyncio.wait_for(it.__anext__(), timeout=max(0.0, deadline - time.monotonic()))
+                    except StopAsyncIteration:
+                        chunk = None
+                    except Exception:
+                        # broke off mid-answer; too late to retry, but it says something about Gemini
+                        BREAKER.record_failure()
+                        raise
+            else:
+                last = await _call_gemini(ctx["contents"], config, deadline, False, hedge_config)
+                flight.chunks.append(_reply_text(last))
+        # The last stream chunk carries the usage totals.
+        _record_context(ctx, bool(cache_name), last)
+        _store_answer(answer_key, "".join(flight.chunks) if stream else getattr(last, "text", None), t0, ctx, last)
+    except asyncio.TimeoutError:
+        CALL_TIMEOUTS += 1
+        flight.error = ChatTimeoutError(f"Gemini did not answer within {CALL_TIMEOUT_SECONDS:g}s.")
+    except asyncio.CancelledError:
+        flight.error = ChatBusyError("Request was abandoned.")
+        raise
+    except Exception as e:
+        flight.error = e
+    finally:
+        await _aclose(upstream)
+        flight.done = True
+        flight.notify()
+        if _INFLIGHT.get(flight.key) is flight:
+            _INFLIGHT.pop(flight.key, None)
+
+
+def _join_flight(mode: str, lang: str, ctx: dict, answer_key: str | None) -> _Flight:
+    key = _flight_key(mode, lang, ctx)
+    flight = _INFLIGHT.get(key)
+    if flight is not None and not flight.done:
+        COALESCE_STATS["joined"] += 1
+    else:
+        flight = _Flight(key)
+        _INFLIGHT[key] = flight
+        flight.task = asyncio.get_running_loop().create_task(_produce(flight, ctx, answer_key, mode == "stream"))
+    flight.waiters += 1
+    return flight
+
+
+async def run_bible_ai_async(
+    prompt: str, lang: str = "auto", history: list | None = None, memory: dict | None = None
+) -> str:
+    """
+    Async twin of run_bible_ai, for use inside the event loop: uses the SDK's
+    async client, waits for one of MAX_CONCURRENCY slots and gives up after
+    CALL_TIMEOUT_SECONDS. Raises ChatBusyError / ChatTimeoutError /
+    ChatUnavailableError.
+    """
+    key = answer_cache_key(prompt, lang, history, memory)
+    cached = await _cached_answer_async(key)
+    if cached is not None:
+        return cached
+
+    _fail_fast()
+    # FTS lookups block (up to RAG_BUDGET_MS); keep them off the event loop
+    grounding = await asyncio.to_thread(retrieve_grounding, prompt, lang)
+    ctx = build_context(prompt, lang, history, memory, grounding)
+    flight = _join_flight("full", lang, ctx, key)
+    try:
+        while not flight.done:
+            await flight.changed().wait()
+    finally:
+        flight.leave()
+    if flight.error is not None:
+        raise flight.error
+    schedule_summary(memory, ctx)
+    return "".join(flight.chunks)
+
+
+async def stream_bible_ai(prompt: str, lang: str = "auto", history: list | None = None, memory: dict | None = None):
+    """
+    Streaming twin of run_bible_ai_async: yields text chunks as Gemini produces
+    them. Closing the generator unsubscribes; once no caller is listening the
+    upstream stream is closed, so abandoned generations stop there.
+    CALL_TIMEOUT_SECONDS bounds the whole stream.
+    """
+    key = answer_cache_key(prompt, lang, history, memory)
+    cached = await _cached_answer_async(key)
+    if cached is not None:
+        yield cached
+        return
+
+    _fail_fast()
+    grounding = await asyncio.to_thread(retrieve_grounding, prompt, lang)
+    ctx = build_context(prompt, lang, history, memory, grounding)
+    flight = _join_flight("stream", lang, ctx, key)
+    i = 0
+    try:
+        while True:
+            if i < len(flight.chunks):
+                i += 1
+                yield flight.chunks[i - 1]
+                continue
+            if flight.done:
+                break
+            await flight.changed().wait()
+    finally:
+        flight.leave()
+    if flight.error is not None:
+        raise flight.error
+    schedule_summary(memory, ctx)
+
+
+def coalesce_stats() -> dict:
+    st = dict(COALESCE_STATS)
+    st["in_flight"] = len(_INFLIGHT)
+    st["upstream_avoided"] = st["joined"]
+    return st
+
+
+def context_stats() -> dict:
+    st = dict(CONTEXT_STATS)
+    st["saved_pct"] = round(100.0 * (st["naive_tokens"] - st["sent_tokens"]) / st["naive_tokens"], 1) if st["naive_tokens"] else 0.0
+    st["history_budget_tokens"] = CONTEXT_HISTORY_TOKENS
+    st["system_cache"] = _cached_system_name()
+    return st
+
+
+def stats() -> dict:
+    return {
+        "model": _model(),
+        "concurrency": LIMITER.stats(),
+        "call_timeouts": CALL_TIMEOUTS,
+        "call_timeout_seconds": CALL_TIMEOUT_SECONDS,
+        "context": context_stats(),
+        "answer_cache": ANSWER_CACHE.stats(),
+        "coalescing": coalesce_stats(),
+        "retrieval": retrieval_stats(),
+        "resilience": resilience_stats(),
+    }
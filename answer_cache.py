@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, List, NamedTuple
+
+log = logging.getLogger(__name__)
+
+# Cache of whole chat answers for questions that don't depend on the conversation
+# ("verses about anxiety", "what does John 3:16 mean"). Keys are built from the
+# normalized question, the reply language and a prompt version, so changing
+# SYSTEM_PROMPT or the model naturally invalidates old answers. Entries live in an
+# in-memory LRU (TTL + entry/byte caps) and, optionally, in a sqlite file so they
+# survive restarts and are shared by workers. put() is called from the chat
+# request path, so sqlite writes are queued and committed by a background thread,
+# and a sqlite lookup never holds the lock the request path takes.
+
+_PUNCT_RE = re.compile(r"[^\w\s:]+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+# Questions that reveal something about the user, or that come from a hard moment,
+# get a fresh answer every time (and are never stored). Topics alone ("verses about
+# anxiety") are fine; the same words in the first person ("I'm so anxious") are not.
+_DISCLOSURE_RE = re.compile(
+    r"\b("
+    r"my name|me llamo|mi nombre|"
+    r"my (wife|husband|mom|mother|dad|father|son|daughter|friend|boyfriend|girlfriend|family|child|kids|baby|marriage|boss)|"
+    r"mi (esposa|esposo|madre|mam[aá]|padre|pap[aá]|hijo|hija|amigo|amiga|familia|novio|novia|beb[eé]|matrimonio|jefe)"
+    r")\b",
+    re.IGNORECASE,
+)
+_CRISIS_RE = re.compile(
+    r"\b(suicid\w*|kill myself|end my life|self harm|hurt myself|quitarme la vida|matarme|hacerme da[nñ]o)\b",
+    re.IGNORECASE,
+)
+_SELF_RE = re.compile(r"\b(i|i'm|im|i've|me|my|myself|yo|mi|mis|estoy|siento|tengo)\b", re.IGNORECASE)
+_EMOTIONAL_RE = re.compile(
+    r"\b("
+    r"anxious|anxiety|depress\w*|hopeless|griev\w*|grief|lonely|alone|scared|afraid|fear|crying|panic\w*|"
+    r"hurt\w*|broken|lost|sick|cancer|divorc\w*|abus\w*|stress\w*|worried|sad|"
+    r"ansiedad|ansios[oa]|deprim\w*|desesperad\w*|duelo|sol[oa]|miedo|llorando|p[aá]nico|triste|"
+    r"dolor|perdid[oa]|enferm[oa]|c[aá]ncer|divorcio|abus\w*|estr[eé]s|preocupad[oa]"
+    r")\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_question(text: str) -> str:
+    """
+    Lowercase, strip accents and punctuation (keeping ":" for references), collapse spaces.
+    """
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    t = _PUNCT_RE.sub(" ", t)
+    return _SPACE_RE.sub(" ", t).strip()
+
+
+def is_personal(text: str) -> bool:
+    t = text or ""
+    if _DISCLOSURE_RE.search(t) or _CRISIS_RE.search(t):
+        return True
+    return bool(_SELF_RE.search(t) and _EMOTIONAL_RE.search(t))
+
+
+class Answer(NamedTuple):
+    reply: str
+    latency_ms: float
+    tokens: int
+    created: float
+
+
+class AnswerCache:
+    """
+    Thread-safe LRU of answers with a TTL, bounded by entry count and total bytes,
+    optionally backed by a sqlite file (db_path), written every flush_seconds.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2000,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+        db_path: Optional[Path] = None,
+        enabled: bool = True,
+        flush_seconds: float = 0.5,
+    ):
+        self.enabled = enabled
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.ttl = float(ttl_seconds)
+        self.db_path = Path(db_path) if db_path else None
+        self._items: "OrderedDict[str, Answer]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()  # the writer connection (flush, clear, close)
+        self._db: Optional[sqlite3.Connection] = None
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._puts = 0
+        self.flush_seconds = max(0.01, float(flush_seconds))
+        self._pending: Dict[str, Answer] = {}
+        self._writing: Dict[str, Answer] = {}  # the batch a flush is committing
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.flush_errors = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.stores = 0
+        self.skipped: Dict[str, int] = {}
+        self.saved_ms = 0.0
+        self.saved_tokens = 0
+
+        if self.enabled and self.db_path is not None:
+            self._open_db()
+
+    def _open_db(self) -> None:
+        try:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    reply TEXT NOT NULL,
+                    latency_ms REAL NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    created REAL NOT NULL
+                )
+                """
+            )
+            con.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+            con.commit()
+            self._db = con
+        except sqlite3.Error as e:
+            log.warning("Answer cache: sqlite backing disabled: %r", e)
+            self._db = None
+            return
+        self._thread = threading.Thread(target=self._run, name="answer-cache", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def key(question: str, lang: str, version: str) -> str:
+        raw = f"{version}\x1f{(lang or 'auto').lower()}\x1f{normalize_question(question)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _size(a: Answer) -> int:
+        return len(a.reply.encode("utf-8")) + 96
+
+    def _store(self, key: str, a: Answer) -> None:
+        # caller holds the lock
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= self._size(old)
+        self._items[key] = a
+        self._bytes += self._size(a)
+        while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+            _, dropped = self._items.popitem(last=False)
+            self._bytes -= self._size(dropped)
+            self.evictions += 1
+
+    @property
+    def on_disk(self) -> bool:
+        return self._db is not None
+
+    def _reader(self) -> sqlite3.Connection:
+        con = getattr(self._local, "db", None)
+        if con is None:
+            con = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5)
+            self._local.db = con
+            with self._lock:
+                self._readers.append(con)
+        return con
+
+    def _queued(self, key: str) -> Optional[Answer]:
+        # caller holds the lock: an answer evicted before it was written
+        return self._pending.get(key) or self._writing.get(key)
+
+    def get(self, key: str, disk: bool = True) -> Optional[Answer]:
+        """
+        Memory (and queued writes) first, then the sqlite file. disk=False stops
+        before sqlite and leaves such a miss uncounted, so an async caller can
+        come back with disk=True from a worker thread (see agent._cached_answer_async).
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            a = self._items.get(key)
+            if a is not None and now - a.created > self.ttl:
+                self._items.pop(key, None)
+                self._bytes -= self._size(a)
+                self.expired += 1
+                a = None
+            if a is None:
+                a = self._queued(key)
+                if a is not None:
+                    self._store(key, a)
+            if a is not None:
+                return self._hit(key, a)
+            if self._db is None:
+                self.misses += 1
+                return None
+            if not disk:
+                return None
+
+        try:
+            row = self._reader().execute(
+                "SELECT reply, latency_ms, tokens, created FROM answers WHERE key=? AND created >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+        except sqlite3.Error:
+            row = None
+        with self._lock:
+            if not row:
+                self.misses += 1
+                return None
+            a = Answer(str(row[0]), float(row[1]), int(row[2]), float(row[3]))
+            self._store(key, a)
+            self.disk_hits += 1
+            return self._hit(key, a)
+
+    def _hit(self, key: str, a: Answer) -> Answer:
+        # caller holds the lock
+        self._items.move_to_end(key)
+        self.hits += 1
+        self.saved_ms += a.latency_ms
+        self.saved_tokens += a.tokens
+        return a
+
+    def put(self, key: str, reply: str, latency_ms: float, tokens: int) -> None:
+        if not self.enabled or not reply:
+            return
+        a = Answer(reply, float(latency_ms), int(tokens), time.time())
+        if self._size(a) > self.max_bytes:
+            return
+        with self._lock:
+            self._store(key, a)
+            self.stores += 1
+            if self._db is not None:
+                self._pending[key] = a
+                self._wake.set()
+
+    # -- background writer --
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait()
+            # let a burst of answers land in the same transaction
+            self._stop.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self) -> int:
+        """
+        Write queued answers in one transaction; returns how many were written.
+        """
+        with self._db_lock:
+            with self._lock:
+                if self._db is None or not self._pending:
+                    return 0
+                pending, self._pending = self._pending, {}
+                self._writing = pending
+            try:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO answers (key, reply, latency_ms, tokens, created) VALUES (?, ?, ?, ?, ?)",
+                        [(k, a.reply, a.latency_ms, a.tokens, a.created) for k, a in pending.items()],
+                    )
+                    before = self._puts
+                    self._puts += len(pending)
+                    if self._puts // 500 != before // 500:
+                        self._db.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+            except sqlite3.Error as e:
+                # keep the batch (behind anything newer); the next flush tries again
+                with self._lock:
+                    self._writing = {}
+                    for k, a in pending.items():
+                        self._pending.setdefault(k, a)
+                    self.flush_errors += 1
+                log.error("Answer cache: sqlite write failed: %r", e)
+                return 0
+            with self._lock:
+                self._writing = {}
+                self.flushes += 1
+            return len(pending)
+
+    def record_skip(self, reason: str) -> None:
+        with self._lock:
+            self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def clear(self) -> None:
+        with self._db_lock:
+            with self._lock:
+                self._items.clear()
+                self._pending.clear()
+                self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers")
+                self._db.commit()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for con in readers:
+            con.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "sqlite": str(self.db_path) if self._db is not None else None,
+                "pending_writes": len(self._pending) + len(self._writing),
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "skipped": dict(self.skipped),
+                "saved_ms": round(self.saved_ms, 1),
+                "saved_tokens": self.saved_tokens,
+            }
@@ -1,10 +1,31 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, List, Iterator, Sequence, Tuple
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+import bible_bundle
+import bible_related
+import bible_search
+from admin_auth import require_admin
+from bible_memory import MemoryCorpus
+from bible_refs import BookResolver, PassageRef, parse_references
+from response_cache import CachedBody, ResponseCache, dump_json
+
+log = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/bible", tags=["bible"])
 
@@ -44,9 +65,34 @@ def _data_dir() -> Path:
     return Path(__file__).resolve().parent / "data"
 
 
+_DATA_DIR: Optional[Path] = None
+
+
+def data_dir() -> Path:
+    """
+    Cached _data_dir(): the data folder does not move while the process runs,
+    so only probe the candidates until one exists.
+    """
+    global _DATA_DIR
+    if _DATA_DIR is not None:
+        return _DATA_DIR
+    d = _data_dir()
+    if d.exists():
+        _DATA_DIR = d
+    return d
+
+
 def resolve_version(version: Optional[str]) -> str:
-    v = (version or "en_default").strip()
-    return v or "en_default"
+    """
+    Canonical id for a version: aliases resolve to the first DB_MAP key for the
+    same DB ("en" -> "en_default"), so they share cache entries and ETags.
+    Unknown versions are returned as given (resolve_db_path rejects them).
+    """
+    v = (version or "en_default").strip() or "en_default"
+    filename = DB_MAP.get(v)
+    if filename:
+        return next(k for k, f in DB_MAP.items() if f == filename)
+    return v
 
 
 def resolve_db_path(version: Optional[str]) -> Path:
@@ -57,20 +103,724 @@ def resolve_db_path(version: Optional[str]) -> Path:
             status_code=400,
             detail=f"Unknown version '{v}'. Allowed: {sorted(DB_MAP.keys())}",
         )
-    return _data_dir() / filename
+    return data_dir() / filename
+
 
+# -----------------------------
+# Read-only connection pool
+# -----------------------------
+POOL_SIZE = int(os.getenv("BIBLE_POOL_SIZE") or "4")
+POOL_TIMEOUT_SECONDS = float(os.getenv("BIBLE_POOL_TIMEOUT") or "5")
+MMAP_SIZE = int(os.getenv("BIBLE_MMAP_SIZE") or str(256 * 1024 * 1024))
+CACHE_SIZE_KB = int(os.getenv("BIBLE_CACHE_SIZE_KB") or "16384")
 
-def open_db(db_path: Path) -> sqlite3.Connection:
+
+def open_ro_db(db_path: Path) -> sqlite3.Connection:
+    """
+    Open a read-only, immutable connection. The Bible DBs never change while
+    the server runs, so SQLite can skip locking and change detection.
+    """
     if not db_path.exists():
         raise HTTPException(
             status_code=404,
             detail=f"Bible DB not found at {db_path}. Make sure your data folder is deployed.",
         )
-    con = sqlite3.connect(str(db_path))
+    uri = f"{db_path.resolve().as_uri()}?mode=ro&immutable=1"
+    con = sqlite3.connect(uri, uri=True, check_same_thread=False)
     con.row_factory = sqlite3.Row
+    con.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    con.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    con.execute("PRAGMA query_only=1")
     return con
 
 
+class ReadOnlyPool:
+    """
+    Fixed-size pool of read-only connections to one sqlite file.
+    Connections are opened lazily up to `size` and handed out one thread at a time.
+    """
+
+    def __init__(self, db_path: Path, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT_SECONDS):
+        self.db_path = db_path
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._acquires = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def warm(self, n: Optional[int] = None) -> None:
+        n = self.size if n is None else min(n, self.size)
+        while True:
+            with self._lock:
+                if self._created >= n:
+                    return
+                self._created += 1
+            try:
+                self._idle.put(open_ro_db(self.db_path))
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+    def _take(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._created < self.size
+            if can_open:
+                self._created += 1
+        if can_open:
+            try:
+                return open_ro_db(self.db_path)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        t0 = time.perf_counter()
+        try:
+            con = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise HTTPException(status_code=503, detail="Bible DB busy, please retry.")
+        waited = time.perf_counter() - t0
+        with self._lock:
+            self._waits += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return con
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        con = self._take()
+        with self._lock:
+            self._acquires += 1
+            self._in_use += 1
+        try:
+            yield con
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._idle.put(con)
+
+    def close(self) -> None:
+        while True:
+            try:
+                con = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            con.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "db": self.db_path.name,
+                "size": self.size,
+                "open": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquires": self._acquires,
+                "waits": self._waits,
+                "wait_ms_total": round(self._wait_total * 1000, 3),
+                "wait_ms_avg": round(self._wait_total * 1000 / self._waits, 3) if self._waits else 0.0,
+                "wait_ms_max": round(self._wait_max * 1000, 3),
+            }
+
+
+_POOLS: Dict[str, ReadOnlyPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def pool_for_path(db_path: Path) -> ReadOnlyPool:
+    key = db_path.name
+    pool = _POOLS.get(key)
+    if pool is not None:
+        return pool
+    if not db_path.exists():
+        open_ro_db(db_path)  # raises the usual 404
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = ReadOnlyPool(db_path)
+            _POOLS[key] = pool
+    return pool
+
+
+def get_pool(version: Optional[str]) -> ReadOnlyPool:
+    return pool_for_path(resolve_db_path(version))
+
+
+@contextmanager
+def db_conn(version: Optional[str]) -> Iterator[sqlite3.Connection]:
+    with get_pool(version).connection() as con:
+        yield con
+
+
+# -----------------------------
+# Optional in-memory engine
+# -----------------------------
+# "sqlite" (default) queries the pooled connections; "memory" loads every
+# translation once at startup and serves /text, /chapters and /verses_max from RAM.
+BIBLE_ENGINE = (os.getenv("BIBLE_ENGINE") or "sqlite").strip().lower()
+
+_CORPORA: Dict[str, MemoryCorpus] = {}
+
+
+def load_corpus(version: Optional[str]) -> MemoryCorpus:
+    db_path = resolve_db_path(version)
+    corpus = _CORPORA.get(db_path.name)
+    if corpus is None:
+        t0 = time.perf_counter()
+        with db_conn(version) as con:
+            corpus = MemoryCorpus.from_connection(con)
+        _CORPORA[db_path.name] = corpus
+        log.info(
+            "Bible memory engine: loaded %s (%d verses, %.1f MB) in %.2fs",
+            db_path.name, len(corpus), corpus.memory_bytes() / 1e6, time.perf_counter() - t0,
+        )
+    return corpus
+
+
+def get_corpus(version: Optional[str]) -> Optional[MemoryCorpus]:
+    if BIBLE_ENGINE != "memory":
+        return None
+    return _CORPORA.get(resolve_db_path(version).name)
+
+
+# Build missing/stale search indexes in the background at startup (python
+# bible_search.py does it offline).
+SEARCH_AUTOBUILD = (os.getenv("BIBLE_SEARCH_AUTOBUILD") or "1").strip() not in ("0", "false", "no")
+
+# Same for the offline bundles (python bible_bundle.py).
+BUNDLE_AUTOBUILD = (os.getenv("BIBLE_BUNDLE_AUTOBUILD") or "1").strip() not in ("0", "false", "no")
+
+# The related-verses index takes tens of seconds of CPU per translation, so it is
+# built offline by default (python bible_related.py). BIBLE_RELATED_AUTOBUILD=1
+# builds it in a background thread at startup instead (one worker builds, the
+# others wait on its lock); /bible/related answers 503 until it is there.
+RELATED_AUTOBUILD = (os.getenv("BIBLE_RELATED_AUTOBUILD") or "0").strip() not in ("0", "false", "no")
+
+
+# -----------------------------
+# Book/chapter/verse outline
+# -----------------------------
+_STRUCTURES: Dict[str, Dict[str, Any]] = {}
+
+
+def _build_structure(version: Optional[str]) -> Dict[str, Any]:
+    corpus = get_corpus(version)
+    if corpus is not None:
+        names = dict(corpus.books)
+        counts = corpus.chapter_counts()
+    else:
+        with db_conn(version) as con:
+            names = {b["id"]: b["name"] for b in get_books(con)}
+            rows = con.execute(
+                "SELECT book_id, chapter, MAX(verse) AS m FROM verses GROUP BY book_id, chapter"
+            ).fetchall()
+        counts = {(int(r["book_id"]), int(r["chapter"])): int(r["m"] or 0) for r in rows}
+
+    # chapters[book_id] = [verse count of chapter 1, chapter 2, ...]; gaps stay 0
+    chapters: Dict[int, List[int]] = {}
+    for (bid, ch), m in counts.items():
+        lst = chapters.setdefault(bid, [])
+        if len(lst) < ch:
+            lst.extend([0] * (ch - len(lst)))
+        lst[ch - 1] = m
+
+    return {
+        "books": [
+            {"id": bid, "name": names.get(bid, str(bid)), "chapters": chapters.get(bid, [])}
+            for bid in sorted(set(names) | set(chapters))
+        ],
+        "chapters": chapters,
+    }
+
+
+def get_structure(version: Optional[str]) -> Dict[str, Any]:
+    """
+    Chapter count per book and verse count per chapter, computed once per translation.
+    """
+    key = resolve_db_path(version).name
+    st = _STRUCTURES.get(key)
+    if st is None:
+        st = _build_structure(version)
+        _STRUCTURES[key] = st
+    return st
+
+
+def structure_max_chapter(version: Optional[str], book_id: int) -> int:
+    return len(get_structure(version)["chapters"].get(int(book_id), ()))
+
+
+def structure_max_verse(version: Optional[str], book_id: int, chapter: int) -> int:
+    counts = get_structure(version)["chapters"].get(int(book_id), ())
+    ch = int(chapter)
+    return counts[ch - 1] if 0 < ch <= len(counts) else 0
+
+
+# -----------------------------
+# Book name resolution
+# -----------------------------
+_RESOLVERS: Dict[str, BookResolver] = {}
+
+
+def get_resolver(version: Optional[str]) -> BookResolver:
+    """
+    Alias/prefix resolver over this translation's book names plus the EN/ES alias table.
+    """
+    key = resolve_db_path(version).name
+    r = _RESOLVERS.get(key)
+    if r is None:
+        corpus = get_corpus(version)
+        if corpus is not None:
+            books = list(corpus.books.items())
+        else:
+            with db_conn(version) as con:
+                books = [(b["id"], b["name"]) for b in get_books(con)]
+        r = BookResolver(books)
+        _RESOLVERS[key] = r
+    return r
+
+
+def resolve_book_id(version: Optional[str], book_id: Optional[int], book: Optional[str]) -> int:
+    if book_id is not None:
+        return int(book_id)
+    if book:
+        resolver = get_resolver(version)
+        bid = resolver.resolve(book)
+        if bid is not None:
+            return bid
+        cands = resolver.candidates(book)
+        if len(cands) > 1:
+            names = ", ".join(c["name"] for c in cands)
+            raise HTTPException(status_code=400, detail=f"Ambiguous book '{book}'. Did you mean: {names}?")
+    raise HTTPException(status_code=400, detail="Missing book_id or book")
+
+
+# -----------------------------
+# Multi-passage lookup
+# -----------------------------
+MAX_PASSAGES = 50
+MAX_PASSAGE_VERSES = 2000
+
+
+def fetch_passages(version: Optional[str], refs: List[PassageRef]) -> List[List[Tuple[int, int, str]]]:
+    """
+    (chapter, verse, text) rows for every ref, in one memory lookup or one SQL query per call.
+    """
+    corpus = get_corpus(version)
+    if corpus is not None:
+        return [
+            corpus.passage(r.book_id, r.chapter_start, r.verse_start, r.chapter_end, r.verse_end)
+            for r in refs
+        ]
+    if not refs:
+        return []
+
+    where = " OR ".join(["(book_id=? AND chapter BETWEEN ? AND ?)"] * len(refs))
+    params: List[int] = []
+    for r in refs:
+        params.extend((r.book_id, r.chapter_start, r.chapter_end))
+    with db_conn(version) as con:
+        rows = con.execute(
+            f"SELECT book_id, chapter, verse, text FROM verses WHERE {where} ORDER BY book_id, chapter, verse",
+            params,
+        ).fetchall()
+
+    by_book: Dict[int, List[Tuple[int, int, str]]] = {}
+    for row in rows:
+        by_book.setdefault(int(row["book_id"]), []).append((int(row["chapter"]), int(row["verse"]), str(row["text"])))
+
+    out: List[List[Tuple[int, int, str]]] = []
+    for r in refs:
+        lo = (r.chapter_start, r.verse_start if r.verse_start is not None else 0)
+        hi = (r.chapter_end, r.verse_end if r.verse_end is not None else 10 ** 6)
+        out.append([v for v in by_book.get(r.book_id, ()) if lo <= (v[0], v[1]) <= hi])
+    return out
+
+
+def passages_payload(version: Optional[str], texts: List[str]) -> Dict[str, Any]:
+    resolver = get_resolver(version)
+    refs: List[PassageRef] = []
+    unresolved: List[str] = []
+    for t in texts:
+        found, bad = parse_references(t, resolver)
+        refs.extend(found)
+        unresolved.extend(bad)
+    if len(refs) > MAX_PASSAGES:
+        raise HTTPException(status_code=400, detail=f"Too many references (max {MAX_PASSAGES}).")
+
+    rows = fetch_passages(version, refs)
+    if sum(len(r) for r in rows) > MAX_PASSAGE_VERSES:
+        raise HTTPException(status_code=400, detail=f"Passages too long (max {MAX_PASSAGE_VERSES} verses).")
+
+    passages = []
+    for ref, verses in zip(refs, rows):
+        name = resolver.names.get(ref.book_id, str(ref.book_id))
+        multi = ref.chapter_end != ref.chapter_start
+        passages.append(
+            {
+                "ref": ref.label(name),
+                "source": ref.source,
+                "book_id": ref.book_id,
+                "book": name,
+                "chapter_start": ref.chapter_start,
+                "verse_start": ref.verse_start,
+                "chapter_end": ref.chapter_end,
+                "verse_end": ref.verse_end,
+                "found": bool(verses),
+                "verses": [{"chapter": c, "verse": v, "text": t} for c, v, t in verses],
+                "text": "\n".join(f"{c}:{v}. {t}" if multi else f"{v}. {t}" for c, v, t in verses),
+            }
+        )
+    return {"version": resolve_version(version), "passages": passages, "unresolved": unresolved}
+
+
+# -----------------------------
+# Parallel translations
+# -----------------------------
+# Verse alignment between translations. Each translation may ship an optional
+# "<db stem>.versification.json" in the data dir mapping its own references to
+# the canonical (en_default) numbering, e.g. {"39.3.19": "39.4.1"}; anything
+# not listed is assumed to line up one-to-one.
+MAX_PARALLEL_VERSIONS = 4
+
+_PARALLEL_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_PARALLEL_VERSIONS, thread_name_prefix="bible-parallel")
+
+VerseKey = Tuple[int, int, int]
+
+_ALIGNMENTS: Dict[str, Dict[VerseKey, VerseKey]] = {}
+
+
+def _parse_verse_key(s: str) -> VerseKey:
+    b, c, v = (int(x) for x in str(s).split("."))
+    return (b, c, v)
+
+
+def get_alignment(version: Optional[str]) -> Dict[VerseKey, VerseKey]:
+    db_path = resolve_db_path(version)
+    m = _ALIGNMENTS.get(db_path.name)
+    if m is None:
+        m = {}
+        path = db_path.with_name(db_path.stem + ".versification.json")
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            m = {_parse_verse_key(k): _parse_verse_key(v) for k, v in raw.items()}
+        _ALIGNMENTS[db_path.name] = m
+    return m
+
+
+def _aligned_chapter(version: str, book_id: int, chapter: int) -> Tuple[str, Dict[int, Tuple[str, str]]]:
+    """
+    Verses of canonical book_id:chapter in this translation:
+    (book name, {canonical verse: (own reference "c:v", text)}).
+    """
+    align = get_alignment(version)
+    chapters = {chapter}
+    for (b, c, _), (cb, cc, _) in align.items():
+        if b == book_id and cb == book_id and cc == chapter:
+            chapters.add(c)
+
+    refs = [PassageRef(book_id, c, None, c, None, "") for c in sorted(chapters)]
+    out: Dict[int, Tuple[str, str]] = {}
+    for rows in fetch_passages(version, refs):
+        for c, v, text in rows:
+            cb, cc, cv = align.get((book_id, c, v), (book_id, c, v))
+            if cb == book_id and cc == chapter:
+                out[cv] = (f"{c}:{v}", text)
+    name = get_resolver(version).names.get(book_id, str(book_id))
+    return name, out
+
+
+def parallel_payload(versions: List[str], book_id: Optional[int], book: Optional[str], chapter: int) -> Dict[str, Any]:
+    # Book ids are canonical in every DB, so any translation's resolver can name the book
+    # ("Juan" works when reading en_default next to rvr1909).
+    bid: Optional[int] = int(book_id) if book_id is not None else None
+    if bid is None:
+        for v in versions:
+            bid = get_resolver(v).resolve(book or "")
+            if bid is not None:
+                break
+    if bid is None:
+        bid = resolve_book_id(versions[0], None, book)  # raises with candidates
+
+    results = list(_PARALLEL_EXECUTOR.map(lambda v: _aligned_chapter(v, bid, chapter), versions))
+    if not any(verses for _, verses in results):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    numbers = sorted({n for _, verses in results for n in verses})
+    rows = []
+    for n in numbers:
+        texts: Dict[str, Optional[str]] = {}
+        refs: Dict[str, str] = {}
+        for v, (_, verses) in zip(versions, results):
+            hit = verses.get(n)
+            texts[v] = hit[1] if hit else None
+            if hit and hit[0] != f"{chapter}:{n}":
+                refs[v] = hit[0]
+        row: Dict[str, Any] = {"verse": n, "texts": texts}
+        if refs:
+            row["refs"] = refs
+        rows.append(row)
+
+    return {
+        "versions": versions,
+        "book_id": bid,
+        "books": {v: name for v, (name, _) in zip(versions, results)},
+        "chapter": int(chapter),
+        "verses": rows,
+    }
+
+
+# -----------------------------
+# Bulk export
+# -----------------------------
+EXPORT_BATCH = 500
+
+
+def _export_rows(
+    version: Optional[str],
+    book_start: int,
+    book_end: int,
+    after: Optional[VerseKey],
+) -> Iterator[Tuple[int, int, int, str]]:
+    corpus = get_corpus(version)
+    if corpus is not None:
+        yield from corpus.iter_rows(book_start, book_end, after)
+        return
+
+    # Own connection rather than a pooled one: a slow client can hold the stream open for minutes.
+    con = open_ro_db(resolve_db_path(version))
+    try:
+        sql = "SELECT book_id, chapter, verse, text FROM verses WHERE book_id BETWEEN ? AND ?"
+        params: List[int] = [book_start, book_end]
+        if after is not None:
+            sql += " AND (book_id, chapter, verse) > (?, ?, ?)"
+            params.extend(after)
+        cur = con.execute(sql + " ORDER BY book_id, chapter, verse", params)
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            for r in rows:
+                yield int(r[0]), int(r[1]), int(r[2]), str(r[3])
+    finally:
+        con.close()
+
+
+def export_ndjson(
+    version: Optional[str],
+    book_start: int,
+    book_end: int,
+    after: Optional[VerseKey] = None,
+) -> Iterator[bytes]:
+    """
+    One JSON object per line, in EXPORT_BATCH-line chunks. Each line carries its
+    "key" ("book.chapter.verse"), which is the resume token for ?after=.
+    """
+    names = get_resolver(version).names
+    batch: List[str] = []
+    for b, c, v, text in _export_rows(version, book_start, book_end, after):
+        batch.append(
+            json.dumps(
+                {"key": f"{b}.{c}.{v}", "book_id": b, "book": names.get(b, str(b)), "chapter": c, "verse": v, "text": text},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        )
+        if len(batch) >= EXPORT_BATCH:
+            yield ("\n".join(batch) + "\n").encode("utf-8")
+            batch = []
+    if batch:
+        yield ("\n".join(batch) + "\n").encode("utf-8")
+
+
+# -----------------------------
+# HTTP caching
+# -----------------------------
+# Bible responses only change when a DB file changes (i.e. on deploy), so each
+# one gets a strong ETag derived from the DB content hash plus the normalized
+# request, and the serialized + compressed body is kept in an in-process LRU.
+# Bump CACHE_FORMAT when a response shape changes without the DB changing.
+CACHE_FORMAT = "1"
+CACHE_MAX_AGE = int(os.getenv("BIBLE_CACHE_MAX_AGE") or str(60 * 60 * 24 * 7))
+CACHE_CONTROL = f"public, max-age={CACHE_MAX_AGE}, stale-while-revalidate={60 * 60 * 24}"
+
+RESPONSE_CACHE = ResponseCache(
+    max_entries=int(os.getenv("BIBLE_CACHE_ENTRIES") or "2048"),
+    max_bytes=int(os.getenv("BIBLE_CACHE_BYTES") or str(64 * 1024 * 1024)),
+)
+
+_DB_HASHES: Dict[str, str] = {}
+_DB_HASHES_LOCK = threading.Lock()
+
+
+def db_content_hash(db_path: Path) -> str:
+    """
+    sha256 of the DB file, computed once per process.
+    """
+    key = db_path.name
+    h = _DB_HASHES.get(key)
+    if h is not None:
+        return h
+    with _DB_HASHES_LOCK:
+        h = _DB_HASHES.get(key)
+        if h is None:
+            digest = hashlib.sha256()
+            with open(db_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            h = digest.hexdigest()
+            _DB_HASHES[key] = h
+    return h
+
+
+def _cache_key(request: Request, version: Optional[str]) -> str:
+    params = sorted((k, v) for k, v in request.query_params.multi_items() if k != "version")
+    query = "&".join(f"{k}={v}" for k, v in params)
+    return f"{request.url.path}?version={resolve_version(version)}&{query}"
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+
+def cached_json(
+    request: Request,
+    version: Optional[str],
+    build: Callable[[], Dict[str, Any]],
+    extra_versions: Sequence[str] = (),
+) -> Response:
+    """
+    Serve build()'s JSON through the ETag/LRU cache. 304 when the client already has it;
+    errors raised by build() are never cached. extra_versions lists any other
+    translations the response is built from.
+    """
+    hashes = []
+    for v in (version, *extra_versions):
+        db_path = resolve_db_path(v)
+        if not db_path.exists():
+            open_ro_db(db_path)  # raises the usual 404
+        hashes.append(db_content_hash(db_path))
+
+    key = _cache_key(request, version)
+    digest = hashlib.sha256(f"{CACHE_FORMAT}:{','.join(hashes)}:{key}".encode("utf-8")).hexdigest()
+    etag = f'"{digest[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+
+    if _etag_matches(request.headers.get("if-none-match") or "", etag):
+        known = RESPONSE_CACHE.peek(key)
+        RESPONSE_CACHE.record_not_modified(len(known.raw) if known else 0)
+        return Response(status_code=304, headers=headers)
+
+    item = RESPONSE_CACHE.get(key)
+    if item is None or item.etag != etag:
+        item = CachedBody(etag, dump_json(build()))
+        RESPONSE_CACHE.put(key, item)
+
+    body, encoding = item.encoded(request.headers.get("accept-encoding") or "")
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    RESPONSE_CACHE.record_sent(len(item.raw), len(body))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def startup() -> None:
+    """
+    Called once by the app on startup: open the pools for every DB that is deployed
+    (and load the memory engine when BIBLE_ENGINE=memory), then start the background
+    build of missing search indexes, offline bundles and related indexes.
+    """
+    for filename in sorted(set(DB_MAP.values())):
+        if not (data_dir() / filename).exists():
+            log.warning("Bible DB missing, skipping pool: %s", filename)
+            continue
+        version = _version_for_file(filename)
+        try:
+            get_pool(version).warm()
+            if BIBLE_ENGINE == "memory":
+                load_corpus(version)
+            get_structure(version)
+            get_resolver(version)
+            db_content_hash(data_dir() / filename)
+        except Exception as e:
+            log.error("Bible startup failed for %s: %r", filename, e)
+
+    if SEARCH_AUTOBUILD or BUNDLE_AUTOBUILD or RELATED_AUTOBUILD:
+        threading.Thread(target=_autobuild, name="bible-index-build", daemon=True).start()
+
+
+def _autobuild() -> None:
+    """
+    Build missing/stale indexes and bundles off the request path, search first
+    (quick, and /bible/search needs it). Each build holds its file's lock, so with
+    several workers one builds and the others find it current.
+    """
+    steps = []
+    if SEARCH_AUTOBUILD:
+        steps.append(("search index", bible_search.ensure_index))
+    if BUNDLE_AUTOBUILD:
+        steps.append(("offline bundle", bible_bundle.ensure_bundle))
+    if RELATED_AUTOBUILD:
+        steps.append(("related-verses index", bible_related.ensure_related))
+    for what, ensure in steps:
+        for filename in sorted(set(DB_MAP.values())):
+            db_path = data_dir() / filename
+            if not db_path.exists():
+                continue
+            try:
+                info = ensure(db_path)
+                if info:
+                    log.info("Bible %s built: %s", what, info)
+            except Exception as e:
+                log.error("Bible %s build failed for %s: %r", what, filename, e)
+
+
+def shutdown() -> None:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for p in pools:
+        p.close()
+    _CORPORA.clear()
+    _STRUCTURES.clear()
+    _RESOLVERS.clear()
+    _ALIGNMENTS.clear()
+    _CANONICAL_TO_OWN.clear()
+    RESPONSE_CACHE.clear()
+
+
+def _version_for_file(filename: str) -> str:
+    for k, v in DB_MAP.items():
+        if v == filename:
+            return k
+    return filename
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    return [p.stats() for p in list(_POOLS.values())]
+
+
+def memory_stats() -> List[Dict[str, Any]]:
+    return [{"db": name, **c.stats()} for name, c in list(_CORPORA.items())]
+
+
 def verse_count(con: sqlite3.Connection) -> int:
     row = con.execute("SELECT COUNT(*) AS c FROM verses").fetchone()
     return int(row["c"]) if row else 0
@@ -81,89 +831,112 @@ def get_books(con: sqlite3.Connection) -> List[Dict[str, Any]]:
     return [{"id": int(r["id"]), "name": str(r["name"])} for r in rows]
 
 
-def get_book_id_by_name(con: sqlite3.Connection, book_name: str) -> Optional[int]:
-    name = (book_name or "").strip()
-    if not name:
-        return None
+def text_payload(
+    version: Optional[str],
+    book_id: Optional[int],
+    book: Optional[str],
+    chapter: int,
+    verse_start: Optional[int] = None,
+    verse_end: Optional[int] = None,
+    whole_chapter: bool = False,
+) -> Dict[str, Any]:
+    vs: Optional[int] = None
+    ve: Optional[int] = None
+    if not (whole_chapter or (verse_start is None and verse_end is None)):
+        vs = int(verse_start) if verse_start is not None else 1
+        ve = int(verse_end) if verse_end is not None else vs
+        if ve < vs:
+            vs, ve = ve, vs
 
-    row = con.execute(
-        "SELECT id FROM books WHERE LOWER(name)=LOWER(?) LIMIT 1",
-        (name,),
-    ).fetchone()
-    if row:
-        return int(row["id"])
+    bid = resolve_book_id(version, book_id, book)
 
-    row = con.execute(
-        "SELECT id FROM books WHERE LOWER(name) LIKE LOWER(?) LIMIT 1",
-        (f"%{name}%",),
-    ).fetchone()
-    if row:
-        return int(row["id"])
+    corpus = get_corpus(version)
+    if corpus is not None:
+        lo, hi = corpus.span(bid, chapter, vs, ve)
+        if hi <= lo:
+            raise HTTPException(status_code=404, detail="Not Found")
 
-    return None
+        book_name = corpus.book_name(bid) or str(bid)
+        verses = corpus.verses(lo, hi)
+        text_joined = corpus.joined(lo, hi)
+    else:
+        with db_conn(version) as con:
+            if vs is None:
+                rows = con.execute(
+                    """
+                    SELECT verse, text
+                    FROM verses
+                    WHERE book_id=? AND chapter=?
+                    ORDER BY verse
+                    """,
+                    (bid, chapter),
+                ).fetchall()
+            else:
+                rows = con.execute(
+                    """
+                    SELECT verse, text
+                    FROM verses
+                    WHERE book_id=? AND chapter=? AND verse BETWEEN ? AND ?
+                    ORDER BY verse
+                    """,
+                    (bid, chapter, vs, ve),
+                ).fetchall()
 
+            if not rows:
+                raise HTTPException(status_code=404, detail="Not Found")
 
-def get_max_chapter(con: sqlite3.Connection, book_id: int) -> int:
-    row = con.execute(
-        "SELECT MAX(chapter) AS m FROM verses WHERE book_id=?",
-        (book_id,),
-    ).fetchone()
-    m = row["m"] if row else None
-    return int(m) if m is not None else 0
+            b = con.execute("SELECT name FROM books WHERE id=? LIMIT 1", (bid,)).fetchone()
+            book_name = str(b["name"]) if b else str(bid)
 
+        verses = [{"verse": int(r["verse"]), "text": str(r["text"])} for r in rows]
+        text_joined = "\n".join([f"{v['verse']}. {v['text']}" for v in verses])
 
-def get_max_verse(con: sqlite3.Connection, book_id: int, chapter: int) -> int:
-    row = con.execute(
-        "SELECT MAX(verse) AS m FROM verses WHERE book_id=? AND chapter=?",
-        (book_id, chapter),
-    ).fetchone()
-    m = row["m"] if row else None
-    return int(m) if m is not None else 0
+    return {
+        "version": resolve_version(version),
+        "book_id": bid,
+        "book": book_name,
+        "chapter": int(chapter),
+        "verses": verses,
+        "text": text_joined,
+    }
 
 
 @router.get("/status")
-def bible_status(version: Optional[str] = Query(default="en_default")) -> Dict[str, Any]:
-    db_path = resolve_db_path(version)
-    con = open_db(db_path)
-    try:
-        c = verse_count(con)
-        return {
-            "status": "ok",
-            "version": resolve_version(version),
-            "db_path": str(db_path),
-            "verse_count": c,
-        }
-    finally:
-        con.close()
+def bible_status(request: Request, version: Optional[str] = Query(default="en_default")) -> Response:
+    def build() -> Dict[str, Any]:
+        db_path = resolve_db_path(version)
+        with db_conn(version) as con:
+            c = verse_count(con)
+            return {
+                "status": "ok",
+                "version": resolve_version(version),
+                "db_path": str(db_path),
+                "verse_count": c,
+            }
+
+    return cached_json(request, version, build)
 
 
 @router.get("/books")
-def bible_books(version: Optional[str] = Query(default="en_default")) -> Dict[str, Any]:
-    db_path = resolve_db_path(version)
-    con = open_db(db_path)
-    try:
-        books = get_books(con)
-        return {"version": resolve_version(version), "books": books}
-    finally:
-        con.close()
+def bible_books(request: Request, version: Optional[str] = Query(default="en_default")) -> Response:
+    def build() -> Dict[str, Any]:
+        with db_conn(version) as con:
+            books = get_books(con)
+            return {"version": resolve_version(version), "books": books}
+
+    return cached_json(request, version, build)
 
 
 @router.get("/chapters")
 def bible_chapters(
+    request: Request,
     version: Optional[str] = Query(default="en_default"),
     book_id: Optional[int] = Query(default=None),
     book: Optional[str] = Query(default=None),
-) -> Dict[str, Any]:
-    db_path = resolve_db_path(version)
-    con = open_db(db_path)
-    try:
-        bid = book_id
-        if bid is None and book:
-            bid = get_book_id_by_name(con, book)
-        if bid is None:
-            raise HTTPException(status_code=400, detail="Missing book_id or book")
-
-        max_ch = get_max_chapter(con, int(bid))
+) -> Response:
+    def build() -> Dict[str, Any]:
+        bid = resolve_book_id(version, book_id, book)
+        max_ch = structure_max_chapter(version, bid)
         if max_ch <= 0:
             raise HTTPException(status_code=404, detail="Book not found (no chapters)")
 
@@ -172,29 +945,41 @@ def bible_chapters(
             "book_id": int(bid),
             "chapters": list(range(1, max_ch + 1)),
         }
-    finally:
-        con.close()
+
+    return cached_json(request, version, build)
 
 
 @router.get("/verses_max")
 def bible_verses_max(
+    request: Request,
     version: Optional[str] = Query(default="en_default"),
     book_id: int = Query(..., ge=1),
     chapter: int = Query(..., ge=1),
-) -> Dict[str, Any]:
-    db_path = resolve_db_path(version)
-    con = open_db(db_path)
-    try:
-        m = get_max_verse(con, int(book_id), int(chapter))
+) -> Response:
+    def build() -> Dict[str, Any]:
+        m = structure_max_verse(version, int(book_id), int(chapter))
         if m <= 0:
             raise HTTPException(status_code=404, detail="Not Found")
         return {"version": resolve_version(version), "book_id": int(book_id), "chapter": int(chapter), "max_verse": m}
-    finally:
-        con.close()
+
+    return cached_json(request, version, build)
+
+
+@router.get("/structure")
+def bible_structure(request: Request, version: Optional[str] = Query(default="en_default")) -> Response:
+    """
+    Whole outline in one response: books[i].chapters[c - 1] is the verse count of chapter c.
+    """
+    return cached_json(
+        request,
+        version,
+        lambda: {"version": resolve_version(version), "books": get_structure(version)["books"]},
+    )
 
 
 @router.get("/text")
 def bible_text(
+    request: Request,
     version: Optional[str] = Query(default="en_default"),
     book_id: Optional[int] = Query(default=None),
     book: Optional[str] = Query(default=None),
@@ -202,63 +987,362 @@ def bible_text(
     verse_start: Optional[int] = Query(default=None, ge=1),
     verse_end: Optional[int] = Query(default=None, ge=1),
     whole_chapter: bool = Query(default=False),
-) -> Dict[str, Any]:
+) -> Response:
+    return cached_json(
+        request,
+        version,
+        lambda: text_payload(version, book_id, book, chapter, verse_start, verse_end, whole_chapter),
+    )
+
+
+@router.get("/parallel")
+def bible_parallel(
+    request: Request,
+    versions: str = Query(default="en_default,rvr1909"),
+    book_id: Optional[int] = Query(default=None),
+    book: Optional[str] = Query(default=None),
+    chapter: int = Query(..., ge=1),
+) -> Response:
+    """
+    One chapter in several translations, aligned by verse:
+    verses[i].texts[version] (None where a translation has no such verse).
+    """
+    wanted: List[str] = []
+    for v in versions.split(","):
+        v = resolve_version(v)
+        resolve_db_path(v)  # 400 for unknown versions
+        if v not in wanted:
+            wanted.append(v)
+    if not 1 <= len(wanted) <= MAX_PARALLEL_VERSIONS:
+        raise HTTPException(status_code=400, detail=f"Give 1-{MAX_PARALLEL_VERSIONS} versions.")
+
+    return cached_json(
+        request,
+        wanted[0],
+        lambda: parallel_payload(wanted, book_id, book, chapter),
+        extra_versions=wanted[1:],
+    )
+
+
+@router.get("/export")
+def bible_export(
+    version: Optional[str] = Query(default="en_default"),
+    book_id: Optional[int] = Query(default=None, ge=1),
+    book: Optional[str] = Query(default=None),
+    testament: Optional[str] = Query(default=None, pattern="^(?i:ot|nt|old|new|at|antiguo|nuevo)$"),
+    after: Optional[str] = Query(default=None, pattern=r"^\d+\.\d+\.\d+$"),
+) -> StreamingResponse:
+    """
+    Stream a book, a testament or the whole translation as NDJSON.
+    To resume an interrupted download, pass the last received "key" as ?after=.
+    """
+    bid = resolve_book_id(version, book_id, book) if (book_id is not None or book) else None
+    if bid is not None:
+        book_start, book_end = bid, bid
+    else:
+        book_start, book_end = bible_search.testament_books(testament) or (1, 999)
+    after_key = _parse_verse_key(after) if after else None
+
+    resolve_db_path(version)
+    filename = resolve_version(version) + (f"-{bid}" if bid else f"-{testament.lower()}" if testament else "")
+    return StreamingResponse(
+        export_ndjson(version, book_start, book_end, after_key),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.ndjson"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+_BUNDLE_FILE_RE = re.compile(r"^\d+\.[0-9a-f]{12}\.jsonl\.gz$")
+
+
+def _bundle_not_built(version: str) -> HTTPException:
+    hint = "It is being built; try again shortly." if BUNDLE_AUTOBUILD else "Run `python bible_bundle.py` to create it."
+    return HTTPException(status_code=503, detail=f"Offline bundle for {resolve_version(version)} not built. {hint}")
+
+
+@router.get("/bundle/manifest")
+def bible_bundle_manifest(request: Request, version: Optional[str] = Query(default="en_default")) -> Response:
+    """
+    Current offline bundle for a translation. Clients revalidate with If-None-Match.
+    """
     db_path = resolve_db_path(version)
-    con = open_db(db_path)
+    manifest = bible_bundle.read_manifest(db_path)
+    if manifest is None:
+        raise _bundle_not_built(version)
+
+    etag = f'"{manifest["bundle"]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match") or "", etag):
+        return Response(status_code=304, headers=headers)
+
+    base = f"{request.url.path.rsplit('/', 1)[0]}/{resolve_version(version)}/"
+    body = {
+        "version": resolve_version(version),
+        "bundle": manifest["bundle"],
+        "bytes": manifest["bytes"],
+        "base_url": base,
+        "books": manifest["books"],
+    }
+    return Response(content=dump_json(body), media_type="application/json", headers=headers)
+
+
+@router.get("/bundle/delta")
+def bible_bundle_delta(
+    version: Optional[str] = Query(default="en_default"),
+    from_bundle: Optional[str] = Query(default=None, alias="from", pattern="^[0-9a-f]{16}$"),
+) -> Dict[str, Any]:
+    """
+    Books that changed since bundle `from` (all books if the server no longer knows it).
+    """
     try:
-        bid = book_id
-        if bid is None and book:
-            bid = get_book_id_by_name(con, book)
-        if bid is None:
-            raise HTTPException(status_code=400, detail="Missing book_id or book")
+        d = bible_bundle.delta(resolve_db_path(version), from_bundle)
+    except FileNotFoundError:
+        raise _bundle_not_built(version)
+    return {"version": resolve_version(version), **d}
 
-        bid = int(bid)
 
-        if whole_chapter or (verse_start is None and verse_end is None):
-            rows = con.execute(
-                """
-                SELECT verse, text
-                FROM verses
-                WHERE book_id=? AND chapter=?
-                ORDER BY verse
-                """,
-                (bid, chapter),
-            ).fetchall()
-        else:
-            vs = int(verse_start) if verse_start is not None else 1
-            ve = int(verse_end) if verse_end is not None else vs
-            if ve < vs:
-                vs, ve = ve, vs
+@router.get("/bundle/{version}/{filename}")
+def bible_bundle_file(version: str, filename: str) -> FileResponse:
+    """
+    One book as gzipped JSON lines: [chapter, verse, text] per line. Content-addressed, so immutable.
+    """
+    if not _BUNDLE_FILE_RE.match(filename):
+        raise HTTPException(status_code=400, detail="Invalid bundle file")
+    path = bible_bundle.bundle_dir_for(resolve_db_path(version)) / filename
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Not Found")
+    return FileResponse(
+        str(path),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Encoding": "gzip",
+            "Cache-Control": "public, max-age=31536000, immutable",
+        },
+    )
 
-            rows = con.execute(
-                """
-                SELECT verse, text
-                FROM verses
-                WHERE book_id=? AND chapter=? AND verse BETWEEN ? AND ?
-                ORDER BY verse
-                """,
-                (bid, chapter, vs, ve),
-            ).fetchall()
 
-        if not rows:
-            raise HTTPException(status_code=404, detail="Not Found")
+@router.get("/resolve")
+def bible_resolve(
+    name: str = Query(..., min_length=1, max_length=60),
+    version: Optional[str] = Query(default="en_default"),
+    limit: int = Query(default=5, ge=1, le=20),
+) -> Dict[str, Any]:
+    resolver = get_resolver(version)
+    return {
+        "version": resolve_version(version),
+        "name": name,
+        "book_id": resolver.resolve(name),
+        "candidates": resolver.candidates(name, limit=limit),
+    }
 
-        b = con.execute("SELECT name FROM books WHERE id=? LIMIT 1", (bid,)).fetchone()
-        book_name = str(b["name"]) if b else str(bid)
 
-        verses = [{"verse": int(r["verse"]), "text": str(r["text"])} for r in rows]
-        text_joined = "\n".join([f"{v['verse']}. {v['text']}" for v in verses])
+@router.get("/passages")
+def bible_passages(
+    request: Request,
+    ref: str = Query(..., min_length=1, max_length=2000),
+    version: Optional[str] = Query(default="en_default"),
+) -> Response:
+    """
+    Free-form reference list, e.g. ref=John 3:16-18; Rom 8:28, 38-39; Ps 23
+    """
+    return cached_json(request, version, lambda: passages_payload(version, [ref]))
 
-        return {
-            "version": resolve_version(version),
-            "book_id": bid,
-            "book": book_name,
-            "chapter": int(chapter),
-            "verses": verses,
-            "text": text_joined,
+
+@router.post("/passages")
+def bible_passages_post(body: Dict[str, Any] = Body(...)) -> Dict[str, Any]:
+    """
+    {"refs": ["John 3:16", "Ps 23"], "version": "en_default"} (or a single "ref" string).
+    """
+    version = body.get("version") or "en_default"
+    refs = body.get("refs")
+    if refs is None:
+        refs = [body.get("ref") or ""]
+    if isinstance(refs, str):
+        refs = [refs]
+    if not isinstance(refs, list) or not all(isinstance(r, str) for r in refs):
+        raise HTTPException(status_code=400, detail="refs must be a list of strings")
+    if not any(r.strip() for r in refs):
+        raise HTTPException(status_code=400, detail="Missing refs")
+    return passages_payload(str(version), refs)
+
+
+@router.get("/search")
+def bible_search_endpoint(
+    q: str = Query(..., min_length=1, max_length=200),
+    version: Optional[str] = Query(default="en_default"),
+    book_id: Optional[int] = Query(default=None, ge=1),
+    book: Optional[str] = Query(default=None),
+    testament: Optional[str] = Query(default=None, pattern="^(?i:ot|nt|old|new|at|antiguo|nuevo)$"),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0, le=10000),
+) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    db_path = resolve_db_path(version)
+    index_path = bible_search.index_path_for(db_path)
+    if not index_path.exists():
+        hint = "It is being built; try again shortly." if SEARCH_AUTOBUILD else "Run `python bible_search.py` to create it."
+        raise HTTPException(status_code=503, detail=f"Search index not built. {hint}")
+
+    bid = resolve_book_id(version, book_id, book) if (book_id is not None or book) else None
+
+    with pool_for_path(index_path).connection() as con:
+        found = bible_search.search(con, q, book_id=bid, testament=testament, limit=limit, offset=offset)
+
+    return {
+        "version": resolve_version(version),
+        "q": q,
+        "book_id": bid,
+        "testament": testament,
+        "limit": limit,
+        "offset": offset,
+        "total": found["total"],
+        "results": found["results"],
+        "took_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+
+
+_CANONICAL_TO_OWN: Dict[str, Dict[VerseKey, VerseKey]] = {}
+
+
+def _to_canonical(version: Optional[str], key: VerseKey) -> VerseKey:
+    return get_alignment(version).get(key, key)
+
+
+def _from_canonical(version: Optional[str], key: VerseKey) -> VerseKey:
+    name = resolve_db_path(version).name
+    inverse = _CANONICAL_TO_OWN.get(name)
+    if inverse is None:
+        inverse = {canon: own for own, canon in get_alignment(version).items()}
+        _CANONICAL_TO_OWN[name] = inverse
+    return inverse.get(key, key)
+
+
+def _related_index(version: str) -> Path:
+    path = bible_related.related_path_for(resolve_db_path(version))
+    if not path.exists():
+        hint = "It is being built; try again shortly." if RELATED_AUTOBUILD else "Run `python bible_related.py` to create it."
+        raise HTTPException(status_code=503, detail=f"Related-verses index for {resolve_version(version)} not built. {hint}")
+    return path
+
+
+def related_payload(
+    version: Optional[str],
+    book_id: Optional[int],
+    book: Optional[str],
+    chapter: int,
+    verse: int,
+    limit: int,
+    also: Sequence[str] = (),
+) -> Dict[str, Any]:
+    """
+    Neighbours of one verse from `version`'s index. With `also`, the indexes of
+    those translations are merged in on canonical (book, chapter, verse) keys, the
+    same alignment /parallel uses: a verse's score is its mean over the
+    translations (0 where one doesn't list it), and every result carries its text
+    in each translation.
+    """
+    versions = [resolve_version(version), *also]
+    bid = resolve_book_id(version, book_id, book)
+    origin = _to_canonical(version, (bid, chapter, verse))
+
+    scores: Dict[VerseKey, float] = {}
+    found_in: Dict[VerseKey, List[str]] = {}
+    for v in versions:
+        path = _related_index(v)
+        own = _from_canonical(v, origin)
+        with pool_for_path(path).connection() as con:
+            found = bible_related.neighbours(con, own[0], own[1], own[2], bible_related.RELATED_TOP_N if also else limit)
+        for b, c, vs, score in found:
+            key = _to_canonical(v, (b, c, vs))
+            scores[key] = scores.get(key, 0.0) + score
+            found_in.setdefault(key, []).append(v)
+    best = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+
+    texts: Dict[str, List[List[Tuple[int, int, str]]]] = {}
+    for v in versions:
+        refs = []
+        for key, _ in best:
+            b, c, vs = _from_canonical(v, key)
+            refs.append(PassageRef(b, c, vs, c, vs, ""))
+        texts[v] = fetch_passages(v, refs)
+
+    names = get_resolver(version).names
+    results = []
+    for i, (key, score) in enumerate(best):
+        primary = texts[versions[0]][i]
+        if not primary and not also:
+            continue
+        b, c, vs = _from_canonical(version, key)
+        item: Dict[str, Any] = {
+            "book_id": b,
+            "book": names.get(b, str(b)),
+            "chapter": c,
+            "verse": vs,
+            "text": primary[0][2] if primary else None,
+            "score": round(score / len(versions), 4),
         }
-    finally:
-        con.close()
+        if also:
+            item["texts"] = {v: (texts[v][i][0][2] if texts[v][i] else None) for v in versions}
+            item["found_in"] = found_in[key]
+        results.append(item)
+    out = {
+        "version": versions[0],
+        "book_id": bid,
+        "book": names.get(bid, str(bid)),
+        "chapter": chapter,
+        "verse": verse,
+        "results": results,
+    }
+    if also:
+        out["versions"] = versions
+    return out
+
+
+@router.get("/related")
+def bible_related_endpoint(
+    request: Request,
+    version: Optional[str] = Query(default="en_default"),
+    book_id: Optional[int] = Query(default=None, ge=1),
+    book: Optional[str] = Query(default=None),
+    chapter: int = Query(..., ge=1),
+    verse: int = Query(..., ge=1),
+    limit: int = Query(default=10, ge=1, le=bible_related.RELATED_TOP_N),
+    also: Optional[str] = Query(default=None, description="other translations to merge in, e.g. rvr1909"),
+) -> Response:
+    """
+    Verses elsewhere in the Bible that share the most distinctive words with this one,
+    within one translation or (with ?also=) across several.
+    """
+    extra: List[str] = []
+    seen = {resolve_db_path(version)}
+    for v in (also or "").split(","):
+        if not v.strip():
+            continue
+        v = resolve_version(v)
+        path = resolve_db_path(v)  # 400 for unknown versions
+        if path not in seen:
+            seen.add(path)
+            extra.append(v)
+    if len(extra) + 1 > MAX_PARALLEL_VERSIONS:
+        raise HTTPException(status_code=400, detail=f"Give at most {MAX_PARALLEL_VERSIONS} versions.")
 
+    return cached_json(
+        request,
+        version,
+        lambda: related_payload(version, book_id, book, chapter, verse, limit, extra),
+        extra_versions=extra,
+    )
 
 
+@router.get("/stats", dependencies=[Depends(require_admin)])
+def bible_stats() -> Dict[str, Any]:
+    return {
+        "ok": True,
+        "engine": BIBLE_ENGINE,
+        "pools": pool_stats(),
+        "memory": memory_stats(),
+        "cache": RESPONSE_CACHE.stats(),
+    }
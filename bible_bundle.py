@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from bible_search import build_lock, source_signature, temp_path_for
+
+# Offline bundles for the service worker.
+#
+# Each translation is packed per book into gzipped JSON lines ([chapter, verse, text]
+# per line) under <data>/bundles/<db stem>/. Book files are content-addressed
+# ("43.<sha12>.jsonl.gz"), so a file never changes once published and clients can
+# cache it forever. manifest.json lists the current files; the bundle id is the
+# hash of all book hashes. Older manifests are kept under manifests/ so the server
+# can answer "what changed since bundle X" with just the books that differ.
+
+BUNDLE_FORMAT = 1
+BUNDLES_DIRNAME = "bundles"
+KEEP_MANIFESTS = 5
+
+
+def bundle_dir_for(db_path: Path) -> Path:
+    return db_path.parent / BUNDLES_DIRNAME / db_path.stem
+
+
+def _book_lines(con: sqlite3.Connection, book_id: int) -> Tuple[bytes, List[int], int]:
+    rows = con.execute(
+        "SELECT chapter, verse, text FROM verses WHERE book_id=? ORDER BY chapter, verse",
+        (book_id,),
+    )
+    lines: List[str] = []
+    counts: List[int] = []
+    for chapter, verse, text in rows:
+        ch, v = int(chapter), int(verse)
+        if len(counts) < ch:
+            counts.extend([0] * (ch - len(counts)))
+        counts[ch - 1] = max(counts[ch - 1], v)
+        lines.append(json.dumps([ch, v, str(text)], ensure_ascii=False, separators=(",", ":")))
+    return ("\n".join(lines) + "\n").encode("utf-8") if lines else b"", counts, len(lines)
+
+
+def read_manifest(db_path: Path, bundle: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    d = bundle_dir_for(db_path)
+    path = d / "manifests" / f"{bundle}.json" if bundle else d / "manifest.json"
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def bundle_is_current(db_path: Path) -> bool:
+    m = read_manifest(db_path)
+    return bool(m) and m.get("format") == BUNDLE_FORMAT and m.get("source") == source_signature(db_path)
+
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    tmp = temp_path_for(path)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def build_bundle(db_path: Path) -> Dict[str, Any]:
+    """
+    (Re)build the bundle for one Bible DB. Unchanged books keep their file name,
+    so clients only download what actually changed. Hold
+    build_lock(bundle_dir_for(db_path)) around it when other processes may build
+    the same bundle.
+    """
+    t0 = time.perf_counter()
+    out = bundle_dir_for(db_path)
+    (out / "manifests").mkdir(parents=True, exist_ok=True)
+
+    con = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        books = con.execute("SELECT id, name FROM books ORDER BY id").fetchall()
+        entries: List[Dict[str, Any]] = []
+        for book_id, name in books:
+            raw, counts, n = _book_lines(con, int(book_id))
+            if not n:
+                continue
+            sha = hashlib.sha256(raw).hexdigest()
+            filename = f"{int(book_id)}.{sha[:12]}.jsonl.gz"
+            path = out / filename
+            if not path.exists():
+                tmp = temp_path_for(path)
+                with open(tmp, "wb") as f:
+                    f.write(gzip.compress(raw, compresslevel=9, mtime=0))
+                os.replace(tmp, path)
+            entries.append(
+                {
+                    "id": int(book_id),
+                    "name": str(name),
+                    "chapters": counts,
+                    "verses": n,
+                    "file": filename,
+                    "sha256": sha,
+                    "bytes": path.stat().st_size,
+                }
+            )
+    finally:
+        con.close()
+
+    bundle = hashlib.sha256("".join(e["sha256"] for e in entries).encode("ascii")).hexdigest()[:16]
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "db": db_path.name,
+        "bundle": bundle,
+        "source": source_signature(db_path),
+        "created": int(time.time()),
+        "bytes": sum(e["bytes"] for e in entries),
+        "books": entries,
+    }
+    _write_json(out / "manifests" / f"{bundle}.json", manifest)
+    _write_json(out / "manifest.json", manifest)
+    _prune(out)
+
+    return {
+        "db": db_path.name,
+        "bundle": bundle,
+        "books": len(entries),
+        "bytes": manifest["bytes"],
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def _prune(out: Path) -> None:
+    """
+    Keep the last KEEP_MANIFESTS manifests and every book file they reference,
+    and drop temp files left by a build that died (the caller holds the build lock).
+    """
+    for p in [*out.glob("*.tmp"), *(out / "manifests").glob("*.tmp")]:
+        p.unlink(missing_ok=True)
+    manifests = sorted((out / "manifests").glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    keep_files = set()
+    for i, p in enumerate(manifests):
+        if i >= KEEP_MANIFESTS:
+            p.unlink()
+            continue
+        with open(p, "r", encoding="utf-8") as f:
+            keep_files.update(e["file"] for e in json.load(f).get("books", []))
+    for p in out.glob("*.jsonl.gz"):
+        if p.name not in keep_files:
+            p.unlink()
+
+
+def ensure_bundle(db_path: Path) -> Optional[Dict[str, Any]]:
+    if bundle_is_current(db_path):
+        return None
+    out = bundle_dir_for(db_path)
+    out.mkdir(parents=True, exist_ok=True)
+    with build_lock(out):
+        if bundle_is_current(db_path):  # another worker built it while we waited
+            return None
+        return build_bundle(db_path)
+
+
+def delta(db_path: Path, from_bundle: Optional[str]) -> Dict[str, Any]:
+    """
+    Books to fetch/drop to go from from_bundle to the current bundle.
+    Unknown or missing from_bundle -> everything ("full": true).
+    """
+    cur = read_manifest(db_path)
+    if cur is None:
+        raise FileNotFoundError(f"No bundle for {db_path.name}")
+
+    old = read_manifest(db_path, from_bundle) if from_bundle else None
+    if old is None:
+        return {"from": from_bundle, "to": cur["bundle"], "full": True, "changed": cur["books"], "removed": []}
+
+    old_files = {e["id"]: e["file"] for e in old.get("books", [])}
+    cur_ids = {e["id"] for e in cur["books"]}
+    return {
+        "from": from_bundle,
+        "to": cur["bundle"],
+        "full": False,
+        "changed": [e for e in cur["books"] if old_files.get(e["id"]) != e["file"]],
+        "removed": sorted(i for i in old_files if i not in cur_ids),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from bible_api import DB_MAP, data_dir
+
+    parser = argparse.ArgumentParser(description="Build offline Bible bundles for the service worker.")
+    parser.add_argument("--data-dir", type=Path, default=None, help="folder holding the Bible DBs")
+    parser.add_argument("--version", action="append", default=None, choices=sorted(DB_MAP), help="version key (repeatable)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the bundle is current")
+    args = parser.parse_args(argv)
+
+    base = args.data_dir or data_dir()
+    files = sorted({DB_MAP[v] for v in args.version} if args.version else set(DB_MAP.values()))
+    for filename in files:
+        db_path = base / filename
+        if not db_path.exists():
+            print(f"skip {filename}: not found in {base}")
+            continue
+        if not args.force and bundle_is_current(db_path):
+            print(f"{filename}: bundle is current")
+            continue
+        bundle_dir_for(db_path).mkdir(parents=True, exist_ok=True)
+        with build_lock(bundle_dir_for(db_path)):
+            info = build_bundle(db_path)
+        print(f"{filename}: bundle {info['bundle']} ({info['books']} books, {info['bytes']} bytes, {info['seconds']}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
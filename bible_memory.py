@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import sqlite3
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Iterator
+
+
+class MemoryCorpus:
+    """
+    One translation held in memory.
+
+    All verses live in a single string buffer, already rendered the way
+    /bible/text joins them ("N. text" lines separated by "\\n"), so a chapter
+    or verse range is one slice of the buffer. Per-verse offsets are kept in
+    flat arrays, ordered by (book, chapter, verse).
+    """
+
+    def __init__(self, books: Iterable[Tuple[int, str]], rows: Iterable[Tuple[int, int, int, Any]]):
+        self.books: Dict[int, str] = {int(bid): str(name) for bid, name in books}
+
+        self._verse = array("H")
+        self._line_start = array("I")
+        self._text_start = array("I")
+        self._line_end = array("I")
+        self._chapters: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        self._max_chapter: Dict[int, int] = {}
+
+        parts: List[str] = []
+        pos = 0
+        cur: Optional[Tuple[int, int]] = None
+        lo = 0
+        i = 0
+        for book_id, chapter, verse, text in rows:
+            key = (int(book_id), int(chapter))
+            if key != cur:
+                if cur is not None:
+                    self._chapters[cur] = (lo, i)
+                cur = key
+                lo = i
+                if key[1] > self._max_chapter.get(key[0], 0):
+                    self._max_chapter[key[0]] = key[1]
+
+            if i:
+                parts.append("\n")
+                pos += 1
+
+            v = int(verse)
+            prefix = f"{v}. "
+            body = str(text)
+            parts.append(prefix)
+            parts.append(body)
+
+            self._verse.append(v)
+            self._line_start.append(pos)
+            self._text_start.append(pos + len(prefix))
+            pos += len(prefix) + len(body)
+            self._line_end.append(pos)
+            i += 1
+
+        if cur is not None:
+            self._chapters[cur] = (lo, i)
+
+        self._buf = "".join(parts)
+
+    @classmethod
+    def from_connection(cls, con: sqlite3.Connection) -> "MemoryCorpus":
+        books = con.execute("SELECT id, name FROM books ORDER BY id").fetchall()
+        rows = con.execute("SELECT book_id, chapter, verse, text FROM verses ORDER BY book_id, chapter, verse")
+        return cls(((b[0], b[1]) for b in books), ((r[0], r[1], r[2], r[3]) for r in rows))
+
+    def __len__(self) -> int:
+        return len(self._verse)
+
+    def book_name(self, book_id: int) -> Optional[str]:
+        return self.books.get(int(book_id))
+
+    def max_chapter(self, book_id: int) -> int:
+        return self._max_chapter.get(int(book_id), 0)
+
+    def max_verse(self, book_id: int, chapter: int) -> int:
+        span = self._chapters.get((int(book_id), int(chapter)))
+        if not span:
+            return 0
+        lo, hi = span
+        return max(self._verse[lo:hi])
+
+    def chapter_counts(self) -> Dict[Tuple[int, int], int]:
+        return {k: max(self._verse[lo:hi]) for k, (lo, hi) in self._chapters.items()}
+
+    def span(self, book_id: int, chapter: int, verse_start: Optional[int] = None, verse_end: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Row range [lo, hi) for a chapter, optionally narrowed to verse_start..verse_end.
+        """
+        span = self._chapters.get((int(book_id), int(chapter)))
+        if not span:
+            return (0, 0)
+        lo, hi = span
+        if verse_start is None and verse_end is None:
+            return (lo, hi)
+        return (
+            bisect_left(self._verse, int(verse_start), lo, hi),
+            bisect_right(self._verse, int(verse_end), lo, hi),
+        )
+
+    def passage(
+        self,
+        book_id: int,
+        chapter_start: int,
+        verse_start: Optional[int],
+        chapter_end: int,
+        verse_end: Optional[int],
+    ) -> List[Tuple[int, int, str]]:
+        """
+        (chapter, verse, text) rows from chapter_start:verse_start through chapter_end:verse_end.
+        None for a verse bound means the start/end of that chapter.
+        """
+        book_id = int(book_id)
+        buf = self._buf
+        out: List[Tuple[int, int, str]] = []
+        last = min(int(chapter_end), self.max_chapter(book_id))
+        for ch in range(int(chapter_start), last + 1):
+            span = self._chapters.get((book_id, ch))
+            if not span:
+                continue
+            lo, hi = span
+            if ch == chapter_start and verse_start is not None:
+                lo = bisect_left(self._verse, int(verse_start), lo, hi)
+            if ch == chapter_end and verse_end is not None:
+                hi = bisect_right(self._verse, int(verse_end), lo, hi)
+            out.extend((ch, self._verse[i], buf[self._text_start[i]:self._line_end[i]]) for i in range(lo, hi))
+        return out
+
+    def iter_rows(
+        self,
+        book_start: int,
+        book_end: int,
+        after: Optional[Tuple[int, int, int]] = None,
+    ) -> Iterator[Tuple[int, int, int, str]]:
+        """
+        (book_id, chapter, verse, text) for books book_start..book_end in order,
+        starting after the given (book, chapter, verse).
+        """
+        buf = self._buf
+        for (b, c) in sorted(k for k in self._chapters if book_start <= k[0] <= book_end):
+            if after is not None and (b, c) < after[:2]:
+                continue
+            lo, hi = self._chapters[(b, c)]
+            if after is not None and (b, c) == after[:2]:
+                lo = bisect_right(self._verse, after[2], lo, hi)
+            for i in range(lo, hi):
+                yield b, c, self._verse[i], buf[self._text_start[i]:self._line_end[i]]
+
+    def verses(self, lo: int, hi: int) -> List[Dict[str, Any]]:
+        buf = self._buf
+        return [
+            {"verse": self._verse[i], "text": buf[self._text_start[i]:self._line_end[i]]}
+            for i in range(lo, hi)
+        ]
+
+    def joined(self, lo: int, hi: int) -> str:
+        if hi <= lo:
+            return ""
+        return self._buf[self._line_start[lo]:self._line_end[hi - 1]]
+
+    def memory_bytes(self) -> int:
+        n = sys.getsizeof(self._buf)
+        for a in (self._verse, self._line_start, self._text_start, self._line_end):
+            n += a.buffer_info()[1] * a.itemsize
+        n += sys.getsizeof(self._chapters) + len(self._chapters) * (2 * sys.getsizeof((0, 0)))
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "verses": len(self),
+            "chapters": len(self._chapters),
+            "books": len(self.books),
+            "bytes": self.memory_bytes(),
+        }
@@ -0,0 +1,404 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+from bisect import bisect_left
+from typing import Optional, Dict, Any, List, NamedTuple, Tuple, Iterable
+
+# Book names and abbreviations, keyed by canonical book id (1 = Genesis ... 66 = Revelation).
+# Both Bible DBs number their books this way, so an alias resolves to the same id
+# in every translation. Accents, case, dots and spacing do not matter here:
+# everything goes through normalize_book_name().
+
+
+def _numbered(n: int, *stems: str) -> Tuple[str, ...]:
+    return tuple(f"{n} {s}" for s in stems)
+
+
+_SAMUEL = ("samuel", "sam", "sa", "sm", "s")
+_KINGS = ("kings", "kgs", "ki", "kin", "reyes", "re", "r")
+_CHRONICLES = ("chronicles", "chron", "chr", "ch", "cronicas", "cron", "cr")
+_CORINTHIANS = ("corinthians", "cor", "co", "corintios")
+_THESSALONIANS = ("thessalonians", "thess", "thes", "th", "tesalonicenses", "tes", "ts")
+_TIMOTHY = ("timothy", "tim", "ti", "tm", "timoteo")
+_PETER = ("peter", "pet", "pe", "pt", "p", "pedro")
+_JOHN_LETTER = ("john", "jn", "jhn", "jo", "joh", "juan", "jua")
+
+BOOK_ALIASES: Dict[int, Tuple[str, ...]] = {
+    1: ("Genesis", "gen", "ge", "gn", "génesis"),
+    2: ("Exodus", "exod", "exo", "ex", "éxodo", "éx"),
+    3: ("Leviticus", "lev", "le", "lv", "levítico"),
+    4: ("Numbers", "num", "nu", "nm", "nb", "números", "núm"),
+    5: ("Deuteronomy", "deut", "deu", "dt", "deuteronomio"),
+    6: ("Joshua", "josh", "jos", "jsh", "josué"),
+    7: ("Judges", "judg", "jdg", "jg", "jdgs", "jueces", "jue", "jc"),
+    8: ("Ruth", "rut", "rth", "ru", "rt"),
+    9: ("1 Samuel",) + _numbered(1, *_SAMUEL),
+    10: ("2 Samuel",) + _numbered(2, *_SAMUEL),
+    11: ("1 Kings",) + _numbered(1, *_KINGS),
+    12: ("2 Kings",) + _numbered(2, *_KINGS),
+    13: ("1 Chronicles",) + _numbered(1, *_CHRONICLES),
+    14: ("2 Chronicles",) + _numbered(2, *_CHRONICLES),
+    15: ("Ezra", "ezr", "esdras", "esd"),
+    16: ("Nehemiah", "neh", "ne", "nehemías"),
+    17: ("Esther", "esth", "est", "es", "ester"),
+    18: ("Job", "jb"),
+    19: ("Psalms", "psalm", "ps", "psa", "pss", "psm", "salmos", "salmo", "sal", "sl"),
+    20: ("Proverbs", "prov", "pro", "prv", "pr", "proverbios"),
+    21: ("Ecclesiastes", "eccl", "eccles", "ecc", "ec", "qoh", "eclesiastés", "ecl"),
+    22: (
+        "Song of Solomon", "song of songs", "song", "sos", "sg", "canticles", "cant",
+        "cantares", "cantar de los cantares", "cnt",
+    ),
+    23: ("Isaiah", "isa", "is", "isaías"),
+    24: ("Jeremiah", "jer", "je", "jr", "jeremías"),
+    25: ("Lamentations", "lam", "la", "lamentaciones"),
+    26: ("Ezekiel", "ezek", "eze", "ezk", "ezequiel", "ez"),
+    27: ("Daniel", "dan", "da", "dn"),
+    28: ("Hosea", "hos", "ho", "oseas", "os"),
+    29: ("Joel", "jl", "joe"),
+    30: ("Amos", "am", "amós"),
+    31: ("Obadiah", "obad", "ob", "abdías", "abd"),
+    32: ("Jonah", "jon", "jnh", "jonás"),
+    33: ("Micah", "mic", "miqueas", "miq", "mi"),
+    34: ("Nahum", "nah", "na", "nahúm"),
+    35: ("Habakkuk", "hab", "hb", "habacuc"),
+    36: ("Zephaniah", "zeph", "zep", "zp", "sofonías", "sof"),
+    37: ("Haggai", "hag", "hg", "hageo"),
+    38: ("Zechariah", "zech", "zec", "zc", "zacarías", "zac"),
+    39: ("Malachi", "mal", "ml", "malaquías"),
+    40: ("Matthew", "matt", "mat", "mt", "mateo"),
+    41: ("Mark", "mrk", "mk", "mr", "marcos", "mc"),
+    42: ("Luke", "luk", "lk", "lucas", "lc"),
+    43: ("John", "jn", "jhn", "joh", "juan", "jua"),
+    44: ("Acts", "act", "ac", "hechos", "hch", "hech"),
+    45: ("Romans", "rom", "ro", "rm", "romanos"),
+    46: ("1 Corinthians",) + _numbered(1, *_CORINTHIANS),
+    47: ("2 Corinthians",) + _numbered(2, *_CORINTHIANS),
+    48: ("Galatians", "gal", "ga", "gálatas"),
+    49: ("Ephesians", "eph", "ephes", "efesios", "ef"),
+    50: ("Philippians", "phil", "php", "pp", "filipenses", "fil", "flp"),
+    51: ("Colossians", "col", "colosenses"),
+    52: ("1 Thessalonians",) + _numbered(1, *_THESSALONIANS),
+    53: ("2 Thessalonians",) + _numbered(2, *_THESSALONIANS),
+    54: ("1 Timothy",) + _numbered(1, *_TIMOTHY),
+    55: ("2 Timothy",) + _numbered(2, *_TIMOTHY),
+    56: ("Titus", "tit", "tito"),
+    57: ("Philemon", "philem", "phlm", "phm", "pm", "filemón", "flm"),
+    58: ("Hebrews", "heb", "he", "hebreos"),
+    59: ("James", "jas", "jm", "santiago", "stg", "sant"),
+    60: ("1 Peter",) + _numbered(1, *_PETER),
+    61: ("2 Peter",) + _numbered(2, *_PETER),
+    62: ("1 John",) + _numbered(1, *_JOHN_LETTER),
+    63: ("2 John",) + _numbered(2, *_JOHN_LETTER),
+    64: ("3 John",) + _numbered(3, *_JOHN_LETTER),
+    65: ("Jude", "jud", "jd", "judas"),
+    66: ("Revelation", "rev", "re", "rv", "revelations", "apocalypse", "apocalipsis", "apoc", "ap"),
+}
+
+# Leading ordinals ("First", "1st", "I", "Primera", "1ra", "1º") -> digit.
+_ORDINALS = {
+    "1": ("1", "i", "1st", "first", "primera", "primero", "primer", "1ra", "1ro", "1er", "1a", "1o", "1º", "1ª"),
+    "2": ("2", "ii", "2nd", "second", "segunda", "segundo", "2da", "2do", "2a", "2o", "2º", "2ª"),
+    "3": ("3", "iii", "3rd", "third", "tercera", "tercero", "tercer", "3ra", "3ro", "3er", "3a", "3o", "3º", "3ª"),
+}
+_ORDINAL_MAP = {alias: digit for digit, aliases in _ORDINALS.items() for alias in aliases}
+
+_PUNCT_RE = re.compile(r"[.\-_,]+")
+_SPACE_RE = re.compile(r"\s+")
+
+# Shortest input we will try as a prefix; below this only exact aliases count.
+MIN_PREFIX = 2
+
+
+def strip_accents(s: str) -> str:
+    return "".join(ch for ch in unicodedata.normalize("NFKD", s) if not unicodedata.combining(ch))
+
+
+def normalize_book_name(name: str) -> str:
+    """
+    Fold a book name to its lookup key: no accents, lower case, no punctuation,
+    ordinal prefix turned into a digit, and all spaces removed ("1 Cor." -> "1cor").
+    """
+    s = (name or "").strip().lower().replace("º", "o ").replace("ª", "a ")
+    s = strip_accents(s)
+    s = _PUNCT_RE.sub(" ", s)
+    s = _SPACE_RE.sub(" ", s).strip()
+    if not s:
+        return ""
+
+    head, _, rest = s.partition(" ")
+    if rest and head in _ORDINAL_MAP:
+        # "Primera de Juan", "First of John"
+        for filler in ("de ", "of "):
+            if rest.startswith(filler):
+                rest = rest[len(filler):]
+        s = _ORDINAL_MAP[head] + " " + rest
+    return s.replace(" ", "")
+
+
+class BookResolver:
+    """
+    Book name -> canonical book id, built once.
+
+    Exact lookups (full names from the DB, the alias table above) are a dict hit.
+    Anything else is resolved as a prefix over the sorted keys, and only if every
+    matching key points to the same book.
+    """
+
+    def __init__(self, books: Iterable[Tuple[int, str]] = ()):
+        self.names: Dict[int, str] = {bid: aliases[0] for bid, aliases in BOOK_ALIASES.items()}
+        # key -> (book_id, rank); rank 0 = name from the DB, 1 = alias table
+        self._exact: Dict[str, Tuple[int, int]] = {}
+
+        for bid, name in books:
+            bid = int(bid)
+            self.names[bid] = str(name)
+            self._add(str(name), bid, 0)
+        for bid, aliases in BOOK_ALIASES.items():
+            for a in aliases:
+                self._add(a, bid, 1)
+
+        self._keys: List[str] = sorted(self._exact)
+
+    def _add(self, name: str, book_id: int, rank: int) -> None:
+        key = normalize_book_name(name)
+        if key and key not in self._exact:
+            self._exact[key] = (book_id, rank)
+
+    def candidates(self, name: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Ranked matches: exact alias first, then books whose names start with the input
+        (shorter, DB-provided names first).
+        """
+        key = normalize_book_name(name)
+        if not key:
+            return []
+
+        out: List[Dict[str, Any]] = []
+        seen = set()
+        hit = self._exact.get(key)
+        if hit:
+            out.append({"book_id": hit[0], "name": self.names.get(hit[0], str(hit[0])), "match": "exact"})
+            seen.add(hit[0])
+
+        if len(key) >= MIN_PREFIX:
+            best: Dict[int, Tuple[int, int]] = {}
+            i = bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i].startswith(key):
+                k = self._keys[i]
+                bid, rank = self._exact[k]
+                score = (rank, len(k))
+                if bid not in seen and (bid not in best or score < best[bid]):
+                    best[bid] = score
+                i += 1
+            for bid in sorted(best, key=lambda b: (best[b], b)):
+                out.append({"book_id": bid, "name": self.names.get(bid, str(bid)), "match": "prefix"})
+
+        return out[: max(1, int(limit))]
+
+    def exact(self, name: str) -> Optional[int]:
+        hit = self._exact.get(normalize_book_name(name))
+        return hit[0] if hit else None
+
+    def resolve(self, name: str) -> Optional[int]:
+        """
+        Best book id for the input, or None if it is unknown or ambiguous ("Jo").
+        """
+        key = normalize_book_name(name)
+        if not key:
+            return None
+        hit = self._exact.get(key)
+        if hit:
+            return hit[0]
+        cands = self.candidates(name, limit=2)
+        if len(cands) == 1:
+            return int(cands[0]["book_id"])
+        return None
+
+
+_DEFAULT_RESOLVER: Optional[BookResolver] = None
+
+
+def default_resolver() -> BookResolver:
+    """
+    Resolver over the alias table only (no DB), for callers outside the /bible router.
+    """
+    global _DEFAULT_RESOLVER
+    if _DEFAULT_RESOLVER is None:
+        _DEFAULT_RESOLVER = BookResolver()
+    return _DEFAULT_RESOLVER
+
+
+# -----------------------------
+# Scripture reference parsing
+# -----------------------------
+class PassageRef(NamedTuple):
+    """
+    One parsed reference. verse_start/verse_end are None for whole chapters,
+    so "Ps 23" is (19, 23, None, 23, None) and "John 3:16-4:2" is (43, 3, 16, 4, 2).
+    """
+
+    book_id: int
+    chapter_start: int
+    verse_start: Optional[int]
+    chapter_end: int
+    verse_end: Optional[int]
+    source: str
+
+    def label(self, book_name: str) -> str:
+        s = f"{book_name} {self.chapter_start}"
+        if self.verse_start is not None:
+            s += f":{self.verse_start}"
+        if self.chapter_end != self.chapter_start:
+            s += f"-{self.chapter_end}"
+            if self.verse_end is not None:
+                s += f":{self.verse_end}"
+        elif self.verse_end is not None and self.verse_end != self.verse_start:
+            s += f"-{self.verse_end}"
+        return s
+
+
+# Obadiah, Philemon, 2 John, 3 John, Jude
+SINGLE_CHAPTER_BOOKS = frozenset((31, 57, 63, 64, 65))
+
+_BOOK_PART_RE = re.compile(
+    r"^(?P<book>(?:[123](?:st|nd|rd|ra|ro|er|da|do|a|o|º|ª)?\.?\s*)?[^\W\d_][^\d]*?)\s*(?P<rest>\d.*)?$",
+    re.UNICODE | re.IGNORECASE,
+)
+_NUMS_RE = re.compile(
+    r"^(?P<c1>\d+)(?:\s*[:.]\s*(?P<v1>\d+))?"
+    r"(?:\s*[-–—]\s*(?:(?P<c2>\d+)\s*[:.]\s*)?(?P<n2>\d+))?$"
+)
+
+# Free-text scan: a capitalised book name followed by chapter:verse, with optional
+# ranges and ", 38-39" continuations ("see Rom 8:28, 38-39 and Ps 23").
+_SCAN_RE = re.compile(
+    r"(?<![\w])"
+    r"(?P<book>(?:[123]\s?)?[A-ZÁÉÍÓÚÑ][a-záéíóúñü]+\.?"
+    r"(?:\s(?:of|de|de los)\s[A-ZÁÉÍÓÚÑ][a-záéíóúñü]+)*)"
+    r"\s+(?P<nums>\d{1,3}(?::\d{1,3}(?:\s*[-–]\s*\d{1,3}(?::\d{1,3})?)?"
+    r"(?:,\s*\d{1,3}(?:\s*[-–]\s*\d{1,3})?)*)?)"
+    r"(?![\w:])",
+    re.UNICODE,
+)
+
+
+def _parse_numbers(
+    book_id: int,
+    nums: str,
+    chapter: Optional[int],
+    in_verses: bool,
+    source: str,
+) -> Optional[PassageRef]:
+    """
+    nums is what follows the book: "3:16-18", "23", "3:16-4:2", or in a comma list a bare "38-39".
+    When in_verses is set (we are after "Rom 8:28,"), a bare number is a verse of `chapter`.
+    """
+    m = _NUMS_RE.match(nums.strip())
+    if not m:
+        return None
+    c1, v1, c2, n2 = m.group("c1"), m.group("v1"), m.group("c2"), m.group("n2")
+
+    if v1 is None and c2 is None and book_id in SINGLE_CHAPTER_BOOKS:
+        # "Jude 3", "Philemon 4-6": the number is a verse
+        chapter, in_verses = 1, True
+
+    if v1 is None and c2 is None and in_verses and chapter is not None:
+        # ", 38-39" -> verses of the current chapter
+        vs = int(c1)
+        ve = int(n2) if n2 else vs
+        return PassageRef(book_id, chapter, min(vs, ve), chapter, max(vs, ve), source)
+
+    cs = int(c1)
+    if v1 is None:
+        if c2 is not None:
+            # "3-4:5" -> from the start of chapter 3 to 4:5
+            return PassageRef(book_id, cs, 1, int(c2), int(n2), source)
+        ce = int(n2) if n2 else cs
+        return PassageRef(book_id, min(cs, ce), None, max(cs, ce), None, source)
+
+    vs = int(v1)
+    if c2 is not None:
+        ce, ve = int(c2), int(n2)
+        if (ce, ve) < (cs, vs):
+            cs, vs, ce, ve = ce, ve, cs, vs
+        return PassageRef(book_id, cs, vs, ce, ve, source)
+    ve = int(n2) if n2 else vs
+    return PassageRef(book_id, cs, min(vs, ve), cs, max(vs, ve), source)
+
+
+def parse_references(text: str, resolver: Optional[BookResolver] = None) -> Tuple[List[PassageRef], List[str]]:
+    """
+    Parse a reference list such as "John 3:16-18; Rom 8:28, 38-39; Ps 23".
+
+    ";" separates references, "," continues the previous one (more verses of the
+    same chapter, or "Rom 8:28, 9:1" another chapter of the same book); a reference
+    without a book name reuses the previous book. Returns (parsed refs, pieces that
+    could not be parsed).
+    """
+    resolver = resolver or default_resolver()
+    refs: List[PassageRef] = []
+    bad: List[str] = []
+
+    book_id: Optional[int] = None
+    chapter: Optional[int] = None
+    for group in re.split(r"[;\n]+", text or ""):
+        in_verses = False
+        for part in group.split(","):
+            part = part.strip()
+            if not part:
+                continue
+
+            m = _BOOK_PART_RE.match(part)
+            if m:
+                bid = resolver.resolve(m.group("book"))
+                if bid is None:
+                    bad.append(part)
+                    book_id = None
+                    continue
+                book_id, chapter, in_verses = bid, None, False
+                nums = m.group("rest") or ""
+                if not nums:
+                    # bare book name -> chapter 1
+                    refs.append(PassageRef(bid, 1, None, 1, None, part))
+                    chapter = 1
+                    continue
+            else:
+                nums = part
+
+            if book_id is None:
+                bad.append(part)
+                continue
+
+            ref = _parse_numbers(book_id, nums, chapter, in_verses, part)
+            if ref is None:
+                bad.append(part)
+                continue
+            refs.append(ref)
+            chapter = ref.chapter_end
+            in_verses = ref.verse_start is not None
+
+    return refs, bad
+
+
+def find_references(text: str, resolver: Optional[BookResolver] = None) -> List[PassageRef]:
+    """
+    Scan free text (e.g. a chat answer) for scripture references. Stricter than
+    parse_references: the book must be capitalised and match a known name or
+    alias exactly, so ordinary words followed by numbers are not picked up.
+    """
+    resolver = resolver or default_resolver()
+    out: List[PassageRef] = []
+    for m in _SCAN_RE.finditer(text or ""):
+        nums = m.group("nums")
+        book_id = resolver.exact(m.group("book"))
+        if book_id is None:
+            continue
+        if ":" not in nums and len(normalize_book_name(m.group("book"))) < 4:
+            # chapter-only mentions ("Psalm 23") are fine for full book names,
+            # but not for short abbreviations that look like words ("Am 5")
+            continue
+        refs, _ = parse_references(f"{m.group('book')} {nums}", resolver)
+        out.extend(refs)
+    return out
@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import argparse
+import heapq
+import math
+import os
+import sqlite3
+import time
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from bible_search import build_lock, content_terms, source_signature, split_key, temp_path_for, verse_key
+
+# "Related verses" for one translation, built offline (python bible_related.py)
+# or, with BIBLE_RELATED_AUTOBUILD=1, in the background by bible_api at startup.
+# /bible/related can merge several translations' files on canonical verse keys.
+#
+# Every verse becomes a TF-IDF vector over its stemmed content words (see
+# bible_search.content_terms), L2-normalised; the top RELATED_TOP_N verses by
+# cosine similarity are stored next to the Bible DB ("bible.db" ->
+# "bible.related.db"), one row per verse with the neighbour keys as packed uint32
+# and the scores as packed float32. Serving is then one primary-key lookup.
+# Verses from the same chapter are skipped (they are one scroll away anyway), and
+# words in more than MAX_DF_RATIO of the verses carry too little signal to keep.
+
+RELATED_SUFFIX = ".related.db"
+RELATED_FORMAT = "1"
+RELATED_TOP_N = 20
+MAX_DF_RATIO = 0.01
+# Only a verse's heaviest terms are used to look for neighbours.
+QUERY_TERMS = 12
+
+
+def related_path_for(db_path: Path) -> Path:
+    return db_path.with_name(db_path.stem + RELATED_SUFFIX)
+
+
+def related_is_current(db_path: Path) -> bool:
+    path = related_path_for(db_path)
+    if not path.exists():
+        return False
+    try:
+        con = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            meta = dict(con.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            con.close()
+    except sqlite3.Error:
+        return False
+    return meta.get("format") == RELATED_FORMAT and meta.get("source") == source_signature(db_path)
+
+
+def _vectors(rows: List[Tuple[int, str]]) -> Tuple[List[Dict[int, float]], int]:
+    """
+    Sparse L2-normalised TF-IDF vectors (term id -> weight), one per row.
+    """
+    counts = [Counter(content_terms(text)) for _, text in rows]
+    df: Counter = Counter()
+    for c in counts:
+        df.update(c.keys())
+
+    n = max(1, len(rows))
+    max_df = max(2, int(n * MAX_DF_RATIO))
+    term_ids: Dict[str, int] = {}
+    idf: Dict[str, float] = {}
+    for t, d in df.items():
+        if 2 <= d <= max_df:
+            term_ids[t] = len(term_ids)
+            idf[t] = math.log(n / d)
+
+    vecs: List[Dict[int, float]] = []
+    for c in counts:
+        v = {term_ids[t]: (1.0 + math.log(tf)) * idf[t] for t, tf in c.items() if t in term_ids}
+        norm = math.sqrt(sum(w * w for w in v.values()))
+        vecs.append({k: w / norm for k, w in v.items()} if norm else {})
+    return vecs, len(term_ids)
+
+
+def build_related(db_path: Path, out_path: Optional[Path] = None, top_n: int = RELATED_TOP_N) -> Dict[str, Any]:
+    """
+    Build the related-verses file for one Bible DB (temp file + swap, like the
+    search index). Hold build_lock(out_path) around it when other processes may
+    build the same file.
+    """
+    out_path = out_path or related_path_for(db_path)
+    tmp_path = temp_path_for(out_path)
+
+    t0 = time.perf_counter()
+    src = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        rows = [
+            (verse_key(b, c, v), str(t))
+            for b, c, v, t in src.execute("SELECT book_id, chapter, verse, text FROM verses ORDER BY book_id, chapter, verse")
+        ]
+    finally:
+        src.close()
+
+    keys = [k for k, _ in rows]
+    chapters = [k // 1000 for k in keys]
+    vecs, vocab = _vectors(rows)
+
+    postings: Dict[int, List[Tuple[int, float]]] = {}
+    for i, v in enumerate(vecs):
+        for t, w in v.items():
+            postings.setdefault(t, []).append((i, w))
+
+    dst = sqlite3.connect(str(tmp_path))
+    try:
+        dst.execute("PRAGMA journal_mode=OFF")
+        dst.execute("PRAGMA synchronous=OFF")
+        dst.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        dst.execute("CREATE TABLE related (key INTEGER PRIMARY KEY, neighbours BLOB NOT NULL, scores BLOB NOT NULL)")
+
+        batch: List[Tuple[int, bytes, bytes]] = []
+        linked = 0
+        for i, v in enumerate(vecs):
+            if not v:
+                continue
+            scores: Dict[int, float] = {}
+            for t, w in heapq.nlargest(QUERY_TERMS, v.items(), key=lambda kv: kv[1]):
+                for j, wj in postings[t]:
+                    scores[j] = scores.get(j, 0.0) + w * wj
+            own_chapter = chapters[i]
+            best = heapq.nlargest(
+                top_n,
+                ((s, j) for j, s in scores.items() if chapters[j] != own_chapter),
+            )
+            if not best:
+                continue
+            batch.append(
+                (
+                    keys[i],
+                    array("I", (keys[j] for _, j in best)).tobytes(),
+                    array("f", (s for s, _ in best)).tobytes(),
+                )
+            )
+            linked += 1
+            if len(batch) >= 2000:
+                dst.executemany("INSERT INTO related (key, neighbours, scores) VALUES (?, ?, ?)", batch)
+                batch.clear()
+        if batch:
+            dst.executemany("INSERT INTO related (key, neighbours, scores) VALUES (?, ?, ?)", batch)
+
+        dst.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?)",
+            [
+                ("format", RELATED_FORMAT),
+                ("source", source_signature(db_path)),
+                ("source_name", db_path.name),
+                ("verses", str(len(rows))),
+                ("linked", str(linked)),
+                ("vocabulary", str(vocab)),
+                ("top_n", str(top_n)),
+            ],
+        )
+        dst.commit()
+    finally:
+        dst.close()
+
+    os.replace(tmp_path, out_path)
+    return {
+        "db": db_path.name,
+        "related": str(out_path),
+        "verses": len(rows),
+        "linked": linked,
+        "vocabulary": vocab,
+        "bytes": out_path.stat().st_size,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def ensure_related(db_path: Path) -> Optional[Dict[str, Any]]:
+    if related_is_current(db_path):
+        return None
+    with build_lock(related_path_for(db_path)):
+        if related_is_current(db_path):  # another worker built it while we waited
+            return None
+        return build_related(db_path)
+
+
+def neighbours(con: sqlite3.Connection, book_id: int, chapter: int, verse: int, limit: int = 10) -> List[Tuple[int, int, int, float]]:
+    """
+    [(book_id, chapter, verse, score)] for one verse, best first; [] if it has none.
+    """
+    row = con.execute(
+        "SELECT neighbours, scores FROM related WHERE key=?",
+        (verse_key(book_id, chapter, verse),),
+    ).fetchone()
+    if not row:
+        return []
+    keys = array("I")
+    keys.frombytes(row[0])
+    scores = array("f")
+    scores.frombytes(row[1])
+    out = []
+    for k, s in list(zip(keys, scores))[: max(0, int(limit))]:
+        b, c, v = split_key(k)
+        out.append((b, c, v, round(float(s), 4)))
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from bible_api import DB_MAP, data_dir
+
+    parser = argparse.ArgumentParser(description="Build the related-verses index for the Bible DBs.")
+    parser.add_argument("--data-dir", type=Path, default=None, help="folder holding the Bible DBs")
+    parser.add_argument("--version", action="append", default=None, choices=sorted(DB_MAP), help="version key (repeatable)")
+    parser.add_argument("--top", type=int, default=RELATED_TOP_N, help="neighbours kept per verse")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the index is current")
+    args = parser.parse_args(argv)
+
+    base = args.data_dir or data_dir()
+    files = sorted({DB_MAP[v] for v in args.version} if args.version else set(DB_MAP.values()))
+    for filename in files:
+        db_path = base / filename
+        if not db_path.exists():
+            print(f"skip {filename}: not found in {base}")
+            continue
+        if not args.force and related_is_current(db_path):
+            print(f"{filename}: related index is current")
+            continue
+        with build_lock(related_path_for(db_path)):
+            info = build_related(db_path, top_n=args.top)
+        print(
+            f"{filename}: linked {info['linked']}/{info['verses']} verses -> {info['related']} "
+            f"({info['bytes']} bytes, {info['seconds']}s)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
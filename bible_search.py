@@ -0,0 +1,417 @@
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+
+# Cross-process build lock (POSIX); without it builds still never share a temp file.
+try:
+    import fcntl
+except Exception:
+    fcntl = None
+
+# Full-text search over one translation.
+#
+# The index is a separate sqlite file next to the Bible DB ("bible.db" ->
+# "bible.fts.db") holding an FTS5 table. Each row's rowid encodes the verse
+# reference as book_id * 1_000_000 + chapter * 1000 + verse, so book and
+# testament filters are plain rowid ranges that FTS5 can apply while matching.
+# unicode61 with remove_diacritics=2 folds case and accents on both sides, so
+# "corazon" finds "corazón" and "Jesus" finds "Jesús".
+
+INDEX_SUFFIX = ".fts.db"
+INDEX_FORMAT = "1"
+
+# Canonical 66-book numbering: 1-39 Old Testament, 40-66 New Testament.
+OT_LAST_BOOK_ID = 39
+
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+SNIPPET_TOKENS = 24
+
+_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+_WORD_RE = re.compile(r"[\w]+\*?", re.UNICODE)
+
+
+def verse_key(book_id: int, chapter: int, verse: int) -> int:
+    return int(book_id) * 1_000_000 + int(chapter) * 1000 + int(verse)
+
+
+def split_key(key: int) -> Tuple[int, int, int]:
+    book_id, rest = divmod(int(key), 1_000_000)
+    chapter, verse = divmod(rest, 1000)
+    return book_id, chapter, verse
+
+
+def index_path_for(db_path: Path) -> Path:
+    return db_path.with_name(db_path.stem + INDEX_SUFFIX)
+
+
+def source_signature(db_path: Path) -> str:
+    st = db_path.stat()
+    return f"{st.st_size}:{int(st.st_mtime)}"
+
+
+# Files derived from a Bible DB are built into a unique temp file and swapped
+# in with os.replace, under a lock file: every uvicorn worker runs the same
+# startup, and only one of them should do the work.
+@contextmanager
+def build_lock(out_path: Path) -> Iterator[None]:
+    """
+    Hold "<out_path>.lock" while building out_path: a second builder waits here
+    and should re-check whether out_path is current before building it again.
+    Temp files left by a build that died are removed once the lock is ours.
+    """
+    with open(out_path.with_name(out_path.name + ".lock"), "a+b") as fh:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            for stale in out_path.parent.glob(out_path.name + ".*.tmp"):
+                stale.unlink(missing_ok=True)
+            yield
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def temp_path_for(out_path: Path) -> Path:
+    """
+    A new, uniquely named file next to out_path (same filesystem, so the final
+    os.replace is atomic).
+    """
+    with tempfile.NamedTemporaryFile(dir=out_path.parent, prefix=out_path.name + ".", suffix=".tmp", delete=False) as f:
+        path = Path(f.name)
+    os.chmod(path, 0o644)
+    return path
+
+
+def index_is_current(db_path: Path) -> bool:
+    idx = index_path_for(db_path)
+    if not idx.exists():
+        return False
+    try:
+        con = sqlite3.connect(f"{idx.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            meta = dict(con.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            con.close()
+    except sqlite3.Error:
+        return False
+    return meta.get("format") == INDEX_FORMAT and meta.get("source") == source_signature(db_path)
+
+
+def build_index(db_path: Path, out_path: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Build the FTS5 index for one Bible DB. Writes to a temp file and swaps it in,
+    so a running server never sees a half-built index. Hold build_lock(out_path)
+    around it when other processes may build the same index.
+    """
+    out_path = out_path or index_path_for(db_path)
+    tmp_path = temp_path_for(out_path)
+
+    t0 = time.perf_counter()
+    src = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+    dst = sqlite3.connect(str(tmp_path))
+    try:
+        dst.execute("PRAGMA journal_mode=OFF")
+        dst.execute("PRAGMA synchronous=OFF")
+        dst.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        dst.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, name TEXT)")
+        dst.execute(
+            "CREATE VIRTUAL TABLE verses_fts USING fts5(text, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+        dst.executemany(
+            "INSERT INTO books (id, name) VALUES (?, ?)",
+            src.execute("SELECT id, name FROM books ORDER BY id"),
+        )
+        n = 0
+        cur = src.execute("SELECT book_id, chapter, verse, text FROM verses ORDER BY book_id, chapter, verse")
+        while True:
+            rows = cur.fetchmany(2000)
+            if not rows:
+                break
+            dst.executemany(
+                "INSERT INTO verses_fts (rowid, text) VALUES (?, ?)",
+                [(verse_key(b, c, v), str(t)) for b, c, v, t in rows],
+            )
+            n += len(rows)
+
+        dst.execute("INSERT INTO verses_fts (verses_fts) VALUES ('optimize')")
+        dst.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?)",
+            [
+                ("format", INDEX_FORMAT),
+                ("source", source_signature(db_path)),
+                ("source_name", db_path.name),
+                ("verses", str(n)),
+            ],
+        )
+        dst.commit()
+    finally:
+        src.close()
+        dst.close()
+
+    os.replace(tmp_path, out_path)
+    return {
+        "db": db_path.name,
+        "index": str(out_path),
+        "verses": n,
+        "bytes": out_path.stat().st_size,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+def ensure_index(db_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Build the index if it is missing or stale. Returns build stats, or None if it was current.
+    """
+    if index_is_current(db_path):
+        return None
+    with build_lock(index_path_for(db_path)):
+        if index_is_current(db_path):  # another worker built it while we waited
+            return None
+        return build_index(db_path)
+
+
+def match_expression(q: str) -> str:
+    """
+    Turn a user query into a safe FTS5 MATCH expression.
+    "quoted text" stays a phrase, bare words are ANDed, a trailing * keeps prefix search.
+    Everything else (operators, column filters, punctuation) is dropped.
+    """
+    terms: List[str] = []
+    for m in _TOKEN_RE.finditer(q or ""):
+        phrase, word = m.group(1), m.group(2)
+        if phrase is not None:
+            words = [w.rstrip("*") for w in _WORD_RE.findall(phrase)]
+            words = [w for w in words if w]
+            if words:
+                terms.append('"' + " ".join(words) + '"')
+            continue
+        for w in _WORD_RE.findall(word or ""):
+            prefix = w.endswith("*")
+            w = w.rstrip("*")
+            if w:
+                terms.append(f'"{w}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def testament_books(testament: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive book id range for "ot"/"nt" (English or Spanish spelling); None for anything else.
+    """
+    t = (testament or "").strip().lower()
+    if t in ("ot", "old", "at", "antiguo"):
+        return 1, OT_LAST_BOOK_ID
+    if t in ("nt", "new", "nuevo"):
+        return OT_LAST_BOOK_ID + 1, 999
+    return None
+
+
+def key_range(book_id: Optional[int], testament: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive verse_key() bounds for one book or one testament; None means everything.
+    """
+    books = (book_id, book_id) if book_id is not None else testament_books(testament)
+    if books is None:
+        return None
+    return verse_key(books[0], 0, 0), verse_key(books[1] + 1, 0, 0) - 1
+
+
+def search(
+    con: sqlite3.Connection,
+    q: str,
+    book_id: Optional[int] = None,
+    testament: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    expr = match_expression(q)
+    if not expr:
+        return {"total": 0, "results": []}
+
+    where = "verses_fts MATCH ?"
+    params: List[Any] = [expr]
+    rng = key_range(book_id, testament)
+    if rng:
+        where += " AND rowid BETWEEN ? AND ?"
+        params.extend(rng)
+
+    total = con.execute(f"SELECT COUNT(*) FROM verses_fts WHERE {where}", params).fetchone()[0]
+
+    rows = con.execute(
+        f"""
+        SELECT rowid, text,
+               snippet(verses_fts, 0, ?, ?, '…', ?) AS snip,
+               bm25(verses_fts) AS score
+        FROM verses_fts
+        WHERE {where}
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+        """,
+        [HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, SNIPPET_TOKENS, *params, int(limit), int(offset)],
+    ).fetchall()
+
+    names: Dict[int, str] = {}
+    ids = sorted({split_key(r[0])[0] for r in rows})
+    if ids:
+        marks = ",".join("?" * len(ids))
+        names = {int(i): str(n) for i, n in con.execute(f"SELECT id, name FROM books WHERE id IN ({marks})", ids)}
+
+    results = []
+    for key, text, snip, score in rows:
+        b, c, v = split_key(key)
+        results.append(
+            {
+                "book_id": b,
+                "book": names.get(b, str(b)),
+                "chapter": c,
+                "verse": v,
+                "text": str(text),
+                "snippet": str(snip),
+                "score": round(-float(score), 4),
+            }
+        )
+    return {"total": int(total), "results": results}
+
+
+# -----------------------------
+# Keyword retrieval (chat grounding)
+# -----------------------------
+# Free-form chat messages are not search queries: "I feel so anxious about my job,
+# what should I read?" has to become an OR of its content words, lightly stemmed
+# into prefix terms, ranked by bm25 so verses matching several rare words win.
+
+_KEYWORD_RE = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+
+_STOPWORDS_EN = frozenset(
+    """
+    about above after again against all also and any are because been before being below between both but
+    can could did does doing down during each few for from further had has have having her here hers herself
+    him himself his how into its itself just like more most myself nor not now off once only other our ours
+    ourselves out over own same she should some such than that the their theirs them themselves then there
+    these they this those through too under until very was were what when where which while who whom why
+    will with would you your yours yourself yourselves please tell give show know want need help bible verse
+    verses scripture scriptures say says said about read explain mean means something anything really feel
+    feeling today pray prayer god lord jesus christ
+    """.split()
+)
+_STOPWORDS_ES = frozenset(
+    """
+    que los las del por con una para como mas pero sus este esta esto estos estas ese esa eso esos esas
+    muy sin sobre tambien hasta desde donde cuando porque todo todos toda todas otro otra otros otras
+    ella ellos ellas nos nosotros usted ustedes mis tus sus ser estar estoy esta estan fue era son hay
+    tengo tiene tienen puede puedo quiero necesito dime dame explica explicame significa algo nada hoy
+    biblia versiculo versiculos escritura escrituras dice dicen leer ora oracion dios senor jesus cristo
+    """.split()
+)
+_SUFFIXES = (
+    "fulness", "nesses", "ness", "ments", "ment", "ings", "ing", "ious", "ous", "edly", "ed",
+    "ies", "es", "ly", "ciones", "cion", "siones", "sion", "mente", "dades", "dad", "mos", "s",
+)
+
+
+def _fold(word: str) -> str:
+    return "".join(ch for ch in unicodedata.normalize("NFKD", word.lower()) if not unicodedata.combining(ch))
+
+
+def _stem(word: str) -> str:
+    for suf in _SUFFIXES:
+        if word.endswith(suf) and len(word) - len(suf) >= 4:
+            return word[: -len(suf)]
+    return word
+
+
+def guess_lang(text: str) -> str:
+    """
+    "es" or "en" from stopword hits; ties go to English.
+    """
+    words = [_fold(w) for w in re.findall(r"[^\W\d_]+", text or "", re.UNICODE)]
+    es = sum(1 for w in words if w in _STOPWORDS_ES or w in ("el", "la", "de", "y", "en", "mi", "me", "un"))
+    en = sum(1 for w in words if w in _STOPWORDS_EN or w in ("i", "a", "is", "of", "to", "in", "my", "me"))
+    return "es" if es > en else "en"
+
+
+def content_terms(text: str) -> List[str]:
+    """
+    Folded, stemmed words of the text without EN/ES stopwords (repeats kept, in order).
+    """
+    out: List[str] = []
+    for w in _KEYWORD_RE.findall(text or ""):
+        w = _fold(w)
+        if w in _STOPWORDS_EN or w in _STOPWORDS_ES:
+            continue
+        out.append(_stem(w))
+    return out
+
+
+def keyword_expression(text: str, max_terms: int = 8) -> str:
+    """
+    FTS5 expression ORing the message's content words as prefix terms; "" if none are left.
+    Longer words are kept first (they tend to be the rarer, more telling ones).
+    """
+    seen = list(dict.fromkeys(content_terms(text)))
+    seen.sort(key=len, reverse=True)
+    return " OR ".join(f'"{t}"*' for t in seen[: max(1, int(max_terms))])
+
+
+def top_verses(con: sqlite3.Connection, text: str, limit: int = 5, max_terms: int = 8) -> List[Dict[str, Any]]:
+    """
+    The best bm25 matches for a chat message: [{"book_id", "book", "chapter", "verse", "text"}].
+    """
+    expr = keyword_expression(text, max_terms=max_terms)
+    if not expr:
+        return []
+    rows = con.execute(
+        "SELECT rowid, text FROM verses_fts WHERE verses_fts MATCH ? ORDER BY rank LIMIT ?",
+        (expr, int(limit)),
+    ).fetchall()
+    if not rows:
+        return []
+
+    ids = sorted({split_key(r[0])[0] for r in rows})
+    marks = ",".join("?" * len(ids))
+    names = {int(i): str(n) for i, n in con.execute(f"SELECT id, name FROM books WHERE id IN ({marks})", ids)}
+    out = []
+    for key, verse_text in rows:
+        b, c, v = split_key(key)
+        out.append({"book_id": b, "book": names.get(b, str(b)), "chapter": c, "verse": v, "text": str(verse_text)})
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from bible_api import DB_MAP, data_dir
+
+    parser = argparse.ArgumentParser(description="Build the full-text search index for the Bible DBs.")
+    parser.add_argument("--data-dir", type=Path, default=None, help="folder holding the Bible DBs")
+    parser.add_argument("--version", action="append", default=None, choices=sorted(DB_MAP), help="version key (repeatable)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the index is current")
+    args = parser.parse_args(argv)
+
+    base = args.data_dir or data_dir()
+    files = sorted({DB_MAP[v] for v in args.version} if args.version else set(DB_MAP.values()))
+    for filename in files:
+        db_path = base / filename
+        if not db_path.exists():
+            print(f"skip {filename}: not found in {base}")
+            continue
+        if not args.force and index_is_current(db_path):
+            print(f"{filename}: index is current")
+            continue
+        with build_lock(index_path_for(db_path)):
+            info = build_index(db_path)
+        print(f"{filename}: indexed {info['verses']} verses -> {info['index']} ({info['bytes']} bytes, {info['seconds']}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
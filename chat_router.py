@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import logging
+import re
+import time
+from typing import Optional, Dict, Any, List
+
+from fastapi import HTTPException
+
+import bible_api
+from bible_refs import normalize_book_name, parse_references
+
+log = logging.getLogger(__name__)
+
+# Local fast path for chat messages that only ask to read a passage
+# ("read John 3:16", "show me Psalm 23", "Romanos 8:28", "léeme Juan 3:16-18").
+# The message must be an optional lookup phrase wrapped around a reference list
+# that parses completely; anything else ("what does John 3:16 mean?") goes to
+# the model. Verses come straight from the local Bible DBs, so the answer is
+# exact and takes milliseconds.
+
+# Largest local answer; longer requests are left to the model.
+MAX_LOOKUP_VERSES = 200
+
+VERSION_BY_LANG = {"en": "en_default", "es": "rvr1909"}
+
+_LEAD_EN = (
+    r"(?:please\s+)?(?:(?:can|could|would|will)\s+you\s+)?(?:please\s+)?"
+    r"(?:read(?:\s+me)?|show(?:\s+me)?|open|quote|give\s+me|display|look\s*up|find|go\s+to|"
+    r"what\s+does|what\s+do|what\s+is|what's)?"
+    r"(?:\s+(?:the\s+)?(?:verses?|passage|chapter|text\s+of|words\s+of))?"
+)
+_LEAD_ES = (
+    r"(?:por\s+favor\s+)?(?:(?:puedes|podr[ií]as)\s+)?"
+    r"(?:l[eé]e(?:me|r)?|l[eé]eme|mu[eé]stra(?:me)?|mostrar|abre|cita(?:me)?|dame|busca(?:r)?|ir\s+a|"
+    r"qu[eé]\s+dice|qu[eé]\s+dicen)?"
+    r"(?:\s+(?:el|los|la)?\s*(?:vers[ií]culos?|pasaje|cap[ií]tulo|texto\s+de))?"
+)
+_TRAIL = r"(?:\s*(?:say|says|said|please|por\s+favor|dice|dicen))?"
+
+_LOOKUP_EN_RE = re.compile(rf"^\s*{_LEAD_EN}\s*(?P<refs>.+?){_TRAIL}\s*[?.!]*\s*$", re.IGNORECASE | re.UNICODE)
+_LOOKUP_ES_RE = re.compile(rf"^\s*[¿¡]?\s*{_LEAD_ES}\s*(?P<refs>.+?){_TRAIL}\s*[?.!]*\s*$", re.IGNORECASE | re.UNICODE)
+_SPANISH_HINT_RE = re.compile(r"[¿¡ñáéíóú]|\b(l[eé]eme|lee|mu[eé]strame|dame|cita|abre|busca|qu[eé] dice|por favor|vers[ií]culo|cap[ií]tulo)\b", re.IGNORECASE)
+_BOOK_TEXT_RE = re.compile(r"^\s*((?:[123]\s*)?[^\d]+)")
+
+ROUTE_STATS = {"local": 0, "model": 0, "not_found": 0, "local_ms": 0.0}
+
+_MESSAGES = {
+    "en": {"not_found": "I couldn’t find {ref} in this translation. Please check the chapter and verse."},
+    "es": {"not_found": "No encontré {ref} en esta traducción. Revisa el capítulo y el versículo."},
+}
+
+
+def _lookup_refs(message: str) -> List[str]:
+    """
+    Candidate reference parts of a lookup message (EN and ES phrasing, shortest first).
+    Empty if the message cannot be a pure lookup.
+    """
+    out: List[str] = []
+    for rx in (_LOOKUP_EN_RE, _LOOKUP_ES_RE):
+        m = rx.match(message or "")
+        if not m:
+            continue
+        refs = m.group("refs").strip().rstrip("?.!").strip()
+        # a reference needs a chapter number; "read Psalms" is not a lookup
+        if refs and re.search(r"\d", refs) and refs not in out:
+            out.append(refs)
+    return sorted(out, key=len)
+
+
+def _spanish_book(source: str, es_names: Dict[int, str], en_names: Dict[int, str], book_id: int) -> bool:
+    m = _BOOK_TEXT_RE.match(source or "")
+    key = normalize_book_name(m.group(1)) if m else ""
+    if len(key) < 3:
+        return False
+    es = normalize_book_name(es_names.get(book_id, ""))
+    en = normalize_book_name(en_names.get(book_id, ""))
+    return es.startswith(key) and not en.startswith(key)
+
+
+def _pick_lang(message: str, lang: str, refs_text: str) -> str:
+    if lang in VERSION_BY_LANG:
+        return lang
+    if _SPANISH_HINT_RE.search(message or ""):
+        return "es"
+    try:
+        es_names = bible_api.get_resolver(VERSION_BY_LANG["es"]).names
+        en_names = bible_api.get_resolver(VERSION_BY_LANG["en"]).names
+    except HTTPException:
+        return "en"
+    refs, _ = parse_references(refs_text, bible_api.get_resolver(VERSION_BY_LANG["en"]))
+    if refs and _spanish_book(refs[0].source, es_names, en_names, refs[0].book_id):
+        return "es"
+    return "en"
+
+
+def _format(passages: List[Dict[str, Any]], lang: str) -> str:
+    blocks = []
+    for p in passages:
+        if not p["found"]:
+            blocks.append(_MESSAGES[lang]["not_found"].format(ref=p["ref"]))
+        else:
+            blocks.append(f"{p['ref']}\n{p['text']}")
+    return "\n\n".join(blocks)
+
+
+def route_message(message: str, lang: str = "auto") -> Optional[Dict[str, Any]]:
+    """
+    Answer a pure scripture lookup locally, in the /chat response shape
+    ({"ok", "reply"} plus "source"/"version"/"passages"); None means "ask the model".
+    """
+    t0 = time.perf_counter()
+    reply = None
+    for refs_text in _lookup_refs(message):
+        try:
+            reply = _answer(message, lang, refs_text)
+        except HTTPException as e:
+            # unknown/ambiguous book, DB missing, too many refs: let the model handle it
+            log.info("route: lookup fell through (%s)", e.detail)
+            reply = None
+        if reply is not None:
+            break
+
+    ms = (time.perf_counter() - t0) * 1000
+    if reply is None:
+        ROUTE_STATS["model"] += 1
+        log.info("route: model (%.1f ms to decide)", ms)
+        return None
+
+    ROUTE_STATS["local"] += 1
+    ROUTE_STATS["local_ms"] += ms
+    if not all(p["found"] for p in reply["passages"]):
+        ROUTE_STATS["not_found"] += 1
+    log.info("route: local %s %d ref(s) in %.1f ms", reply["version"], len(reply["passages"]), ms)
+    return reply
+
+
+def _answer(message: str, lang: str, refs_text: str) -> Optional[Dict[str, Any]]:
+    lang = _pick_lang(message, (lang or "auto").strip().lower(), refs_text)
+    version = VERSION_BY_LANG[lang]
+
+    refs, bad = parse_references(refs_text, bible_api.get_resolver(version))
+    if not refs or bad:
+        return None
+
+    payload = bible_api.passages_payload(version, [refs_text])
+    if sum(len(p["verses"]) for p in payload["passages"]) > MAX_LOOKUP_VERSES:
+        return None
+    return {
+        "ok": True,
+        "reply": _format(payload["passages"], lang),
+        "source": "local",
+        "version": payload["version"],
+        "passages": payload["passages"],
+    }
+
+
+def stats() -> Dict[str, Any]:
+    st = dict(ROUTE_STATS)
+    total = st["local"] + st["model"]
+    st["local_share"] = round(st["local"] / total, 4) if total else 0.0
+    st["local_ms_avg"] = round(st.pop("local_ms") / st["local"], 2) if st["local"] else 0.0
+    return st
@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from fastapi import HTTPException, Request, Response
+
+try:
+    from zoneinfo import ZoneInfo
+except Exception:  # pragma: no cover - py<3.9
+    ZoneInfo = None
+
+import agent
+import bible_api
+from agent import run_bible_ai
+from response_cache import CachedBody, ResponseCache, dump_json
+from state_paths import state_path
+
+log = logging.getLogger(__name__)
+
+# Daily devotional + prayer, generated ahead of time.
+#
+# A background thread makes sure today and the next DAYS_AHEAD days have one
+# devotional and one prayer per language, written by run_bible_ai around that
+# day's verse (VERSE_OF_THE_DAY, text from the local Bible DB). Results go to a
+# small sqlite table; a 'pending' row with a claim time acts as a lease so several
+# workers don't generate the same entry. /devotional and /daily_prayer only read
+# that table: ETag + 304, and yesterday's entry if today's is not ready.
+
+KINDS = ("devotional", "prayer")
+LANGS = ("en", "es")
+VERSIONS = {"en": "en_default", "es": "rvr1909"}
+
+DAILY_ENABLED = (os.getenv("DAILY_PIPELINE") or "1").strip().lower() in ("1", "true", "yes", "on")
+DAYS_AHEAD = int(os.getenv("DAILY_DAYS_AHEAD") or "3")
+REFRESH_SECONDS = float(os.getenv("DAILY_REFRESH_SECONDS") or "1800")
+DAILY_TIMEZONE = (os.getenv("DAILY_TIMEZONE") or "UTC").strip()
+CLAIM_TTL_SECONDS = 600
+# Days to look back for a fallback entry.
+FALLBACK_DAYS = 7
+CACHE_CONTROL = "public, max-age=300"
+
+# Cycled by date; every reference exists in both translations.
+VERSE_OF_THE_DAY = (
+    "John 3:16", "Psalm 23:1-3", "Philippians 4:6-7", "Isaiah 41:10", "Romans 8:28",
+    "Proverbs 3:5-6", "Jeremiah 29:11", "Matthew 11:28-30", "Joshua 1:9", "Psalm 46:1",
+    "2 Corinthians 5:17", "Galatians 5:22-23", "Romans 12:2", "Hebrews 11:1", "1 Corinthians 13:4-7",
+    "Psalm 119:105", "Matthew 6:33-34", "Isaiah 40:31", "Lamentations 3:22-23", "Ephesians 2:8-9",
+    "1 John 1:9", "Psalm 27:1", "John 14:27", "Romans 15:13", "Colossians 3:23",
+    "James 1:5", "Micah 6:8", "Psalm 34:18", "Matthew 5:14-16", "John 15:5",
+    "2 Timothy 1:7", "Psalm 37:4-5", "1 Peter 5:7", "Hebrews 12:1-2", "Psalm 139:13-14",
+    "Romans 5:8", "Isaiah 26:3", "Philippians 4:13", "Psalm 91:1-2", "Zephaniah 3:17",
+    "John 16:33", "Matthew 22:37-39", "Psalm 51:10", "Ephesians 4:32", "Deuteronomy 31:6",
+    "Psalm 16:11", "1 Thessalonians 5:16-18", "Romans 10:9", "James 1:2-4", "Psalm 121:1-2",
+)
+
+_PROMPTS = {
+    "devotional": (
+        "Write today's short Christian devotional based on {ref}:\n\"{text}\"\n\n"
+        "Format: a short title on the first line, then 2-3 short paragraphs explaining the verse in context "
+        "and applying it to everyday life, then one reflection question. No prayer; no markdown headings."
+    ),
+    "prayer": (
+        "Write today's short prayer (4-6 sentences) inspired by {ref}:\n\"{text}\"\n\n"
+        "Warm and personal, addressed to God, ending with Amen. No title."
+    ),
+}
+
+_DB_LOCK = threading.Lock()
+_DB: Optional[sqlite3.Connection] = None
+_THREAD: Optional[threading.Thread] = None
+_STOP = threading.Event()
+# entries for the served (kind, lang, day)s; only a handful are live at a time
+_CACHE = ResponseCache(max_entries=64, max_bytes=4 * 1024 * 1024)
+
+STATS = {"generated": 0, "failed": 0, "served": 0, "fallbacks": 0, "not_modified": 0, "last_run": None}
+
+
+def db_path() -> Path:
+    return state_path("DAILY_DB", "daily.db")
+
+
+def _db() -> sqlite3.Connection:
+    global _DB
+    if _DB is None:
+        path = db_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(path), timeout=10, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily (
+                day TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                ref TEXT,
+                verse TEXT,
+                body TEXT,
+                model TEXT,
+                claimed REAL,
+                created REAL,
+                PRIMARY KEY (day, lang, kind)
+            )
+            """
+        )
+        con.commit()
+        _DB = con
+    return _DB
+
+
+def today() -> dt.date:
+    tz = None
+    if ZoneInfo is not None and DAILY_TIMEZONE:
+        try:
+            tz = ZoneInfo(DAILY_TIMEZONE)
+        except Exception:
+            tz = None
+    return dt.datetime.now(tz or dt.timezone.utc).date()
+
+
+def verse_of_the_day(day: dt.date, lang: str) -> Dict[str, str]:
+    ref = VERSE_OF_THE_DAY[day.toordinal() % len(VERSE_OF_THE_DAY)]
+    version = VERSIONS.get(lang, "en_default")
+    try:
+        p = bible_api.passages_payload(version, [ref])["passages"][0]
+        return {"ref": p["ref"], "text": p["text"], "version": version}
+    except (HTTPException, IndexError) as e:
+        log.warning("Verse of the day %s (%s) unavailable: %r", ref, version, e)
+        return {"ref": ref, "text": "", "version": version}
+
+
+# -----------------------------
+# Generation
+# -----------------------------
+def _claim(day: str, lang: str, kind: str) -> bool:
+    now = time.time()
+    with _DB_LOCK:
+        con = _db()
+        cur = con.execute(
+            """
+            INSERT INTO daily (day, lang, kind, status, claimed) VALUES (?, ?, ?, 'pending', ?)
+            ON CONFLICT (day, lang, kind) DO UPDATE SET claimed = excluded.claimed
+            WHERE daily.status = 'pending' AND daily.claimed < ?
+            """,
+            (day, lang, kind, now, now - CLAIM_TTL_SECONDS),
+        )
+        con.commit()
+        return cur.rowcount == 1
+
+
+def generate(day: dt.date, lang: str, kind: str) -> bool:
+    """
+    Generate one entry unless it is ready or another worker holds the claim.
+    """
+    key = day.isoformat()
+    if not _claim(key, lang, kind):
+        return False
+
+    verse = verse_of_the_day(day, lang)
+    t0 = time.perf_counter()
+    try:
+        body = run_bible_ai(_PROMPTS[kind].format(ref=verse["ref"], text=verse["text"] or verse["ref"]), lang=lang)
+    except Exception as e:
+        STATS["failed"] += 1
+        log.warning("Daily %s %s/%s failed: %r", kind, key, lang, e)
+        with _DB_LOCK:
+            _db().execute("DELETE FROM daily WHERE day=? AND lang=? AND kind=? AND status='pending'", (key, lang, kind))
+            _db().commit()
+        return False
+
+    with _DB_LOCK:
+        _db().execute(
+            """
+            UPDATE daily SET status='ready', ref=?, verse=?, body=?, model=?, created=?
+            WHERE day=? AND lang=? AND kind=?
+            """,
+            (verse["ref"], verse["text"], body.strip(), agent._model(), time.time(), key, lang, kind),
+        )
+        _db().commit()
+    STATS["generated"] += 1
+    log.info("Daily %s %s/%s generated in %.1fs", kind, key, lang, time.perf_counter() - t0)
+    return True
+
+
+def missing(days: int = DAYS_AHEAD) -> List[tuple]:
+    start = today()
+    wanted = [(start + dt.timedelta(days=i), lang, kind) for i in range(days + 1) for lang in LANGS for kind in KINDS]
+    with _DB_LOCK:
+        ready = {
+            (r["day"], r["lang"], r["kind"])
+            for r in _db().execute("SELECT day, lang, kind FROM daily WHERE status='ready' AND day >= ?", (start.isoformat(),))
+        }
+    return [w for w in wanted if (w[0].isoformat(), w[1], w[2]) not in ready]
+
+
+def run_once() -> int:
+    """
+    Fill today + DAYS_AHEAD; returns how many entries were generated.
+    """
+    n = 0
+    for day, lang, kind in missing():
+        if _STOP.is_set():
+            break
+        n += 1 if generate(day, lang, kind) else 0
+    STATS["last_run"] = int(time.time())
+    return n
+
+
+def _loop() -> None:
+    while not _STOP.is_set():
+        try:
+            run_once()
+        except Exception as e:
+            log.error("Daily pipeline run failed: %r", e)
+        _STOP.wait(REFRESH_SECONDS)
+
+
+def start() -> None:
+    global _THREAD
+    if not DAILY_ENABLED or (_THREAD is not None and _THREAD.is_alive()):
+        return
+    _STOP.clear()
+    _THREAD = threading.Thread(target=_loop, name="daily-content", daemon=True)
+    _THREAD.start()
+
+
+def stop() -> None:
+    global _DB
+    _STOP.set()
+    if _THREAD is not None:
+        _THREAD.join(timeout=5)
+        if _THREAD.is_alive():
+            # still waiting on Gemini; it's a daemon thread, leave the DB to it
+            log.warning("Daily pipeline still generating at shutdown; not closing its DB")
+            return
+    with _DB_LOCK:
+        if _DB is not None:
+            _DB.close()
+            _DB = None
+
+
+# -----------------------------
+# Serving
+# -----------------------------
+def get_entry(kind: str, lang: str, day: dt.date) -> Optional[sqlite3.Row]:
+    """
+    The ready entry for `day`, else the newest ready one from the FALLBACK_DAYS before it.
+    """
+    with _DB_LOCK:
+        return _db().execute(
+            """
+            SELECT day, lang, kind, ref, verse, body FROM daily
+            WHERE kind=? AND lang=? AND status='ready' AND day <= ? AND day >= ?
+            ORDER BY day DESC LIMIT 1
+            """,
+            (kind, lang, day.isoformat(), (day - dt.timedelta(days=FALLBACK_DAYS)).isoformat()),
+        ).fetchone()
+
+
+def daily_response(request: Request, kind: str, lang: Optional[str], date: Optional[str]) -> Response:
+    lang = (lang or "en").strip().lower()
+    if lang not in LANGS:
+        lang = "en"
+    if date:
+        try:
+            day = dt.date.fromisoformat(date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+        if day > today() + dt.timedelta(days=DAYS_AHEAD):
+            raise HTTPException(status_code=404, detail="Not published yet.")
+    else:
+        day = today()
+
+    field = "devotional" if kind == "devotional" else "prayer"
+    row = get_entry(kind, lang, day)
+    if row is None:
+        payload = {"ok": True, field: "Coming soon.", "date": day.isoformat(), "lang": lang, "fallback": True}
+    else:
+        payload = {
+            "ok": True,
+            field: row["body"],
+            "date": row["day"],
+            "lang": lang,
+            "ref": row["ref"],
+            "verse": row["verse"],
+            "fallback": row["day"] != day.isoformat(),
+        }
+    if payload["fallback"]:
+        STATS["fallbacks"] += 1
+
+    raw = dump_json(payload)
+    etag = '"' + hashlib.sha256(raw).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if bible_api._etag_matches(request.headers.get("if-none-match") or "", etag):
+        STATS["not_modified"] += 1
+        _CACHE.record_not_modified(len(raw))
+        return Response(status_code=304, headers=headers)
+
+    key = f"{kind}:{lang}:{day.isoformat()}"
+    item = _CACHE.get(key)
+    if item is None or item.etag != etag:
+        item = CachedBody(etag, raw)
+        _CACHE.put(key, item)
+    body, encoding = item.encoded(request.headers.get("accept-encoding") or "")
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    _CACHE.record_sent(len(item.raw), len(body))
+    STATS["served"] += 1
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def stats() -> Dict[str, Any]:
+    st = dict(STATS)
+    st["enabled"] = DAILY_ENABLED
+    st["days_ahead"] = DAYS_AHEAD
+    st["cache"] = _CACHE.stats()
+    try:
+        st["missing"] = len(missing())
+    except sqlite3.Error:
+        st["missing"] = None
+    return st
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable, NamedTuple, Tuple
+
+from state_paths import state_path
+
+log = logging.getLogger(__name__)
+
+# Local copy of who is subscribed, so /me doesn't call Stripe.
+#
+# Stripe webhooks (customer.subscription.* and checkout.session.completed) keep
+# one row per customer: subscription status and current period end. /me reads
+# that row. Only when a customer is unknown, or their paid period has run out
+# without a renewal event, is Stripe asked directly (the `refresh` callable), and
+# at most once per REFRESH_TTL_SECONDS per customer; "no subscription" answers
+# are stored too (rechecked after NEGATIVE_TTL_SECONDS), so unknown customers
+# don't turn every /me into a Stripe call.
+
+ENTITLED_STATUSES = ("active", "trialing")
+REFRESH_TTL_SECONDS = float(os.getenv("ENTITLEMENT_REFRESH_TTL") or "3600")
+# Our own "not subscribed" lookups are redone sooner (the webhook may be missing).
+NEGATIVE_TTL_SECONDS = float(os.getenv("ENTITLEMENT_NEGATIVE_TTL") or "60")
+# A renewal event can land a little after the period ends.
+GRACE_SECONDS = float(os.getenv("ENTITLEMENT_GRACE_SECONDS") or "3600")
+
+_DB_LOCK = threading.Lock()
+_DB: Optional[sqlite3.Connection] = None
+
+STATS = {"lookups": 0, "local_hits": 0, "refreshes": 0, "refresh_errors": 0, "events": 0, "events_stale": 0}
+
+
+class Entitlement(NamedTuple):
+    customer_id: str
+    status: str
+    period_end: Optional[int]
+    subscription_id: str
+    event_created: int
+    checked: float
+    source: str
+
+    @property
+    def entitled(self) -> bool:
+        if self.status not in ENTITLED_STATUSES:
+            return False
+        return self.period_end is None or time.time() < self.period_end + GRACE_SECONDS
+
+
+def db_path() -> Path:
+    return state_path("ENTITLEMENTS_DB", "entitlements.db")
+
+
+def _db() -> sqlite3.Connection:
+    global _DB
+    if _DB is None:
+        path = db_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(path), timeout=10, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entitlements (
+                customer_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                period_end INTEGER,
+                subscription_id TEXT NOT NULL DEFAULT '',
+                event_created INTEGER NOT NULL DEFAULT 0,
+                checked REAL NOT NULL,
+                source TEXT NOT NULL
+            )
+            """
+        )
+        con.commit()
+        _DB = con
+    return _DB
+
+
+def close() -> None:
+    global _DB
+    with _DB_LOCK:
+        if _DB is not None:
+            _DB.close()
+            _DB = None
+
+
+def get(customer_id: str) -> Optional[Entitlement]:
+    with _DB_LOCK:
+        row = _db().execute(
+            "SELECT customer_id, status, period_end, subscription_id, event_created, checked, source "
+            "FROM entitlements WHERE customer_id=?",
+            (customer_id,),
+        ).fetchone()
+    return Entitlement(*row) if row else None
+
+
+def record(
+    customer_id: str,
+    status: str,
+    period_end: Optional[int] = None,
+    subscription_id: str = "",
+    event_created: int = 0,
+    source: str = "stripe",
+) -> bool:
+    """
+    Store a customer's subscription state; False if it was ignored as stale.
+
+    Events older than the stored one are dropped (Stripe doesn't deliver in order),
+    and a non-entitling update about some other subscription doesn't override an
+    entitling one (a canceled old plan next to a current one).
+    """
+    if not customer_id:
+        return False
+    with _DB_LOCK:
+        con = _db()
+        old = con.execute(
+            "SELECT status, subscription_id, event_created FROM entitlements WHERE customer_id=?",
+            (customer_id,),
+        ).fetchone()
+        if old is not None and event_created:
+            old_status, old_sub, old_created = old
+            if event_created < old_created:
+                return False
+            if (
+                subscription_id
+                and old_sub
+                and subscription_id != old_sub
+                and old_status in ENTITLED_STATUSES
+                and status not in ENTITLED_STATUSES
+            ):
+                return False
+        con.execute(
+            """
+            INSERT INTO entitlements (customer_id, status, period_end, subscription_id, event_created, checked, source)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (customer_id) DO UPDATE SET
+                status=excluded.status,
+                period_end=excluded.period_end,
+                subscription_id=excluded.subscription_id,
+                event_created=max(entitlements.event_created, excluded.event_created),
+                checked=excluded.checked,
+                source=excluded.source
+            """,
+            (customer_id, status, period_end, subscription_id or "", int(event_created or 0), time.time(), source),
+        )
+        con.commit()
+    return True
+
+
+def period_end_of(sub: Dict[str, Any]) -> Optional[int]:
+    # Top-level on older API versions, per subscription item on newer ones.
+    end = sub.get("current_period_end")
+    if not end:
+        items = (sub.get("items") or {}).get("data") or []
+        ends = [i.get("current_period_end") for i in items if i.get("current_period_end")]
+        end = max(ends) if ends else None
+    return int(end) if end else None
+
+
+def apply_event(event: Dict[str, Any]) -> Optional[str]:
+    """
+    Update the table from a verified Stripe event; the customer id it touched, if any.
+    """
+    etype = str(event.get("type") or "")
+    obj = (event.get("data") or {}).get("object") or {}
+    created = int(event.get("created") or 0)
+    customer = obj.get("customer")
+    customer_id = str(customer.get("id") if isinstance(customer, dict) else customer or "")
+    if not customer_id:
+        return None
+
+    if etype.startswith("customer.subscription."):
+        status = "canceled" if etype == "customer.subscription.deleted" else str(obj.get("status") or "")
+        applied = record(customer_id, status, period_end_of(obj), str(obj.get("id") or ""), created, source=etype)
+    elif etype == "checkout.session.completed":
+        old = get(customer_id)
+        if obj.get("mode") != "subscription" or (old is not None and old.source.startswith("customer.subscription.")):
+            # subscription events carry the real state; this only fills the gap until they arrive
+            return None
+        paid = obj.get("payment_status") in ("paid", "no_payment_required")
+        sub = obj.get("subscription")
+        sub_id = str(sub.get("id") if isinstance(sub, dict) else sub or "")
+        applied = record(customer_id, "active" if paid else "incomplete", None, sub_id, created, source=etype)
+    else:
+        return None
+
+    STATS["events"] += 1
+    if not applied:
+        STATS["events_stale"] += 1
+        return None
+    log.info("entitlement: %s <- %s", customer_id, etype)
+    return customer_id
+
+
+def is_subscribed(customer_id: str, refresh: Optional[Callable[[str], Tuple[str, Optional[int], str]]] = None) -> bool:
+    """
+    Local answer for /me. `refresh(customer_id) -> (status, period_end, subscription_id)`
+    asks Stripe; it is only called for unknown customers, lapsed periods and our own
+    stale "not subscribed" answers, once per TTL.
+    """
+    STATS["lookups"] += 1
+    if not customer_id:
+        return False
+    ent = get(customer_id)
+    now = time.time()
+    if ent is None:
+        ttl = 0.0
+    elif ent.entitled:
+        ttl = None
+    elif ent.status in ENTITLED_STATUSES:
+        ttl = REFRESH_TTL_SECONDS  # period ran out and no renewal event came
+    elif ent.source == "stripe":
+        ttl = NEGATIVE_TTL_SECONDS  # "not subscribed" from our own lookup; they may subscribe any minute
+    else:
+        ttl = None  # a webhook said so
+    if ttl is None or refresh is None or (ent is not None and now - ent.checked < ttl):
+        STATS["local_hits"] += 1
+        return bool(ent and ent.entitled)
+
+    STATS["refreshes"] += 1
+    try:
+        status, period_end, sub_id = refresh(customer_id)
+    except Exception as e:
+        STATS["refresh_errors"] += 1
+        log.warning("entitlement refresh failed: %r", e)
+        return bool(ent and ent.entitled)
+    record(customer_id, status or "none", period_end, sub_id, source="stripe")
+    return status in ENTITLED_STATUSES and (period_end is None or now < period_end + GRACE_SECONDS)
+
+
+def stats() -> Dict[str, Any]:
+    st = dict(STATS)
+    st["refresh_ttl_seconds"] = REFRESH_TTL_SECONDS
+    try:
+        with _DB_LOCK:
+            st["customers"] = _db().execute("SELECT COUNT(*) FROM entitlements").fetchone()[0]
+            st["entitled"] = _db().execute(
+                "SELECT COUNT(*) FROM entitlements WHERE status IN ('active', 'trialing')"
+            ).fetchone()[0]
+    except sqlite3.Error:
+        st["customers"] = st["entitled"] = None
+    return st
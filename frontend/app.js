@@ -486,6 +486,52 @@
     return data;
   }
 
+  // POST that answers with Server-Sent Events (event: delta/done/error).
+  // Calls onDelta(text) per chunk and resolves with the "done" payload.
+  async function apiStream(path, body, onDelta, opts = {}) {
+    const res = await fetch(path, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", Accept: "text/event-stream", ...(opts.headers || {}) },
+      body: JSON.stringify(body || {}),
+      ...opts,
+    });
+    if (!res.ok || !res.body) {
+      let data = null;
+      try { data = await res.json(); } catch {}
+      const msg = (data && (data.detail || data.error)) || `HTTP ${res.status}`;
+      throw new Error(msg);
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buf = "";
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += decoder.decode(value, { stream: true });
+
+      let idx;
+      while ((idx = buf.indexOf("\n\n")) >= 0) {
+        const block = buf.slice(0, idx);
+        buf = buf.slice(idx + 2);
+
+        let event = "message";
+        const dataLines = [];
+        for (const line of block.split("\n")) {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+        }
+        if (!dataLines.length) continue; // heartbeat comment
+
+        const data = safeJsonParse(dataLines.join("\n"), {});
+        if (event === "delta") onDelta && onDelta(String(data.text || ""));
+        else if (event === "done") return data;
+        else if (event === "error") throw new Error(data.detail || "Stream failed");
+      }
+    }
+    throw new Error("Stream ended early");
+  }
+
   // ---------------------------
   // Tabs
   // ---------------------------
@@ -743,6 +789,7 @@
     chat.appendChild(row);
 
     chat.scrollTop = chat.scrollHeight;
+    return bubble;
   }
 
   function loadSavedChats() {
@@ -819,9 +866,18 @@
         localStorage.setItem(LS.chatDraft, "");
 
         try {
-          const out = await apiPost("/chat", { message: msg, lang });
-          const reply = out?.reply || "…";
-          addBubble("bot", reply);
+          let bubble = null;
+          let text = "";
+          const out = await apiStream("/chat/stream", { message: msg, lang }, (chunk) => {
+            text += chunk;
+            if (!bubble) bubble = addBubble("bot", text);
+            else bubble.textContent = text;
+            const chat = $("#chat");
+            if (chat) chat.scrollTop = chat.scrollHeight;
+          });
+          const reply = out?.reply || text || "…";
+          if (bubble) bubble.textContent = reply;
+          else addBubble("bot", reply);
         } catch (err) {
           console.error(err);
           addBubble("system", "Error: " + String(err.message || err));
@@ -889,6 +945,26 @@
     return (readingVoice === "es") ? "es" : "en_default";
   }
 
+  // Whole book/chapter/verse outline per version, fetched once.
+  // bibleStructure[version].get(bookId) = [verse count of chapter 1, chapter 2, ...]
+  const bibleStructure = {};
+
+  async function getBibleStructure(version) {
+    if (!bibleStructure[version]) {
+      bibleStructure[version] = apiGet(`/bible/structure?version=${encodeURIComponent(version)}`)
+        .then((data) => {
+          const byBook = new Map();
+          for (const b of (data?.books || [])) byBook.set(Number(b.id), b.chapters || []);
+          return byBook;
+        })
+        .catch((e) => {
+          delete bibleStructure[version];
+          throw e;
+        });
+    }
+    return bibleStructure[version];
+  }
+
   async function refreshBibleStatus() {
     const ui = getUILang();
     const t = I18N[ui];
@@ -960,8 +1036,14 @@
       const rv = ($("#readingVoice")?.value || "en").trim().toLowerCase();
       const version = bibleVersionForReadingVoice(rv);
 
-      const data = await apiGet(`/bible/chapters?version=${encodeURIComponent(version)}&book_id=${bid}`);
-      const chapters = data?.chapters || [];
+      let chapters = [];
+      try {
+        const counts = (await getBibleStructure(version)).get(bid) || [];
+        chapters = counts.map((_, i) => i + 1);
+      } catch {
+        const data = await apiGet(`/bible/chapters?version=${encodeURIComponent(version)}&book_id=${bid}`);
+        chapters = data?.chapters || [];
+      }
 
       chapSel.innerHTML = `<option value="">—</option>`;
       for (const c of chapters) {
@@ -993,8 +1075,14 @@
       const rv = ($("#readingVoice")?.value || "en").trim().toLowerCase();
       const version = bibleVersionForReadingVoice(rv);
 
-      const data = await apiGet(`/bible/verses_max?version=${encodeURIComponent(version)}&book_id=${bid}&chapter=${ch}`);
-      const maxV = parseInt(data?.max_verse || "0", 10) || 0;
+      let maxV = 0;
+      try {
+        const counts = (await getBibleStructure(version)).get(bid) || [];
+        maxV = parseInt(counts[ch - 1] || "0", 10) || 0;
+      } catch {
+        const data = await apiGet(`/bible/verses_max?version=${encodeURIComponent(version)}&book_id=${bid}&chapter=${ch}`);
+        maxV = parseInt(data?.max_verse || "0", 10) || 0;
+      }
 
       vsSel.innerHTML = `<option value="">—</option>`;
       veSel.innerHTML = `<option value="">(optional)</option>`;
@@ -1550,6 +1638,11 @@
         reg.waiting.postMessage({ type: "SKIP_WAITING" });
       }
 
+      // Download / refresh the offline Bible in the background
+      navigator.serviceWorker.ready
+        .then((r) => r.active && r.active.postMessage({ type: "SYNC_BIBLE" }))
+        .catch(() => {});
+
       reg.addEventListener("updatefound", () => {
         const sw = reg.installing;
         if (!sw) return;
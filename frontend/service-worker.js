@@ -1,13 +1,19 @@
 // frontend/service-worker.js
-const CACHE_NAME = "alyana-cache-v6";
+const CACHE_NAME = "alyana-cache-v8";
 
 // Cache-bust app.js so new deployments load immediately
 const PRECACHE_URLS = [
   "/",
-  "/app.js?v=6",
+  "/app.js?v=9",
   "/manifest.webmanifest",
 ];
 
+// Offline Bible: per-book bundles from /bible/bundle/*, synced in the background.
+// Kept in its own cache so app deployments don't throw the corpus away.
+const BIBLE_CACHE = "alyana-bible-v1";
+const BIBLE_VERSIONS = ["en_default", "es"];
+const BIBLE_FETCH_CONCURRENCY = 4;
+
 self.addEventListener("install", (event) => {
   self.skipWaiting();
   event.waitUntil(
@@ -18,7 +24,8 @@ self.addEventListener("install", (event) => {
 self.addEventListener("activate", (event) => {
   event.waitUntil((async () => {
     const keys = await caches.keys();
-    await Promise.all(keys.map((k) => (k !== CACHE_NAME ? caches.delete(k) : Promise.resolve())));
+    const keep = [CACHE_NAME, BIBLE_CACHE];
+    await Promise.all(keys.map((k) => (!keep.includes(k) ? caches.delete(k) : Promise.resolve())));
     await self.clients.claim();
   })());
 });
@@ -27,8 +34,169 @@ self.addEventListener("message", (event) => {
   if (event?.data?.type === "SKIP_WAITING") {
     try { self.skipWaiting(); } catch {}
   }
+  if (event?.data?.type === "SYNC_BIBLE") {
+    const versions = event.data.versions || BIBLE_VERSIONS;
+    event.waitUntil(Promise.all(versions.map((v) => syncBible(v).catch(() => {}))));
+  }
 });
 
+// ---------------------------
+// Offline Bible bundles
+// ---------------------------
+const bibleManifests = new Map();   // version -> manifest
+let bibleBookMemo = null;           // { url, rows } of the last book parsed
+
+function bibleManifestKey(version) {
+  return `/__bible__/manifest/${encodeURIComponent(version)}`;
+}
+
+async function getBibleManifest(version) {
+  if (bibleManifests.has(version)) return bibleManifests.get(version);
+  const cache = await caches.open(BIBLE_CACHE);
+  const res = await cache.match(bibleManifestKey(version));
+  const m = res ? await res.json() : null;
+  if (m) bibleManifests.set(version, m);
+  return m;
+}
+
+async function syncBible(version) {
+  const cache = await caches.open(BIBLE_CACHE);
+  const current = await getBibleManifest(version);
+
+  const mRes = await fetch(`/bible/bundle/manifest?version=${encodeURIComponent(version)}`);
+  if (!mRes.ok) return;
+  const manifest = await mRes.json();
+  if (current && current.bundle === manifest.bundle) return;
+
+  // Only the books that changed since the bundle we hold (everything on first sync)
+  let changed = manifest.books;
+  let removed = [];
+  if (current) {
+    const dRes = await fetch(
+      `/bible/bundle/delta?version=${encodeURIComponent(version)}&from=${encodeURIComponent(current.bundle)}`
+    );
+    if (dRes.ok) {
+      const delta = await dRes.json();
+      if (delta.to === manifest.bundle) {
+        changed = delta.changed || [];
+        removed = delta.removed || [];
+      }
+    }
+  }
+
+  const queue = changed.slice();
+  async function worker() {
+    while (queue.length) {
+      const b = queue.shift();
+      const url = manifest.base_url + b.file;
+      if (await cache.match(url)) continue;
+      const res = await fetch(url);
+      if (!res.ok) throw new Error(`bundle ${url}: HTTP ${res.status}`);
+      await cache.put(url, res);
+    }
+  }
+  await Promise.all(Array.from({ length: BIBLE_FETCH_CONCURRENCY }, worker));
+
+  // Switch to the new manifest only once every file it needs is cached
+  await cache.put(
+    bibleManifestKey(version),
+    new Response(JSON.stringify(manifest), { headers: { "Content-Type": "application/json" } })
+  );
+  bibleManifests.set(version, manifest);
+
+  if (current) {
+    const live = new Set(manifest.books.map((b) => manifest.base_url + b.file));
+    const stale = current.books
+      .filter((b) => removed.includes(b.id) || !live.has(current.base_url + b.file))
+      .map((b) => current.base_url + b.file);
+    await Promise.all(stale.filter((u) => !live.has(u)).map((u) => cache.delete(u)));
+  }
+}
+
+async function loadBibleBook(manifest, book) {
+  const url = manifest.base_url + book.file;
+  if (bibleBookMemo && bibleBookMemo.url === url) return bibleBookMemo.rows;
+  const cache = await caches.open(BIBLE_CACHE);
+  const res = await cache.match(url);
+  if (!res) return null;
+  const rows = (await res.text()).split("\n").filter(Boolean).map((line) => JSON.parse(line));
+  bibleBookMemo = { url, rows };
+  return rows;
+}
+
+function jsonResponse(data) {
+  return new Response(JSON.stringify(data), { headers: { "Content-Type": "application/json" } });
+}
+
+// Answer /bible/* reads from the bundle, in the same shape as the server.
+// Returns null when the bundle can't answer (not synced yet, book given by name, ...).
+async function bibleFromBundle(url) {
+  const p = url.searchParams;
+  const version = (p.get("version") || "en_default").trim() || "en_default";
+  const manifest = await getBibleManifest(version);
+  if (!manifest) return null;
+
+  if (url.pathname === "/bible/books") {
+    return jsonResponse({ version, books: manifest.books.map((b) => ({ id: b.id, name: b.name })) });
+  }
+  if (url.pathname === "/bible/structure") {
+    return jsonResponse({
+      version,
+      books: manifest.books.map((b) => ({ id: b.id, name: b.name, chapters: b.chapters })),
+    });
+  }
+
+  const bookId = parseInt(p.get("book_id") || "", 10);
+  const book = manifest.books.find((b) => b.id === bookId);
+  if (!book) return null;
+
+  if (url.pathname === "/bible/chapters") {
+    if (!book.chapters.length) return null;
+    return jsonResponse({ version, book_id: bookId, chapters: book.chapters.map((_, i) => i + 1) });
+  }
+
+  const chapter = parseInt(p.get("chapter") || "", 10);
+  if (!chapter) return null;
+
+  if (url.pathname === "/bible/verses_max") {
+    const m = book.chapters[chapter - 1] || 0;
+    if (!m) return null;
+    return jsonResponse({ version, book_id: bookId, chapter, max_verse: m });
+  }
+
+  if (url.pathname === "/bible/text") {
+    const rows = await loadBibleBook(manifest, book);
+    if (!rows) return null;
+
+    let vs = parseInt(p.get("verse_start") || "", 10) || null;
+    let ve = parseInt(p.get("verse_end") || "", 10) || null;
+    const whole = p.get("whole_chapter") === "true" || (vs === null && ve === null);
+    if (!whole) {
+      vs = vs || 1;
+      ve = ve || vs;
+      if (ve < vs) [vs, ve] = [ve, vs];
+    }
+
+    const verses = rows
+      .filter(([c, v]) => c === chapter && (whole || (v >= vs && v <= ve)))
+      .map(([, v, text]) => ({ verse: v, text }));
+    if (!verses.length) return null;
+
+    return jsonResponse({
+      version,
+      book_id: bookId,
+      book: book.name,
+      chapter,
+      verses,
+      text: verses.map((v) => `${v.verse}. ${v.text}`).join("\n"),
+    });
+  }
+
+  return null;
+}
+
+const BIBLE_LOCAL_PATHS = ["/bible/books", "/bible/structure", "/bible/chapters", "/bible/verses_max", "/bible/text"];
+
 // Network-first for HTML, cache-first for other assets
 self.addEventListener("fetch", (event) => {
   const req = event.request;
@@ -36,6 +204,26 @@ self.addEventListener("fetch", (event) => {
 
   if (url.origin !== self.location.origin) return;
 
+  // Chat, Stripe etc. go straight to the network (and streams stay unbuffered)
+  if (req.method !== "GET") return;
+
+  // Bible reads: local bundle first, then the network
+  if (req.method === "GET" && BIBLE_LOCAL_PATHS.includes(url.pathname)) {
+    event.respondWith((async () => {
+      try {
+        const local = await bibleFromBundle(url);
+        if (local) return local;
+      } catch {}
+      try {
+        return await fetch(req);
+      } catch {
+        const cached = await caches.match(req);
+        return cached || new Response(JSON.stringify({ detail: "Offline" }), { status: 504 });
+      }
+    })());
+    return;
+  }
+
   const accept = req.headers.get("accept") || "";
   const isHTML = accept.includes("text/html");
 
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+# Brotli is optional (pip install brotli); gzip is always available.
+try:
+    import brotli  # type: ignore
+except Exception:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing.
+MIN_COMPRESS_BYTES = 512
+
+
+def dump_json(content: Any) -> bytes:
+    # Same serialization as fastapi.responses.JSONResponse
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class CachedBody:
+    """
+    One serialized response plus its pre-compressed variants.
+    """
+
+    __slots__ = ("etag", "raw", "gzip", "br")
+
+    def __init__(self, etag: str, raw: bytes):
+        self.etag = etag
+        self.raw = raw
+        self.gzip: Optional[bytes] = None
+        self.br: Optional[bytes] = None
+        if len(raw) >= MIN_COMPRESS_BYTES:
+            self.gzip = gzip.compress(raw, compresslevel=6, mtime=0)
+            if brotli is not None:
+                self.br = brotli.compress(raw, quality=5)
+
+    @property
+    def size(self) -> int:
+        return len(self.raw) + len(self.gzip or b"") + len(self.br or b"")
+
+    def encoded(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """
+        Best variant for the client's Accept-Encoding: (body, content-encoding or None).
+        """
+        accepted = {p.split(";", 1)[0].strip().lower() for p in (accept_encoding or "").split(",")}
+        if self.br is not None and "br" in accepted:
+            return self.br, "br"
+        if self.gzip is not None and ("gzip" in accepted or "*" in accepted):
+            return self.gzip, "gzip"
+        return self.raw, None
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU of CachedBody, bounded by entry count and total bytes.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self._items: "OrderedDict[str, CachedBody]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+
+    def get(self, key: str) -> Optional[CachedBody]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def peek(self, key: str) -> Optional[CachedBody]:
+        with self._lock:
+            return self._items.get(key)
+
+    def put(self, key: str, item: CachedBody) -> None:
+        if item.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._items[key] = item
+            self._bytes += item.size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, dropped = self._items.popitem(last=False)
+                self._bytes -= dropped.size
+                self.evictions += 1
+
+    def record_sent(self, raw_len: int, sent_len: int) -> None:
+        with self._lock:
+            self.bytes_sent += sent_len
+            self.bytes_saved += max(0, raw_len - sent_len)
+
+    def record_not_modified(self, raw_len: int) -> None:
+        with self._lock:
+            self.not_modified += 1
+            self.bytes_saved += raw_len
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "bytes_sent": self.bytes_sent,
+                "bytes_saved": self.bytes_saved,
+                "brotli": brotli is not None,
+            }
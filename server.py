@@ -1,21 +1,35 @@
 from pathlib import Path
+import logging
 import time
-import traceback
+import asyncio
 import os
 import json
 import base64
 import hmac
 import hashlib
+from typing import Optional
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 # Bible API router
+import bible_api
 from bible_api import router as bible_router
 
 # AI brain
-from agent import run_bible_ai
+import agent
+import chat_router
+import daily_content
+import entitlements
+import stripe_client
+import webhook_queue
+from admin_auth import require_admin
+from session_store import open_session_store
+from agent import run_bible_ai_async, stream_bible_ai, ChatBusyError, ChatTimeoutError, ChatUnavailableError
+
+log = logging.getLogger(__name__)
 
 # Stripe (requires: pip install stripe)
 try:
@@ -44,11 +58,19 @@ STRIPE_PRICE_ID = (os.getenv("STRIPE_PRICE_ID") or "").strip()
 STRIPE_WEBHOOK_SECRET = (os.getenv("STRIPE_WEBHOOK_SECRET") or "").strip()
 JWT_SECRET = (os.getenv("JWT_SECRET") or "").strip()  # used for signed session tokens
 
+# INFO by default so request/pipeline logs show up next to uvicorn's
+logging.basicConfig(
+    level=(os.getenv("LOG_LEVEL") or "INFO").strip().upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+# one line per Gemini/Stripe HTTP request is noise
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
 # ✅ IMPORTANT: default to 0 (no trial)
 TRIAL_DAYS = int(os.getenv("TRIAL_DAYS") or "0")
 
 if STRIPE_SECRET_KEY and stripe:
-    stripe.api_key = STRIPE_SECRET_KEY
+    stripe_client.configure(STRIPE_SECRET_KEY)
 
 # -----------------------------
 # App
@@ -56,6 +78,26 @@ if STRIPE_SECRET_KEY and stripe:
 app = FastAPI()
 app.include_router(bible_router)
 
+
+@app.on_event("startup")
+def _startup():
+    bible_api.startup()
+    daily_content.start()
+    if STRIPE_WEBHOOK_SECRET:
+        webhook_queue.start(_handle_stripe_event)
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await stripe_client.aclose()
+    bible_api.shutdown()
+    daily_content.stop()
+    agent.ANSWER_CACHE.close()
+    CHAT_SESSIONS.close()
+    webhook_queue.stop()
+    entitlements.close()
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -65,11 +107,22 @@ app.add_middleware(
 )
 
 # -----------------------------
-# Simple in-memory chat memory
+# Chat memory
 # -----------------------------
-CHAT_SESSIONS = {}
 SESSION_TTL_SECONDS = 60 * 60 * 6  # 6 hours
 MAX_HISTORY = 30
+MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS") or "10000")
+MAX_SESSION_MB = float(os.getenv("CHAT_SESSIONS_MAX_MB") or "64")
+
+# CHAT_SESSION_DB=/path/sessions.db shares sessions between workers and restarts
+# (there the session/MB caps are soft: enforced by its periodic sweep)
+CHAT_SESSIONS = open_session_store(
+    (os.getenv("CHAT_SESSION_DB") or "").strip() or None,
+    ttl_seconds=SESSION_TTL_SECONDS,
+    max_history=MAX_HISTORY,
+    max_sessions=MAX_SESSIONS,
+    max_bytes=int(MAX_SESSION_MB * 1024 * 1024),
+)
 
 
 def _session_key(req: Request) -> str:
@@ -78,33 +131,19 @@ def _session_key(req: Request) -> str:
     return f"{ip}::{ua}"
 
 
-def _cleanup_sessions():
-    now = time.time()
-    dead = []
-    for k, v in CHAT_SESSIONS.items():
-        last = v.get("ts") or 0
-        if now - last > SESSION_TTL_SECONDS:
-            dead.append(k)
-    for k in dead:
-        CHAT_SESSIONS.pop(k, None)
+# The session store may read its sqlite file, so the handlers reach it through the threadpool.
+async def _get_history(req: Request) -> list:
+    # A copy: later pushes don't change what was handed to the agent
+    return await run_in_threadpool(CHAT_SESSIONS.history, _session_key(req))
 
 
-def _get_history(req: Request) -> list:
-    _cleanup_sessions()
-    key = _session_key(req)
-    sess = CHAT_SESSIONS.get(key)
-    if not sess:
-        sess = {"ts": time.time(), "history": []}
-        CHAT_SESSIONS[key] = sess
-    sess["ts"] = time.time()
-    return sess["history"]
+async def _get_memory(req: Request) -> dict:
+    # Rolling summary of turns that no longer fit the context budget (see agent.build_context)
+    return await run_in_threadpool(CHAT_SESSIONS.memory, _session_key(req))
 
 
-def _push_history(req: Request, role: str, content: str):
-    h = _get_history(req)
-    h.append({"role": role, "content": content})
-    if len(h) > MAX_HISTORY:
-        del h[:-MAX_HISTORY]
+async def _push_history(req: Request, role: str, content: str):
+    await run_in_threadpool(CHAT_SESSIONS.append, _session_key(req), role, content)
 
 
 # -----------------------------
@@ -190,31 +229,20 @@ def _require_auth(req: Request) -> dict:
     return payload
 
 
-def _stripe_customer_by_email(email: str):
+def _stripe_subscription_state(customer_id: str) -> tuple:
+    """
+    (status, current_period_end, subscription_id) of the customer's best subscription,
+    straight from Stripe; ("none", None, "") if they have none. Blocking: /me runs it
+    in the thread pool.
+    """
     _require_stripe_ready()
-    email = (email or "").strip().lower()
-    if not email or "@" not in email:
-        raise HTTPException(status_code=400, detail="Invalid email")
-    customers = stripe.Customer.list(email=email, limit=1)
-    if not customers or not customers.data:
-        return None
-    return customers.data[0]
-
-
-def _stripe_has_active_or_trialing_subscription(customer_id: str) -> bool:
-    _require_stripe_ready()
-    if not customer_id:
-        return False
+    return stripe_client.subscription_state_sync(customer_id)
 
-    subs = stripe.Subscription.list(customer=customer_id, status="all", limit=20)
-    if not subs or not subs.data:
-        return False
 
-    for s in subs.data:
-        st = str(getattr(s, "status", "") or "")
-        if st in ("active", "trialing"):
-            return True
-    return False
+async def _stripe_subscribed_now(customer_id: str) -> bool:
+    status, period_end, sub_id = await stripe_client.subscription_state(customer_id)
+    await asyncio.to_thread(entitlements.record, customer_id, status, period_end, sub_id, source="stripe")
+    return status in entitlements.ENTITLED_STATUSES
 
 
 # -----------------------------
@@ -233,11 +261,14 @@ def me(req: Request):
     customer_id = str(payload.get("customer_id") or "")
     email = str(payload.get("email") or "")
 
+    # Local entitlement table (kept current by the Stripe webhook); Stripe is only
+    # asked for customers we know nothing fresh about.
     subscribed = False
     try:
-        if customer_id and STRIPE_SECRET_KEY and stripe:
-            subscribed = _stripe_has_active_or_trialing_subscription(customer_id)
-    except Exception:
+        refresh = _stripe_subscription_state if (STRIPE_SECRET_KEY and stripe) else None
+        subscribed = entitlements.is_subscribed(customer_id, refresh=refresh)
+    except Exception as e:
+        log.error("/me entitlement: %r", e)
         subscribed = False
 
     return {
@@ -251,13 +282,36 @@ def me(req: Request):
 
 
 @app.get("/devotional")
-def devotional():
-    return {"ok": True, "devotional": "Coming soon."}
+def devotional(request: Request, lang: str = "en", date: Optional[str] = None):
+    return daily_content.daily_response(request, "devotional", lang, date)
 
 
 @app.get("/daily_prayer")
-def daily_prayer():
-    return {"ok": True, "prayer": "Coming soon."}
+def daily_prayer(request: Request, lang: str = "en", date: Optional[str] = None):
+    return daily_content.daily_response(request, "prayer", lang, date)
+
+
+@app.get("/chat/stats", dependencies=[Depends(require_admin)])
+def chat_stats():
+    return {
+        **agent.stats(),
+        "routing": chat_router.stats(),
+        "daily": daily_content.stats(),
+        "sessions": CHAT_SESSIONS.stats(),
+    }
+
+
+def _route_locally(user_message: str, lang: str, where: str) -> Optional[dict]:
+    """
+    chat_router's local answer, or None. A failing lookup (DB missing, odd
+    reference) is logged and the message goes to the model instead. It reads
+    the Bible DBs, so the async handlers run it in the threadpool.
+    """
+    try:
+        return chat_router.route_message(user_message, lang)
+    except Exception as e:
+        log.warning("Local route failed in %s, using the model: %r", where, e)
+        return None
 
 
 @app.post("/chat")
@@ -275,26 +329,171 @@ async def chat(req: Request):
     if lang not in ("auto", "en", "es"):
         lang = "auto"
 
+    # Pure scripture lookups ("read John 3:16") are answered from the local DBs
+    local = await run_in_threadpool(_route_locally, user_message, lang, "/chat")
+    if local is not None:
+        await _push_history(req, "user", user_message)
+        await _push_history(req, "assistant", local["reply"])
+        return local
+
     try:
-        _push_history(req, "user", user_message)
-        history = _get_history(req)
+        await _push_history(req, "user", user_message)
+        history = await _get_history(req)
 
-        reply = run_bible_ai(user_message, lang=lang, history=history)
+        reply = await run_bible_ai_async(user_message, lang=lang, history=history, memory=await _get_memory(req))
         if not reply:
             reply = "I’m here. Please try again."
 
-        _push_history(req, "assistant", str(reply))
+        await _push_history(req, "assistant", str(reply))
         return {"ok": True, "reply": str(reply)}
 
+    except ChatBusyError as e:
+        log.warning("BUSY in /chat: %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail="Alyana is helping many people right now. Please try again in a moment.",
+            headers={"Retry-After": "5"},
+        )
+    except ChatTimeoutError as e:
+        log.warning("TIMEOUT in /chat: %s", e)
+        raise HTTPException(
+            status_code=504,
+            detail="The answer took too long. Please try again.",
+        )
+    except ChatUnavailableError as e:
+        log.warning("UNAVAILABLE in /chat: %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail=agent.fallback_message(user_message, lang),
+            headers={"Retry-After": str(max(1, int(e.retry_after + 0.999)))},
+        )
     except Exception as e:
-        print("ERROR in /chat:", repr(e))
-        print(traceback.format_exc())
+        log.exception("ERROR in /chat: %r", e)
         raise HTTPException(
             status_code=500,
             detail="Chat engine failed. Check server logs / API key.",
         )
 
 
+# Seconds between SSE comment lines while waiting for Gemini; keeps proxies from
+# closing an idle connection and lets us notice a client that went away.
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("CHAT_STREAM_HEARTBEAT") or "10")
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: Request):
+    """
+    Same input as /chat, answered as Server-Sent Events:
+      event: delta  data: {"text": "..."}       (repeated)
+      event: done   data: {"ok": true, "reply": "..."}
+      event: error  data: {"ok": false, "status": 503|504|500, "detail": "..."}
+    History is only updated once the whole reply has been sent.
+    """
+    try:
+        body = await req.json()
+    except Exception:
+        body = {}
+
+    user_message = (body.get("message") or "").strip()
+    lang = (body.get("lang") or "auto").strip().lower()
+    if lang not in ("auto", "en", "es"):
+        lang = "auto"
+
+    async def events():
+        if not user_message:
+            yield _sse("done", {"ok": True, "reply": "Please type a message."})
+            return
+
+        local = await run_in_threadpool(_route_locally, user_message, lang, "/chat/stream")
+        if local is not None:
+            await _push_history(req, "user", user_message)
+            await _push_history(req, "assistant", local["reply"])
+            yield _sse("delta", {"text": local["reply"]})
+            yield _sse("done", local)
+            return
+
+        history = list(await _get_history(req)) + [{"role": "user", "content": user_message}]
+        t0 = time.perf_counter()
+        ttft = None
+        parts = []
+        status = "disconnected"  # until we get to the end one way or another
+
+        gen = stream_bible_ai(user_message, lang=lang, history=history, memory=await _get_memory(req))
+        nxt = None
+        try:
+            yield ": connected\n\n"
+            while True:
+                if nxt is None:
+                    nxt = asyncio.ensure_future(gen.__anext__())
+                done, _ = await asyncio.wait({nxt}, timeout=STREAM_HEARTBEAT_SECONDS)
+                if not done:
+                    if await req.is_disconnected():
+                        return
+                    yield ": ping\n\n"
+                    continue
+                try:
+                    text = nxt.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    nxt = None
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                parts.append(text)
+                yield _sse("delta", {"text": text})
+
+            reply = "".join(parts).strip() or "I’m here with you. Please try again."
+            await _push_history(req, "user", user_message)
+            await _push_history(req, "assistant", reply)
+            status = "ok"
+            yield _sse("done", {"ok": True, "reply": reply})
+
+        except ChatBusyError as e:
+            status = "busy"
+            log.warning("BUSY in /chat/stream: %s", e)
+            yield _sse("error", {"ok": False, "status": 503, "detail": "Alyana is helping many people right now. Please try again in a moment."})
+        except ChatTimeoutError as e:
+            status = "timeout"
+            log.warning("TIMEOUT in /chat/stream: %s", e)
+            yield _sse("error", {"ok": False, "status": 504, "detail": "The answer took too long. Please try again."})
+        except ChatUnavailableError as e:
+            status = "unavailable"
+            log.warning("UNAVAILABLE in /chat/stream: %s", e)
+            yield _sse(
+                "error",
+                {"ok": False, "status": 503, "detail": agent.fallback_message(user_message, lang), "retry_after": round(e.retry_after, 1)},
+            )
+        except Exception as e:
+            status = "error"
+            log.exception("ERROR in /chat/stream: %r", e)
+            yield _sse("error", {"ok": False, "status": 500, "detail": "Chat engine failed. Check server logs / API key."})
+        finally:
+            # Stop the upstream generation if the client left mid-answer.
+            if nxt is not None and not nxt.done():
+                nxt.cancel()
+                try:
+                    await nxt
+                except BaseException:
+                    pass
+            await gen.aclose()
+            total_ms = (time.perf_counter() - t0) * 1000
+            ttft_ms = f"{ttft * 1000:.0f}" if ttft is not None else "-"
+            log.info(
+                "/chat/stream %s ttft_ms=%s total_ms=%.0f chunks=%d chars=%d",
+                status, ttft_ms, total_ms, len(parts), sum(map(len, parts)),
+            )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # -----------------------------
 # Stripe endpoints
 # -----------------------------
@@ -329,11 +528,11 @@ async def stripe_checkout(req: Request):
         if email and "@" in email:
             params["customer_email"] = email
 
-        session = stripe.checkout.Session.create(**params)
+        session = await stripe_client.create_checkout(params)
         return {"ok": True, "url": session.url}
 
     except Exception as e:
-        print("ERROR stripe_checkout:", repr(e))
+        log.error("stripe_checkout: %r", e)
         raise HTTPException(status_code=500, detail=f"Stripe checkout failed: {repr(e)}")
 
 
@@ -351,7 +550,7 @@ async def stripe_restore(req: Request):
         raise HTTPException(status_code=400, detail="Please provide a valid email.")
 
     try:
-        cust = _stripe_customer_by_email(email)
+        cust = await stripe_client.customer_by_email(email)
         if not cust:
             raise HTTPException(status_code=404, detail="No Stripe customer found for that email.")
 
@@ -359,16 +558,17 @@ async def stripe_restore(req: Request):
             {"iat": int(time.time()), "email": email, "customer_id": cust.id}
         )
 
-        subscribed = False
-        try:
-            subscribed = _stripe_has_active_or_trialing_subscription(cust.id)
-        except Exception:
-            subscribed = False
-
-        portal = stripe.billing_portal.Session.create(
-            customer=cust.id,
-            return_url=f"{APP_BASE_URL}/",
+        # Both only need the customer id: one round trip of latency instead of two.
+        subscribed, portal = await asyncio.gather(
+            _stripe_subscribed_now(cust.id),
+            stripe_client.create_portal(cust.id, f"{APP_BASE_URL}/"),
+            return_exceptions=True,
         )
+        if isinstance(portal, BaseException):
+            raise portal
+        if isinstance(subscribed, BaseException):
+            log.warning("stripe_restore: subscription check failed: %r", subscribed)
+            subscribed = False
 
         status = "active" if subscribed else "inactive"
         return {
@@ -384,7 +584,7 @@ async def stripe_restore(req: Request):
     except HTTPException:
         raise
     except Exception as e:
-        print("ERROR stripe_restore:", repr(e))
+        log.error("stripe_restore: %r", e)
         raise HTTPException(status_code=500, detail=f"Stripe restore failed: {repr(e)}")
 
 
@@ -398,13 +598,10 @@ async def stripe_portal(req: Request):
         raise HTTPException(status_code=401, detail="Missing customer_id")
 
     try:
-        portal = stripe.billing_portal.Session.create(
-            customer=customer_id,
-            return_url=f"{APP_BASE_URL}/",
-        )
+        portal = await stripe_client.create_portal(customer_id, f"{APP_BASE_URL}/")
         return {"ok": True, "url": portal.url}
     except Exception as e:
-        print("ERROR stripe_portal:", repr(e))
+        log.error("stripe_portal: %r", e)
         raise HTTPException(status_code=500, detail=f"Stripe portal failed: {repr(e)}")
 
 
@@ -424,10 +621,30 @@ async def stripe_webhook(req: Request):
         raise HTTPException(status_code=400, detail=f"Invalid webhook: {repr(e)}")
 
     etype = event.get("type")
-    print("Stripe webhook event:", etype)
+    # Stored durably and de-duplicated by event id; the queue worker does the work.
+    try:
+        new = await run_in_threadpool(webhook_queue.enqueue, event, payload)
+    except Exception as e:
+        log.error("stripe_webhook enqueue: %r", e)
+        raise HTTPException(status_code=500, detail="Could not store webhook event.")
+    log.info("Stripe webhook event: %s %s", etype, "queued" if new else "duplicate")
     return {"ok": True}
 
 
+def _handle_stripe_event(event: dict) -> None:
+    entitlements.apply_event(event)
+
+
+@app.get("/stripe/stats", dependencies=[Depends(require_admin)])
+def stripe_stats():
+    return {
+        "ok": True,
+        "webhooks": webhook_queue.stats(),
+        "entitlements": entitlements.stats(),
+        "api": stripe_client.stats(),
+    }
+
+
 # -----------------------------
 # Frontend / Static serving
 # -----------------------------
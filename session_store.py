@@ -0,0 +1,641 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
+
+log = logging.getLogger(__name__)
+
+# Per-visitor chat sessions: recent history plus the rolling-summary `memory` dict
+# (see agent.build_context). Sessions sit in an OrderedDict in last-access order,
+# so touching one is a move_to_end and expiry/eviction only ever looks at the
+# oldest end: amortized O(1) per request however many visitors there are.
+# History is kept as (role, content) tuples in a bounded deque and only turned
+# into the {"role", "content"} dicts the agent expects when read.
+#
+# That store is per process. SqliteSessionStore keeps the same data in a sqlite
+# file (WAL) shared by every worker on the host and surviving restarts; anything
+# else (e.g. Redis) only has to implement SessionBackend.
+
+_ROLES = {"user": "user", "assistant": "assistant"}
+# Rough fixed cost of one session / one message, on top of the text itself.
+SESSION_OVERHEAD_BYTES = 600
+MESSAGE_OVERHEAD_BYTES = 120
+
+
+class _Session:
+    __slots__ = ("ts", "history", "memory", "text_bytes")
+
+    def __init__(self, now: float, max_history: int):
+        self.ts = now
+        self.history: deque = deque(maxlen=max_history)
+        self.memory: Dict[str, Any] = {}
+        self.text_bytes = 0
+
+    def size(self) -> int:
+        summary = self.memory.get("summary") or ""
+        return SESSION_OVERHEAD_BYTES + self.text_bytes + len(self.history) * MESSAGE_OVERHEAD_BYTES + len(summary)
+
+
+def _text_bytes(content: str) -> int:
+    return len(content.encode("utf-8"))
+
+
+class SessionBackend(ABC):
+    """
+    What server.py needs from a session store. Keys are opaque visitor ids.
+
+    - history(key): recent messages, oldest first, as new {"role", "content"} dicts
+      (at most max_history); refreshes the session's idle TTL.
+    - memory(key): the session's mutable memory dict; the agent writes to it after
+      the reply (background summary), so writes must reach the store later on too.
+    - append(key, role, content): add a message, keeping only the last max_history.
+    - drop(key), stats(), close().
+
+    A Redis version maps naturally: a list per key (RPUSH + LTRIM -max_history),
+    a hash or JSON string for memory, EXPIRE ttl on every touch.
+    """
+
+    @abstractmethod
+    def history(self, key: str) -> List[Dict[str, str]]:
+        ...
+
+    @abstractmethod
+    def memory(self, key: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def append(self, key: str, role: str, content: str) -> None:
+        ...
+
+    @abstractmethod
+    def drop(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class SessionStore(SessionBackend):
+    """
+    Thread-safe LRU of chat sessions with an idle TTL, bounded by session count and total bytes.
+    """
+
+    def __init__(self, ttl_seconds: float, max_history: int, max_sessions: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = float(ttl_seconds)
+        self.max_history = max(1, int(max_history))
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_bytes = max(1, int(max_bytes))
+        self._items: "OrderedDict[str, _Session]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.expired = 0
+        self.evicted_count = 0
+        self.evicted_bytes = 0
+        self.trimmed = 0
+
+    def _expire(self, now: float) -> None:
+        # caller holds the lock; oldest first, so stop at the first live session
+        while self._items:
+            key, sess = next(iter(self._items.items()))
+            if now - sess.ts <= self.ttl:
+                break
+            self._drop(key)
+            self.expired += 1
+
+    def _drop(self, key: str) -> None:
+        self._items.pop(key, None)
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def _resize(self, key: str, sess: _Session) -> None:
+        size = sess.size()
+        self._bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def _enforce_caps(self, keep: str) -> None:
+        while self._items and (len(self._items) > self.max_sessions or self._bytes > self.max_bytes):
+            key = next(iter(self._items))
+            if key == keep:
+                break
+            if self._bytes > self.max_bytes:
+                self.evicted_bytes += 1
+            else:
+                self.evicted_count += 1
+            self._drop(key)
+
+    def _touch(self, key: str) -> _Session:
+        # caller holds the lock
+        now = time.time()
+        self._expire(now)
+        sess = self._items.get(key)
+        if sess is None:
+            sess = _Session(now, self.max_history)
+            self._items[key] = sess
+            self.created += 1
+        else:
+            self._items.move_to_end(key)
+        sess.ts = now
+        self._resize(key, sess)
+        self._enforce_caps(key)
+        return sess
+
+    def history(self, key: str) -> List[Dict[str, str]]:
+        """
+        Copy of the session's recent messages as [{"role", "content"}], oldest first.
+        """
+        with self._lock:
+            sess = self._touch(key)
+            return [{"role": r, "content": c} for r, c in sess.history]
+
+    def memory(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._touch(key).memory
+
+    def append(self, key: str, role: str, content: str) -> None:
+        role = _ROLES.get(role, "user")
+        content = content or ""
+        with self._lock:
+            sess = self._touch(key)
+            if len(sess.history) == sess.history.maxlen:
+                sess.text_bytes -= _text_bytes(sess.history[0][1])
+                self.trimmed += 1
+            sess.history.append((role, content))
+            sess.text_bytes += _text_bytes(content)
+            self._resize(key, sess)
+            self._enforce_caps(key)
+
+    def drop(self, key: str) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.time())
+            return {
+                "backend": "memory",
+                "sessions": len(self._items),
+                "bytes": self._bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "occupancy": round(len(self._items) / self.max_sessions, 4),
+                "bytes_occupancy": round(self._bytes / self.max_bytes, 4),
+                "ttl_seconds": self.ttl,
+                "max_history": self.max_history,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted_count": self.evicted_count,
+                "evicted_bytes": self.evicted_bytes,
+                "trimmed_messages": self.trimmed,
+            }
+
+
+# Memory keys that only matter while this process is working on them.
+_TRANSIENT_MEMORY_KEYS = ("updating",)
+
+
+class _StoredMemory(dict):
+    """
+    memory dict that queues itself for saving whenever a key is set.
+    """
+
+    __slots__ = ("_store", "_key", "__weakref__")
+
+    def __init__(self, store: "SqliteSessionStore", key: str, data: Dict[str, Any]):
+        super().__init__(data)
+        self._store = store
+        self._key = key
+
+    def __setitem__(self, name, value) -> None:
+        super().__setitem__(name, value)
+        if name not in _TRANSIENT_MEMORY_KEYS:
+            self._store._queue_memory(self._key, self)
+
+
+class SqliteSessionStore(SessionBackend):
+    """
+    Sessions in a sqlite file (WAL), shared by the workers of one host.
+
+    Writes (messages, memory, last-access times) are queued in memory and written
+    by a background thread every flush_seconds in one transaction, so a request
+    never waits for a commit. Reads see the queued writes, so a worker always
+    reads its own writes; other workers see them after the next flush. Stored
+    rows are read on a per-thread read connection without holding the queue
+    lock, and a flush only holds that lock to swap the queues out, so append()
+    and memory writes never wait on sqlite. history() and memory() still read
+    the file when the queue doesn't have the session: call them off the event
+    loop (server.py uses run_in_threadpool).
+
+    The same thread deletes sessions idle for longer than ttl_seconds every
+    sweep_seconds, then the least recently used ones beyond max_sessions /
+    max_bytes (same size estimate as SessionStore). Those two caps are soft:
+    they hold as of each sweep, not on every write, so between sweeps the file
+    can run over by whatever the workers wrote in the meantime.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        ttl_seconds: float,
+        max_history: int,
+        max_sessions: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        flush_seconds: float = 0.2,
+        sweep_seconds: float = 300.0,
+    ):
+        self.db_path = Path(db_path)
+        self.ttl = float(ttl_seconds)
+        self.max_history = max(1, int(max_history))
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_bytes = max(1, int(max_bytes))
+        self.flush_seconds = max(0.01, float(flush_seconds))
+        self.sweep_seconds = max(1.0, float(sweep_seconds))
+
+        # _lock guards the queues below and is never held across a sqlite call;
+        # _db_lock serializes the writer connection (flush, sweep, close).
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._msgs: Dict[str, List[tuple]] = {}
+        self._mems: Dict[str, str] = {}
+        self._touches: Dict[str, float] = {}
+        self._since: Dict[str, float] = {}  # first access of each key since the last flush
+        self._drops: set = set()
+        self._live: "weakref.WeakValueDictionary[str, _StoredMemory]" = weakref.WeakValueDictionary()
+        self._batch = 0  # flushes started; a read that spans one is retried
+        self._flushing = False
+        self._flushed = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_ms = 0.0
+        self.flush_errors = 0
+        self.swept = 0
+        self.evicted_count = 0
+        self.evicted_bytes = 0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                key TEXT PRIMARY KEY,
+                ts REAL NOT NULL,
+                memory TEXT NOT NULL DEFAULT '{}'
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_key ON messages (key, id);
+            CREATE INDEX IF NOT EXISTS sessions_ts ON sessions (ts);
+            """
+        )
+        self._db.commit()
+
+        self._thread = threading.Thread(target=self._run, name="chat-sessions", daemon=True)
+        self._thread.start()
+
+    # -- request path (never commits) --
+    def _reader(self) -> sqlite3.Connection:
+        con = getattr(self._local, "db", None)
+        if con is None:
+            con = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=10)
+            self._local.db = con
+            with self._lock:
+                self._readers.append(con)
+        return con
+
+    def _read(self, key: str, with_history: bool, combine: Callable[[Optional[float], list, Optional[str]], Any]) -> Any:
+        """
+        Read key's stored row (and history) without the queue lock, then return
+        combine(stored ts, stored history, stored memory json) run under it.
+        Retried when a flush started in between: its rows may or may not be on
+        disk yet, so the read and the queue would not line up.
+        """
+        while True:
+            with self._lock:
+                while self._flushing:
+                    self._flushed.wait()
+                batch = self._batch
+            con = self._reader()
+            ts, rows, raw = None, [], None
+            row = con.execute("SELECT ts, memory FROM sessions WHERE key=?", (key,)).fetchone()
+            if row is not None:
+                ts, raw = float(row[0]), row[1]
+                if with_history:
+                    rows = con.execute(
+                        "SELECT role, content FROM messages WHERE key=? ORDER BY id DESC LIMIT ?",
+                        (key, self.max_history),
+                    ).fetchall()[::-1]
+            with self._lock:
+                if self._batch == batch:
+                    return combine(ts, rows, raw)
+
+    def _stale(self, key: str, ts: Optional[float], now: float) -> bool:
+        # caller holds the lock: the stored copy is gone (dropped) or had expired
+        # before this worker's first access since the last flush
+        return ts is None or key in self._drops or self._since.get(key, now) - ts > self.ttl
+
+    def _touch(self, key: str, now: float) -> None:
+        self._touches[key] = now
+        self._since.setdefault(key, now)
+        self._kick()
+
+    def _live_memory(self, key: str, raw: Optional[str]) -> "_StoredMemory":
+        try:
+            data = json.loads(raw) if raw else {}
+        except ValueError:
+            data = {}
+        mem = _StoredMemory(self, key, data if isinstance(data, dict) else {})
+        self._live[key] = mem
+        return mem
+
+    def history(self, key: str) -> List[Dict[str, str]]:
+        now = time.time()
+
+        def combine(ts, stored, _raw):
+            if self._stale(key, ts, now):
+                stored = []
+            self._touch(key, now)
+            return list(stored) + self._msgs.get(key, [])
+
+        msgs = self._read(key, True, combine)
+        return [{"role": r, "content": c} for r, c in msgs[-self.max_history:]]
+
+    def memory(self, key: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            mem = self._live.get(key)
+            if mem is None and key in self._mems:
+                mem = self._live_memory(key, self._mems[key])
+            if mem is not None:
+                self._touch(key, now)
+                return mem
+
+        def combine(ts, _stored, raw):
+            mem = self._live.get(key)
+            if mem is None:
+                if key in self._mems:
+                    raw = self._mems[key]
+                elif self._stale(key, ts, now):
+                    raw = None
+                mem = self._live_memory(key, raw)
+            self._touch(key, now)
+            return mem
+
+        return self._read(key, False, combine)
+
+    def append(self, key: str, role: str, content: str) -> None:
+        now = time.time()
+        with self._lock:
+            pending = self._msgs.setdefault(key, [])
+            pending.append((_ROLES.get(role, "user"), content or ""))
+            if len(pending) > self.max_history:
+                del pending[: -self.max_history]
+            self._touch(key, now)
+
+    def drop(self, key: str) -> None:
+        with self._lock:
+            self._msgs.pop(key, None)
+            self._mems.pop(key, None)
+            self._touches.pop(key, None)
+            self._since.pop(key, None)
+            self._live.pop(key, None)
+            self._drops.add(key)
+            self._kick()
+
+    def _queue_memory(self, key: str, mem: Dict[str, Any]) -> None:
+        data = {k: v for k, v in mem.items() if k not in _TRANSIENT_MEMORY_KEYS}
+        raw = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._mems[key] = raw
+            now = time.time()
+            self._touches.setdefault(key, now)
+            self._since.setdefault(key, now)
+            self._kick()
+
+    def _kick(self) -> None:
+        self._wake.set()
+
+    # -- background thread --
+    def _run(self) -> None:
+        next_sweep = time.monotonic() + self.sweep_seconds
+        while not self._stop.is_set():
+            self._wake.wait(self.sweep_seconds)
+            if self._stop.is_set():
+                break
+            # let a burst of requests land in the same transaction
+            self._stop.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+            if time.monotonic() >= next_sweep:
+                self.sweep()
+                next_sweep = time.monotonic() + self.sweep_seconds
+        self.flush()
+
+    def _requeue(self, msgs, mems, touches, since, drops) -> None:
+        # caller holds the lock: put a batch that failed to commit back in front of
+        # what was queued since (sessions dropped in the meantime stay dropped)
+        for key, items in msgs.items():
+            if key not in self._drops:
+                self._msgs[key] = (items + self._msgs.get(key, []))[-self.max_history:]
+        for key, raw in mems.items():
+            if key not in self._drops:
+                self._mems.setdefault(key, raw)
+        for key, ts in touches.items():
+            if key not in self._drops:
+                self._touches[key] = max(ts, self._touches.get(key, ts))
+        for key, ts in since.items():
+            if key not in self._drops:
+                self._since[key] = min(ts, self._since.get(key, ts))
+        self._drops |= drops
+
+    def flush(self) -> int:
+        """
+        Write every queued change in one transaction; returns the number of rows written.
+        """
+        with self._db_lock:
+            with self._lock:
+                if not (self._msgs or self._mems or self._touches or self._drops):
+                    return 0
+                msgs, mems, touches, since, drops = self._msgs, self._mems, self._touches, self._since, self._drops
+                self._msgs, self._mems, self._touches, self._since, self._drops = {}, {}, {}, {}, set()
+                self._batch += 1
+                self._flushing = True
+            t0 = time.perf_counter()
+            rows = 0
+            error = None
+            try:
+                with self._db:
+                    for key in drops:
+                        self._db.execute("DELETE FROM messages WHERE key=?", (key,))
+                        self._db.execute("DELETE FROM sessions WHERE key=?", (key,))
+                    # a session that had expired before this batch touched it starts over
+                    stale = [(key, key, ts - self.ttl) for key, ts in since.items()]
+                    self._db.executemany(
+                        "DELETE FROM messages WHERE key=? AND EXISTS (SELECT 1 FROM sessions WHERE key=? AND ts < ?)", stale
+                    )
+                    self._db.executemany("DELETE FROM sessions WHERE key=? AND ts < ?", [(k, c) for k, _, c in stale])
+                    for key, ts in touches.items():
+                        self._db.execute(
+                            "INSERT INTO sessions (key, ts) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET ts = max(ts, excluded.ts)",
+                            (key, ts),
+                        )
+                    for key, raw in mems.items():
+                        self._db.execute("UPDATE sessions SET memory=? WHERE key=?", (raw, key))
+                    for key, items in msgs.items():
+                        self._db.executemany(
+                            "INSERT INTO messages (key, role, content) VALUES (?, ?, ?)",
+                            [(key, r, c) for r, c in items],
+                        )
+                        self._db.execute(
+                            """
+                            DELETE FROM messages WHERE key=? AND id <= (
+                                SELECT id FROM messages WHERE key=? ORDER BY id DESC LIMIT 1 OFFSET ?
+                            )
+                            """,
+                            (key, key, self.max_history),
+                        )
+                    rows = len(drops) + len(touches) + len(mems) + sum(len(v) for v in msgs.values())
+            except sqlite3.Error as e:
+                error = e
+            with self._lock:
+                self._flushing = False
+                self._flushed.notify_all()
+                if error is not None:
+                    # keep the batch; the next flush tries again
+                    self._requeue(msgs, mems, touches, since, drops)
+                    self.flush_errors += 1
+                else:
+                    self.flushes += 1
+                    self.rows_written += rows
+                    self.flush_ms += (time.perf_counter() - t0) * 1000
+            if error is not None:
+                log.error("Chat sessions: sqlite flush failed: %r", error)
+            return rows
+
+    def sweep(self) -> int:
+        """
+        Delete expired sessions, then evict the oldest beyond the count and byte
+        caps (the newest one always stays); returns how many sessions went.
+        """
+        cutoff = time.time() - self.ttl
+        with self._db_lock:
+            try:
+                with self._db:
+                    self._db.execute(
+                        "DELETE FROM messages WHERE key IN (SELECT key FROM sessions WHERE ts < ?)", (cutoff,)
+                    )
+                    n = self._db.execute("DELETE FROM sessions WHERE ts < ?", (cutoff,)).rowcount
+                    over = self._db.execute(
+                        """
+                        WITH sizes AS (
+                            SELECT s.key, s.ts,
+                                   ? + length(CAST(s.memory AS BLOB)) + COALESCE((
+                                       SELECT SUM(length(CAST(m.content AS BLOB)) + ?) FROM messages m WHERE m.key = s.key
+                                   ), 0) AS size
+                            FROM sessions s
+                        ), ranked AS (
+                            SELECT key,
+                                   ROW_NUMBER() OVER (ORDER BY ts DESC) AS n,
+                                   SUM(size) OVER (ORDER BY ts DESC ROWS UNBOUNDED PRECEDING) AS total
+                            FROM sizes
+                        )
+                        SELECT key, n > ? FROM ranked WHERE n > 1 AND (n > ? OR total > ?)
+                        """,
+                        (SESSION_OVERHEAD_BYTES, MESSAGE_OVERHEAD_BYTES, self.max_sessions, self.max_sessions, self.max_bytes),
+                    ).fetchall()
+                    keys = [(k,) for k, _ in over]
+                    self._db.executemany("DELETE FROM messages WHERE key=?", keys)
+                    self._db.executemany("DELETE FROM sessions WHERE key=?", keys)
+            except sqlite3.Error as e:
+                log.error("Chat sessions: sqlite sweep failed: %r", e)
+                return 0
+        by_count = sum(1 for _, c in over if c)
+        with self._lock:
+            self.swept += n
+            self.evicted_count += by_count
+            self.evicted_bytes += len(over) - by_count
+        return n + len(over)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for con in readers:
+            con.close()
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            sessions = self._reader().execute(
+                "SELECT COUNT(*) FROM sessions WHERE ts >= ?", (time.time() - self.ttl,)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            sessions = None
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "sqlite": str(self.db_path),
+                "sessions": sessions,
+                "ttl_seconds": self.ttl,
+                "max_history": self.max_history,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "evicted_count": self.evicted_count,
+                "evicted_bytes": self.evicted_bytes,
+                "pending_writes": len(self._msgs) + len(self._mems) + len(self._touches) + len(self._drops),
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "flush_ms_avg": round(self.flush_ms / self.flushes, 2) if self.flushes else 0.0,
+                "flush_errors": self.flush_errors,
+                "swept": self.swept,
+            }
+
+
+def open_session_store(
+    db_path: Optional[str], ttl_seconds: float, max_history: int, max_sessions: int, max_bytes: int
+) -> SessionBackend:
+    """
+    SqliteSessionStore when db_path is set, else the in-process SessionStore.
+    """
+    if db_path:
+        try:
+            return SqliteSessionStore(
+                Path(db_path),
+                ttl_seconds=ttl_seconds,
+                max_history=max_history,
+                max_sessions=max_sessions,
+                max_bytes=max_bytes,
+            )
+        except sqlite3.Error as e:
+            log.warning("Chat sessions: sqlite backend unavailable, keeping them in memory: %r", e)
+    return SessionStore(ttl_seconds=ttl_seconds, max_history=max_history, max_sessions=max_sessions, max_bytes=max_bytes)
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+# Where the app writes its own runtime state (daily content, billing tables,
+# queues). Kept apart from the shipped data/ folder, which may be read-only on
+# the host and is part of the deploy; point APP_STATE_DIR at a persistent disk.
+
+
+def state_dir() -> Path:
+    p = (os.getenv("APP_STATE_DIR") or "").strip()
+    return Path(p) if p else Path(__file__).resolve().parent / "state"
+
+
+def state_path(env_var: str, filename: str) -> Path:
+    """
+    `env_var` if set (a full file path), else `filename` inside state_dir().
+    """
+    p = (os.getenv(env_var) or "").strip()
+    return Path(p) if p else state_dir() / filename
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Optional, Dict, Any, Tuple
+
+# Stripe (requires: pip install stripe)
+try:
+    import stripe  # type: ignore
+except Exception:
+    stripe = None
+
+import entitlements
+
+# One StripeClient per process on the SDK's HTTPX transport, so billing calls
+# reuse keep-alive connections and the async ones don't block the event loop
+# (chat and Bible requests share it). Every call gets its own deadline and is
+# timed per operation; see stats().
+
+TIMEOUT_SECONDS = float(os.getenv("STRIPE_TIMEOUT") or "10")
+MAX_NETWORK_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES") or "1")
+
+_CLIENT = None
+_API_KEY = ""
+CALL_STATS: Dict[str, Dict[str, float]] = {}
+
+
+class StripeTimeoutError(RuntimeError):
+    """Stripe did not answer within the call's deadline."""
+
+
+def configure(api_key: str) -> None:
+    global _API_KEY
+    _API_KEY = api_key or ""
+
+
+def client():
+    global _CLIENT
+    if _CLIENT is None:
+        if stripe is None or not _API_KEY:
+            raise RuntimeError("Stripe is not configured.")
+        _CLIENT = stripe.StripeClient(
+            _API_KEY,
+            http_client=stripe.HTTPXClient(timeout=TIMEOUT_SECONDS, allow_sync_methods=True),
+            max_network_retries=MAX_NETWORK_RETRIES,
+        )
+    return _CLIENT
+
+
+def _record(name: str, t0: float, outcome: str) -> None:
+    ms = (time.perf_counter() - t0) * 1000
+    st = CALL_STATS.setdefault(name, {"calls": 0, "errors": 0, "timeouts": 0, "ms_total": 0.0, "ms_max": 0.0})
+    st["calls"] += 1
+    st["errors"] += 1 if outcome == "error" else 0
+    st["timeouts"] += 1 if outcome == "timeout" else 0
+    st["ms_total"] += ms
+    st["ms_max"] = max(st["ms_max"], ms)
+
+
+async def _call(name: str, coro, timeout: Optional[float] = None):
+    t0 = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(coro, timeout=timeout or TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        _record(name, t0, "timeout")
+        raise StripeTimeoutError(f"Stripe {name} did not answer within {timeout or TIMEOUT_SECONDS:g}s.")
+    except Exception:
+        _record(name, t0, "error")
+        raise
+    _record(name, t0, "ok")
+    return result
+
+
+def _best_subscription(subs) -> Tuple[str, Optional[int], str]:
+    data = list(getattr(subs, "data", None) or [])
+    if not data:
+        return "none", None, ""
+    best = next((s for s in data if str(s.get("status") or "") in entitlements.ENTITLED_STATUSES), data[0])
+    return str(best.get("status") or "none"), entitlements.period_end_of(best), str(best.get("id") or "")
+
+
+async def customer_by_email(email: str):
+    customers = await _call("customers.list", client().v1.customers.list_async(params={"email": email, "limit": 1}))
+    if not customers or not customers.data:
+        return None
+    return customers.data[0]
+
+
+async def subscription_state(customer_id: str) -> Tuple[str, Optional[int], str]:
+    """
+    (status, current_period_end, subscription_id) of the customer's best subscription
+    (active/trialing first, else the newest); ("none", None, "") if they have none.
+    """
+    if not customer_id:
+        return "none", None, ""
+    subs = await _call(
+        "subscriptions.list",
+        client().v1.subscriptions.list_async(params={"customer": customer_id, "status": "all", "limit": 20}),
+    )
+    return _best_subscription(subs)
+
+
+def subscription_state_sync(customer_id: str) -> Tuple[str, Optional[int], str]:
+    """
+    Blocking twin of subscription_state for sync endpoints (run in the thread pool);
+    the HTTP timeout is the deadline.
+    """
+    if not customer_id:
+        return "none", None, ""
+    t0 = time.perf_counter()
+    try:
+        subs = client().v1.subscriptions.list(params={"customer": customer_id, "status": "all", "limit": 20})
+    except Exception:
+        _record("subscriptions.list", t0, "error")
+        raise
+    _record("subscriptions.list", t0, "ok")
+    return _best_subscription(subs)
+
+
+async def create_portal(customer_id: str, return_url: str):
+    return await _call(
+        "billing_portal.sessions.create",
+        client().v1.billing_portal.sessions.create_async(params={"customer": customer_id, "return_url": return_url}),
+    )
+
+
+async def create_checkout(params: Dict[str, Any]):
+    return await _call("checkout.sessions.create", client().v1.checkout.sessions.create_async(params=params))
+
+
+async def aclose() -> None:
+    global _CLIENT
+    if _CLIENT is None:
+        return
+    http = _CLIENT._requestor._client if hasattr(_CLIENT, "_requestor") else None
+    _CLIENT = None
+    if http is not None:
+        # two pools: httpx.AsyncClient for the async calls, httpx.Client for the sync ones
+        try:
+            await http.close_async()
+        except Exception:
+            pass
+        try:
+            http.close()
+        except Exception:
+            pass
+
+
+def stats() -> Dict[str, Any]:
+    out = {}
+    for name, st in CALL_STATS.items():
+        calls = int(st["calls"])
+        out[name] = {
+            "calls": calls,
+            "errors": int(st["errors"]),
+            "timeouts": int(st["timeouts"]),
+            "ms_avg": round(st["ms_total"] / calls, 1) if calls else 0.0,
+            "ms_max": round(st["ms_max"], 1),
+        }
+    return {"timeout_seconds": TIMEOUT_SECONDS, "calls": out}
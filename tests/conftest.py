@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+# The app is a flat set of modules at the repo root (the root __init__.py would pull
+# in agent before this file runs, so the tests live here rather than next to it).
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# The app modules read their configuration at import time: point everything at a
+# throwaway state dir and switch off the network and the background builders
+# before any of them is imported.
+os.environ["APP_STATE_DIR"] = tempfile.mkdtemp(prefix="alyana-test-state-")
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ["GEMINI_MODEL"] = "gemini-2.5-flash"
+os.environ["GEMINI_CACHE_SYSTEM_PROMPT"] = "0"
+os.environ["RAG_GROUNDING"] = "0"
+os.environ["ANSWER_CACHE"] = "0"
+os.environ["DAILY_PIPELINE"] = "0"
+os.environ["BIBLE_SEARCH_AUTOBUILD"] = "0"
+os.environ["BIBLE_BUNDLE_AUTOBUILD"] = "0"
+os.environ["BIBLE_RELATED_AUTOBUILD"] = "0"
+
+import pytest
+
+BOOKS_EN = [(1, "Genesis"), (6, "Joshua"), (18, "Job"), (19, "Psalms"), (29, "Joel"), (32, "Jonah"), (43, "John")]
+BOOKS_ES = [(1, "Génesis"), (19, "Salmos"), (43, "Juan")]
+
+VERSES_EN = [
+    (1, 1, 1, "In the beginning God created the heaven and the earth."),
+    (1, 1, 2, "And the earth was without form, and void."),
+    (1, 1, 3, "And God said, Let there be light: and there was light."),
+    (19, 23, 1, "The LORD is my shepherd; I shall not want."),
+    (19, 23, 2, "He maketh me to lie down in green pastures."),
+    (43, 3, 16, "For God so loved the world, that he gave his only begotten Son."),
+    (43, 3, 17, "For God sent not his Son into the world to condemn the world."),
+    (43, 3, 18, "He that believeth on him is not condemned."),
+]
+VERSES_ES = [
+    (1, 1, 1, "En el principio crió Dios los cielos y la tierra."),
+    (43, 3, 16, "Porque de tal manera amó Dios al mundo, que ha dado á su Hijo unigénito."),
+]
+
+
+def _write_bible(path, books, verses):
+    con = sqlite3.connect(str(path))
+    con.executescript(
+        """
+        CREATE TABLE books (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+        CREATE TABLE verses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            chapter INTEGER NOT NULL,
+            verse INTEGER NOT NULL,
+            text TEXT NOT NULL
+        );
+        """
+    )
+    con.executemany("INSERT INTO books (id, name) VALUES (?, ?)", books)
+    con.executemany("INSERT INTO verses (book_id, chapter, verse, text) VALUES (?, ?, ?, ?)", verses)
+    con.commit()
+    con.close()
+
+
+@pytest.fixture
+def bible_data(tmp_path, monkeypatch):
+    """
+    A tiny en_default + rvr1909 pair in tmp_path, with bible_api's caches reset around the test.
+    """
+    import bible_api
+
+    _write_bible(tmp_path / "bible.db", BOOKS_EN, VERSES_EN)
+    _write_bible(tmp_path / "bible_es_rvr.db", BOOKS_ES, VERSES_ES)
+    bible_api.shutdown()
+    monkeypatch.setattr(bible_api, "_DATA_DIR", tmp_path)
+    monkeypatch.setattr(bible_api, "_DB_HASHES", {})
+    yield tmp_path
+    bible_api.shutdown()
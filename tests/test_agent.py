@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from google.genai import errors as genai_errors
+
+import agent
+from answer_cache import AnswerCache
+
+
+class FakeModels:
+    """
+    Stands in for client.aio.models: counts calls, optionally holds them until
+    `gate` is set, and raises the queued errors before answering.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = None
+        self.errors = []
+
+    async def generate_content(self, model, contents, config):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(text=f"answer #{self.calls}", usage_metadata=None)
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    models = FakeModels()
+    monkeypatch.setattr(agent, "client", SimpleNamespace(aio=SimpleNamespace(models=models)))
+    monkeypatch.setattr(agent, "BREAKER", agent.CircuitBreaker(2, 30))
+    monkeypatch.setattr(agent, "LIMITER", agent.ConcurrencyLimiter(4, 16, 5))
+    monkeypatch.setattr(agent, "_INFLIGHT", {})
+    monkeypatch.setattr(agent, "COALESCE_STATS", {"upstream_calls": 0, "joined": 0, "abandoned": 0})
+    monkeypatch.setattr(agent, "RETRIES", 1)
+    monkeypatch.setattr(agent, "RETRY_BASE_SECONDS", 0.0)
+    monkeypatch.setattr(agent, "CACHE_SYSTEM_PROMPT", False)
+    monkeypatch.setattr(agent, "RAG_ENABLED", False)
+    monkeypatch.setattr(agent.ANSWER_CACHE, "enabled", False)
+    return models
+
+
+def _server_error():
+    return genai_errors.ServerError(503, {"error": {"message": "overloaded", "status": "UNAVAILABLE"}})
+
+
+# -----------------------------
+# Single-flight
+# -----------------------------
+def test_identical_prompts_share_one_upstream_call(gemini):
+    async def scenario():
+        gemini.gate = asyncio.Event()
+        calls = [asyncio.ensure_future(agent.run_bible_ai_async("What is grace?", "en")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        gemini.gate.set()
+        return await asyncio.gather(*calls)
+
+    replies = asyncio.run(scenario())
+    assert replies == ["answer #1"] * 3
+    assert gemini.calls == 1
+    assert agent.COALESCE_STATS == {"upstream_calls": 1, "joined": 2, "abandoned": 0}
+    assert agent._INFLIGHT == {}
+
+
+def test_different_prompts_do_not_share(gemini):
+    async def scenario():
+        return await asyncio.gather(
+            agent.run_bible_ai_async("What is grace?", "en"),
+            agent.run_bible_ai_async("What is mercy?", "en"),
+        )
+
+    assert sorted(asyncio.run(scenario())) == ["answer #1", "answer #2"]
+    assert gemini.calls == 2
+    assert agent.COALESCE_STATS["joined"] == 0
+
+
+def test_last_waiter_leaving_cancels_the_call(gemini):
+    async def scenario():
+        gemini.gate = asyncio.Event()
+        call = asyncio.ensure_future(agent.run_bible_ai_async("What is hope?", "en"))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert agent.COALESCE_STATS["abandoned"] == 1
+    assert agent._INFLIGHT == {}
+
+
+# -----------------------------
+# Circuit breaker
+# -----------------------------
+def test_breaker_opens_then_probes_once_then_closes():
+    breaker = agent.CircuitBreaker(2, cooldown=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.is_open()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()  # the half-open probe
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    assert breaker.stats()["opens"] == 1
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = agent.CircuitBreaker(3, cooldown=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open()
+    assert breaker.stats()["opens"] == 2
+
+
+def test_breaker_fails_fast_while_gemini_is_down(gemini):
+    gemini.errors = [_server_error(), _server_error()]
+    with pytest.raises(agent.ChatUnavailableError):
+        asyncio.run(agent.run_bible_ai_async("Who was Ruth?", "en"))
+    assert gemini.calls == 2  # first attempt + one retry, then the breaker opened
+    assert agent.BREAKER.is_open()
+
+    with pytest.raises(agent.ChatUnavailableError) as e:
+        asyncio.run(agent.run_bible_ai_async("Who was Naomi?", "en"))
+    assert gemini.calls == 2  # short-circuited, never reached the client
+    assert e.value.retry_after > 0
+
+
+def test_half_open_probe_success_closes_the_breaker(gemini):
+    gemini.errors = [_server_error(), _server_error()]
+    with pytest.raises(agent.ChatUnavailableError):
+        asyncio.run(agent.run_bible_ai_async("Who was Ruth?", "en"))
+    agent.BREAKER.opened_at -= agent.BREAKER.cooldown  # cooldown over
+
+    assert asyncio.run(agent.run_bible_ai_async("Who was Boaz?", "en")) == "answer #3"
+    assert agent.BREAKER.state == "closed"
+
+
+def test_client_errors_do_not_trip_the_breaker(gemini):
+    gemini.errors = [genai_errors.ClientError(400, {"error": {"message": "bad request", "status": "INVALID_ARGUMENT"}})]
+    with pytest.raises(genai_errors.ClientError):
+        asyncio.run(agent.run_bible_ai_async("Who was Ruth?", "en"))
+    assert gemini.calls == 1
+    assert agent.BREAKER.state == "closed"
+    assert agent.BREAKER.consecutive == 0
+
+
+# -----------------------------
+# Answer cache
+# -----------------------------
+def test_answer_cache_disk_lookup_runs_off_the_loop(monkeypatch, tmp_path):
+    writer = AnswerCache(db_path=tmp_path / "answers.db")
+    writer.put("k", "cached", 10.0, 1)
+    writer.close()
+
+    cache = AnswerCache(db_path=tmp_path / "answers.db")
+    monkeypatch.setattr(agent, "ANSWER_CACHE", cache)
+    readers = []
+    reader = cache._reader
+    monkeypatch.setattr(cache, "_reader", lambda: readers.append(threading.get_ident()) or reader())
+    try:
+        assert asyncio.run(agent._cached_answer_async("k")) == "cached"
+        assert readers and threading.get_ident() not in readers
+        # now in memory: answered on the loop without touching sqlite
+        assert asyncio.run(agent._cached_answer_async("k")) == "cached"
+        assert len(readers) == 1
+    finally:
+        cache.close()
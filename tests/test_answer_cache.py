@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from answer_cache import AnswerCache, is_personal, normalize_question
+
+
+@pytest.fixture
+def caches(tmp_path):
+    opened = []
+
+    def make(**kwargs):
+        cache = AnswerCache(db_path=tmp_path / "answers.db", flush_seconds=60, **kwargs)
+        opened.append(cache)
+        return cache
+
+    yield make
+    for cache in opened:
+        cache.close()
+
+
+def test_normalized_questions_share_a_key():
+    assert normalize_question("  What does JOHN 3:16 mean?! ") == "what does john 3:16 mean"
+    assert AnswerCache.key("¿Qué es la fe?", "es", "v1") == AnswerCache.key("que es la fe", "es", "v1")
+    assert AnswerCache.key("grace", "en", "v1") != AnswerCache.key("grace", "en", "v2")
+
+
+def test_personal_questions_are_detected():
+    assert is_personal("I'm so anxious about tomorrow")
+    assert is_personal("my husband left")
+    assert not is_personal("verses about anxiety")
+
+
+def test_answers_survive_in_the_sqlite_file(caches):
+    a = caches()
+    a.put("k", "Grace is unmerited favor.", 1200.0, 300)
+    assert a.flush() == 1
+
+    b = caches()
+    hit = b.get("k")
+    assert hit.reply == "Grace is unmerited favor."
+    assert b.stats()["disk_hits"] == 1
+
+
+def test_memory_only_lookup_leaves_the_miss_to_the_disk_lookup(caches):
+    a = caches()
+    a.put("k", "stored", 10.0, 1)
+    a.flush()
+
+    b = caches()
+    assert b.get("k", disk=False) is None
+    assert b.stats()["misses"] == 0
+    assert b.get("k").reply == "stored"
+    assert b.get("missing") is None
+    assert b.stats()["misses"] == 1
+
+
+def test_flush_does_not_hold_the_lock_while_writing(caches, tmp_path):
+    cache = caches(max_entries=1)
+    cache.put("a", "first", 10.0, 1)
+
+    blocker = sqlite3.connect(str(tmp_path / "answers.db"))
+    blocker.execute("BEGIN IMMEDIATE")  # the flush below waits for this write lock
+    flusher = threading.Thread(target=cache.flush)
+    flusher.start()
+    time.sleep(0.1)
+
+    t0 = time.perf_counter()
+    cache.put("b", "second", 10.0, 1)  # evicts "a" from memory while it is being written
+    assert cache.get("a").reply == "first"
+    assert time.perf_counter() - t0 < 0.5
+    assert flusher.is_alive()
+
+    blocker.rollback()
+    blocker.close()
+    flusher.join()
+    assert cache.flush() == 1  # "b"; "a" went in with the blocked flush
+    other = caches()
+    assert [other.get(k).reply for k in ("a", "b")] == ["first", "second"]
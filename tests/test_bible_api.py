@@ -0,0 +1,197 @@
+import threading
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import bible_api
+from bible_refs import BookResolver, PassageRef, parse_references
+
+
+@pytest.fixture
+def client(bible_data):
+    app = FastAPI()
+    app.include_router(bible_api.router)
+    return TestClient(app)
+
+
+# -----------------------------
+# Connection pool
+# -----------------------------
+def test_pool_is_shared_per_db_file(bible_data):
+    assert bible_api.get_pool("en_default") is bible_api.get_pool("en")
+    assert bible_api.get_pool("rvr1909") is not bible_api.get_pool("en_default")
+
+
+def test_pool_reuses_connections(bible_data):
+    pool = bible_api.ReadOnlyPool(bible_data / "bible.db", size=2, timeout=0.5)
+    for _ in range(5):
+        with pool.connection() as con:
+            assert con.execute("SELECT COUNT(*) FROM verses").fetchone()[0] == 8
+    st = pool.stats()
+    assert st["open"] == 1
+    assert st["acquires"] == 5
+    assert st["in_use"] == 0
+    pool.close()
+
+
+def test_pool_is_read_only(bible_data):
+    pool = bible_api.ReadOnlyPool(bible_data / "bible.db", size=1)
+    with pool.connection() as con:
+        with pytest.raises(Exception):
+            con.execute("DELETE FROM verses")
+    pool.close()
+
+
+def test_pool_waits_then_503_when_exhausted(bible_data):
+    pool = bible_api.ReadOnlyPool(bible_data / "bible.db", size=1, timeout=0.05)
+    with pool.connection():
+        errors = []
+
+        def take():
+            try:
+                with pool.connection():
+                    pass
+            except HTTPException as e:
+                errors.append(e.status_code)
+
+        t = threading.Thread(target=take)
+        t.start()
+        t.join()
+    assert errors == [503]
+    assert pool.stats()["open"] == 1
+    pool.close()
+
+
+# -----------------------------
+# Memory engine parity
+# -----------------------------
+@pytest.mark.parametrize(
+    "version, book_id, book, chapter, vs, ve",
+    [
+        ("en_default", 43, None, 3, 16, 18),
+        ("en_default", None, "John", 3, 17, None),
+        ("en_default", None, "Gen", 1, None, None),
+        ("en_default", 19, None, 23, 2, 1),
+        ("rvr1909", None, "Juan", 3, 16, 16),
+    ],
+)
+def test_memory_engine_matches_sqlite(bible_data, monkeypatch, version, book_id, book, chapter, vs, ve):
+    from_sqlite = bible_api.text_payload(version, book_id, book, chapter, vs, ve)
+
+    monkeypatch.setattr(bible_api, "BIBLE_ENGINE", "memory")
+    bible_api.load_corpus(version)
+    assert bible_api.get_corpus(version) is not None
+    assert bible_api.text_payload(version, book_id, book, chapter, vs, ve) == from_sqlite
+
+
+def test_memory_engine_missing_passage_is_404(bible_data, monkeypatch):
+    monkeypatch.setattr(bible_api, "BIBLE_ENGINE", "memory")
+    bible_api.load_corpus("en_default")
+    with pytest.raises(HTTPException) as e:
+        bible_api.text_payload("en_default", 43, None, 4, 1, 2)
+    assert e.value.status_code == 404
+
+
+# -----------------------------
+# References
+# -----------------------------
+def test_parse_references_lists_and_ranges():
+    resolver = BookResolver([(1, "Genesis"), (43, "John")])
+    refs, bad = parse_references("John 3:16-18; Gen 1:1, 3", resolver)
+    assert bad == []
+    assert refs == [
+        PassageRef(43, 3, 16, 3, 18, "John 3:16-18"),
+        PassageRef(1, 1, 1, 1, 1, "Gen 1:1"),
+        PassageRef(1, 1, 3, 1, 3, "3"),
+    ]
+
+
+def test_parse_references_reports_unresolved():
+    refs, bad = parse_references("Hezekiah 4:2", BookResolver([(43, "John")]))
+    assert refs == []
+    assert bad == ["Hezekiah 4:2"]
+
+
+def test_ambiguous_book_is_400_with_candidates(client):
+    r = client.get("/bible/text", params={"book": "Jo", "chapter": 1})
+    assert r.status_code == 400
+    detail = r.json()["detail"]
+    assert detail.startswith("Ambiguous book 'Jo'. Did you mean:")
+    for name in ("Job", "Joel", "John", "Jonah", "Joshua"):
+        assert name in detail
+
+
+def test_ambiguous_book_is_not_cached(client):
+    assert client.get("/bible/text", params={"book": "Jo", "chapter": 1}).status_code == 400
+    assert bible_api.RESPONSE_CACHE.stats()["entries"] == 0
+
+
+def test_passages_payload(bible_data):
+    out = bible_api.passages_payload("en_default", ["John 3:16-17", "Psalm 23:1"])
+    assert [len(p["verses"]) for p in out["passages"]] == [2, 1]
+    assert all(p["found"] for p in out["passages"])
+
+
+# -----------------------------
+# ETag / response cache
+# -----------------------------
+def test_etag_and_304(client):
+    params = {"book_id": 43, "chapter": 3, "verse_start": 16}
+    r = client.get("/bible/text", params=params)
+    assert r.status_code == 200
+    etag = r.headers["etag"]
+    assert r.headers["cache-control"].startswith("public, max-age=")
+
+    again = client.get("/bible/text", params=params, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    assert again.content == b""
+
+    weak = client.get("/bible/text", params=params, headers={"If-None-Match": f'"other", W/{etag}'})
+    assert weak.status_code == 304
+
+    stale = client.get("/bible/text", params=params, headers={"If-None-Match": '"other"'})
+    assert stale.status_code == 200
+    assert stale.json() == r.json()
+
+
+def test_etag_depends_on_request_and_version(client):
+    a = client.get("/bible/text", params={"book_id": 43, "chapter": 3, "verse_start": 16}).headers["etag"]
+    b = client.get("/bible/text", params={"book_id": 43, "chapter": 3, "verse_start": 17}).headers["etag"]
+    c = client.get("/bible/text", params={"version": "rvr1909", "book_id": 43, "chapter": 3, "verse_start": 16}).headers["etag"]
+    assert len({a, b, c}) == 3
+
+
+def test_response_cache_hits(client):
+    cache = bible_api.RESPONSE_CACHE
+    before = cache.stats()
+    params = {"book_id": 1, "chapter": 1}
+    first = client.get("/bible/text", params=params)
+    second = client.get("/bible/text", params=params)
+    assert first.content == second.content
+    st = cache.stats()
+    assert st["misses"] - before["misses"] == 1
+    assert st["hits"] - before["hits"] == 1
+    assert st["entries"] == 1
+
+
+def test_version_aliases_share_the_cache(client):
+    cache = bible_api.RESPONSE_CACHE
+    before = cache.stats()
+    params = {"book_id": 43, "chapter": 3, "verse_start": 16}
+    alias = client.get("/bible/text", params={**params, "version": "en"})
+    canonical = client.get("/bible/text", params={**params, "version": "en_default"})
+    assert alias.headers["etag"] == canonical.headers["etag"]
+    assert alias.json()["version"] == "en_default"
+    st = cache.stats()
+    assert st["misses"] - before["misses"] == 1
+    assert st["hits"] - before["hits"] == 1
+
+
+def test_etag_matches():
+    assert bible_api._etag_matches('"a", "b"', '"b"')
+    assert bible_api._etag_matches("*", '"b"')
+    assert bible_api._etag_matches('W/"b"', '"b"')
+    assert not bible_api._etag_matches("", '"b"')
+    assert not bible_api._etag_matches('"a"', '"b"')
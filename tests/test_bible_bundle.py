@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import bible_api
+import bible_bundle
+
+
+def test_concurrent_builds_run_once(bible_data):
+    db_path = bible_data / "bible.db"
+    results = []
+    gate = threading.Barrier(3)
+
+    def build():
+        gate.wait()
+        results.append(bible_bundle.ensure_bundle(db_path))
+
+    workers = [threading.Thread(target=build) for _ in range(3)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    assert sum(r is not None for r in results) == 1  # the others waited, then found it current
+    assert bible_bundle.bundle_is_current(db_path)
+    assert not list(bible_bundle.bundle_dir_for(db_path).rglob("*.tmp"))
+
+
+def test_build_drops_temp_files_left_by_a_dead_build(bible_data):
+    db_path = bible_data / "bible.db"
+    out = bible_bundle.bundle_dir_for(db_path)
+    (out / "manifests").mkdir(parents=True)
+    stale = [out / "43.0123456789ab.jsonl.gz.1234.tmp", out / "manifests" / "abc.json.1234.tmp"]
+    for p in stale:
+        p.write_bytes(b"left by a build that died")
+
+    info = bible_bundle.ensure_bundle(db_path)
+    assert info["books"] > 0
+    assert not any(p.exists() for p in stale)
+    assert bible_bundle.ensure_bundle(db_path) is None
+
+
+@pytest.mark.parametrize("autobuild, hint", [(True, "being built"), (False, "python bible_bundle.py")])
+def test_manifest_is_503_until_the_bundle_exists(bible_data, monkeypatch, autobuild, hint):
+    monkeypatch.setattr(bible_api, "BUNDLE_AUTOBUILD", autobuild)
+    app = FastAPI()
+    app.include_router(bible_api.router)
+    client = TestClient(app)
+
+    r = client.get("/bible/bundle/manifest")
+    assert r.status_code == 503
+    assert hint in r.json()["detail"]
+
+    info = bible_bundle.ensure_bundle(bible_data / "bible.db")
+    assert client.get("/bible/bundle/manifest").json()["bundle"] == info["bundle"]
@@ -0,0 +1,34 @@
+import threading
+
+import bible_related
+
+
+def test_concurrent_builds_run_once(bible_data):
+    db_path = bible_data / "bible.db"
+    results = []
+    gate = threading.Barrier(3)
+
+    def build():
+        gate.wait()
+        results.append(bible_related.ensure_related(db_path))
+
+    workers = [threading.Thread(target=build) for _ in range(3)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    assert sum(r is not None for r in results) == 1  # the others waited, then found it current
+    assert bible_related.related_is_current(db_path)
+    assert not list(bible_data.glob("*.tmp"))
+
+
+def test_build_uses_a_fresh_temp_file(bible_data):
+    db_path = bible_data / "bible.db"
+    out = bible_related.related_path_for(db_path)
+    stale = out.with_name(out.name + ".1234.tmp")
+    stale.write_bytes(b"left by a build that died")
+
+    assert bible_related.ensure_related(db_path)["verses"] == 8
+    assert not stale.exists()
+    assert bible_related.ensure_related(db_path) is None
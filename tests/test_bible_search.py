@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import bible_api
+import bible_search
+
+
+def test_concurrent_builds_run_once(bible_data):
+    db_path = bible_data / "bible.db"
+    results = []
+    gate = threading.Barrier(3)
+
+    def build():
+        gate.wait()
+        results.append(bible_search.ensure_index(db_path))
+
+    workers = [threading.Thread(target=build) for _ in range(3)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    assert sum(r is not None for r in results) == 1  # the others waited, then found it current
+    assert bible_search.index_is_current(db_path)
+    assert not list(bible_data.glob("*.tmp"))
+
+
+def test_startup_builds_the_index_in_the_background(bible_data, monkeypatch):
+    release = threading.Event()
+    built = []
+
+    def slow_ensure(db_path):
+        release.wait(5)
+        built.append(db_path.name)
+        return None
+
+    monkeypatch.setattr(bible_api, "SEARCH_AUTOBUILD", True)
+    monkeypatch.setattr(bible_api, "RELATED_AUTOBUILD", False)
+    monkeypatch.setattr(bible_api, "BUNDLE_AUTOBUILD", False)
+    monkeypatch.setattr(bible_search, "ensure_index", slow_ensure)
+    bible_api.startup()  # returns while the build is still waiting
+    assert built == []
+
+    release.set()
+    for t in threading.enumerate():
+        if t.name == "bible-index-build":
+            t.join(5)
+    assert sorted(built) == ["bible.db", "bible_es_rvr.db"]
+
+
+@pytest.mark.parametrize("autobuild, hint", [(True, "being built"), (False, "python bible_search.py")])
+def test_search_is_503_until_the_index_exists(bible_data, monkeypatch, autobuild, hint):
+    monkeypatch.setattr(bible_api, "SEARCH_AUTOBUILD", autobuild)
+    app = FastAPI()
+    app.include_router(bible_api.router)
+    client = TestClient(app)
+
+    r = client.get("/bible/search", params={"q": "shepherd"})
+    assert r.status_code == 503
+    assert hint in r.json()["detail"]
+
+    bible_search.ensure_index(bible_data / "bible.db")
+    found = client.get("/bible/search", params={"q": "shepherd"}).json()
+    assert [(v["book_id"], v["chapter"], v["verse"]) for v in found["results"]] == [(19, 23, 1)]
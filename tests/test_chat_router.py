@@ -0,0 +1,60 @@
+import pytest
+
+import chat_router
+
+
+@pytest.fixture
+def router(bible_data, monkeypatch):
+    monkeypatch.setattr(chat_router, "ROUTE_STATS", {"local": 0, "model": 0, "not_found": 0, "local_ms": 0.0})
+    return chat_router
+
+
+@pytest.mark.parametrize(
+    "message",
+    ["read John 3:16", "John 3:16", "Can you show me John 3:16?", "what does John 3:16 say?"],
+)
+def test_lookups_are_answered_locally(router, message):
+    reply = router.route_message(message)
+    assert reply["ok"] and reply["source"] == "local"
+    assert reply["version"] == "en_default"
+    assert reply["reply"].endswith("For God so loved the world, that he gave his only begotten Son.")
+    assert router.ROUTE_STATS["local"] == 1
+
+
+def test_reference_lists_and_ranges(router):
+    reply = router.route_message("show me John 3:16-17; Psalm 23:1")
+    assert [len(p["verses"]) for p in reply["passages"]] == [2, 1]
+
+
+def test_spanish_lookup_uses_the_spanish_bible(router):
+    reply = router.route_message("léeme Juan 3:16")
+    assert reply["version"] == "rvr1909"
+    assert "Porque de tal manera amó Dios al mundo" in reply["reply"]
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "what does John 3:16 mean?",
+        "Explain John 3:16 to me",
+        "read Psalms",
+        "I feel lost, what should I read?",
+        "read Hezekiah 4:2",
+        "read Jo 1:1",
+    ],
+)
+def test_everything_else_goes_to_the_model(router, message):
+    assert router.route_message(message) is None
+    assert router.ROUTE_STATS["model"] == 1
+
+
+def test_missing_verse_is_reported_not_invented(router):
+    reply = router.route_message("read John 3:99")
+    assert reply["passages"][0]["found"] is False
+    assert "couldn’t find" in reply["reply"]
+    assert router.ROUTE_STATS["not_found"] == 1
+
+
+def test_long_lookups_go_to_the_model(router, monkeypatch):
+    monkeypatch.setattr(router, "MAX_LOOKUP_VERSES", 2)
+    assert router.route_message("read John 3") is None
@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+import entitlements
+
+
+@pytest.fixture
+def ents(tmp_path, monkeypatch):
+    monkeypatch.setenv("ENTITLEMENTS_DB", str(tmp_path / "entitlements.db"))
+    monkeypatch.setattr(entitlements, "_DB", None)
+    monkeypatch.setattr(entitlements, "STATS", {k: 0 for k in entitlements.STATS})
+    yield entitlements
+    entitlements.close()
+
+
+class Stripe:
+    """refresh() stand-in: answers with `state` and counts the calls."""
+
+    def __init__(self, state=("active", None, "sub_1")):
+        self.state = state
+        self.calls = 0
+
+    def __call__(self, customer_id):
+        self.calls += 1
+        if isinstance(self.state, Exception):
+            raise self.state
+        return self.state
+
+
+def _sub_event(etype, customer, created, status="active", sub_id="sub_1", period_end=None):
+    obj = {"id": sub_id, "customer": customer, "status": status}
+    if period_end:
+        obj["items"] = {"data": [{"current_period_end": period_end}]}
+    return {"type": etype, "created": created, "data": {"object": obj}}
+
+
+def _age(ents, customer_id, seconds):
+    with ents._DB_LOCK:
+        ents._db().execute("UPDATE entitlements SET checked = checked - ? WHERE customer_id=?", (seconds, customer_id))
+        ents._db().commit()
+
+
+def test_unknown_customer_asks_stripe_once(ents):
+    stripe = Stripe()
+    assert ents.is_subscribed("cus_1", stripe)
+    assert ents.is_subscribed("cus_1", stripe)
+    assert stripe.calls == 1
+    assert ents.get("cus_1").source == "stripe"
+    assert ents.STATS["local_hits"] == 1
+
+
+def test_negative_answer_is_rechecked_after_its_ttl(ents):
+    stripe = Stripe(("none", None, ""))
+    assert not ents.is_subscribed("cus_1", stripe)
+    assert not ents.is_subscribed("cus_1", stripe)
+    assert stripe.calls == 1
+
+    _age(ents, "cus_1", ents.NEGATIVE_TTL_SECONDS + 1)
+    stripe.state = ("active", None, "sub_1")
+    assert ents.is_subscribed("cus_1", stripe)
+    assert stripe.calls == 2
+
+
+def test_webhook_state_is_trusted_without_refresh(ents):
+    ents.apply_event(_sub_event("customer.subscription.deleted", "cus_1", 100))
+    stripe = Stripe()
+    _age(ents, "cus_1", 10 * ents.REFRESH_TTL_SECONDS)
+    assert not ents.is_subscribed("cus_1", stripe)
+    assert stripe.calls == 0
+
+
+def test_lapsed_period_is_refreshed_once_per_ttl(ents):
+    lapsed = int(time.time() - ents.GRACE_SECONDS - 60)
+    ents.apply_event(_sub_event("customer.subscription.updated", "cus_1", 100, period_end=lapsed))
+    stripe = Stripe(("active", lapsed, "sub_1"))
+    assert not ents.is_subscribed("cus_1", stripe)
+    assert stripe.calls == 0  # fresh row; wait for the renewal event
+
+    _age(ents, "cus_1", ents.REFRESH_TTL_SECONDS + 1)
+    stripe.state = ("active", int(time.time() + 30 * 24 * 3600), "sub_1")
+    assert ents.is_subscribed("cus_1", stripe)
+    assert stripe.calls == 1
+
+
+def test_refresh_error_keeps_the_local_answer(ents):
+    ents.record("cus_1", "none", source="stripe")
+    _age(ents, "cus_1", ents.NEGATIVE_TTL_SECONDS + 1)
+    assert not ents.is_subscribed("cus_1", Stripe(RuntimeError("stripe down")))
+    assert ents.STATS["refresh_errors"] == 1
+
+
+def test_older_events_are_ignored(ents):
+    assert ents.apply_event(_sub_event("customer.subscription.updated", "cus_1", 200, status="active")) == "cus_1"
+    assert ents.apply_event(_sub_event("customer.subscription.updated", "cus_1", 100, status="past_due")) is None
+    assert ents.get("cus_1").status == "active"
+    assert ents.STATS["events_stale"] == 1
+
+
+def test_other_canceled_subscription_does_not_revoke(ents):
+    ents.apply_event(_sub_event("customer.subscription.created", "cus_1", 100, sub_id="sub_new"))
+    ents.apply_event(_sub_event("customer.subscription.deleted", "cus_1", 200, status="canceled", sub_id="sub_old"))
+    assert ents.get("cus_1").status == "active"
+    assert ents.is_subscribed("cus_1")
+
+
+def test_checkout_only_fills_the_gap(ents):
+    checkout = {
+        "type": "checkout.session.completed",
+        "created": 100,
+        "data": {"object": {"mode": "subscription", "payment_status": "paid", "customer": "cus_1", "subscription": "sub_1"}},
+    }
+    assert ents.apply_event(checkout) == "cus_1"
+    assert ents.get("cus_1").source == "checkout.session.completed"
+
+    ents.apply_event(_sub_event("customer.subscription.updated", "cus_1", 150, status="past_due"))
+    checkout["created"] = 300
+    assert ents.apply_event(checkout) is None
+    assert ents.get("cus_1").status == "past_due"
+
+
+def test_events_without_customer_are_skipped(ents):
+    assert ents.apply_event({"type": "customer.subscription.updated", "created": 1, "data": {"object": {}}}) is None
+    assert not ents.record("", "active")
@@ -0,0 +1,217 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from session_store import (
+    MESSAGE_OVERHEAD_BYTES,
+    SESSION_OVERHEAD_BYTES,
+    SessionBackend,
+    SessionStore,
+    SqliteSessionStore,
+    open_session_store,
+)
+
+
+@pytest.fixture
+def sqlite_stores(tmp_path):
+    opened = []
+
+    def make(**kwargs):
+        kwargs.setdefault("ttl_seconds", 3600)
+        kwargs.setdefault("max_history", 10)
+        store = SqliteSessionStore(tmp_path / "sessions.db", **kwargs)
+        opened.append(store)
+        return store
+
+    yield make
+    for store in opened:
+        store.close()
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        SessionBackend()
+
+
+# -----------------------------
+# In-process store
+# -----------------------------
+def test_history_is_capped_and_ordered():
+    store = SessionStore(ttl_seconds=60, max_history=3)
+    for i in range(5):
+        store.append("a", "user" if i % 2 == 0 else "assistant", f"m{i}")
+    assert [m["content"] for m in store.history("a")] == ["m2", "m3", "m4"]
+    assert store.stats()["trimmed_messages"] == 2
+
+
+def test_idle_sessions_expire():
+    store = SessionStore(ttl_seconds=0.05, max_history=5)
+    store.append("a", "user", "hello")
+    store.memory("a")["summary"] = "kept while live"
+    time.sleep(0.1)
+    assert store.history("a") == []
+    assert store.memory("a") == {}
+    assert store.stats()["expired"] == 1
+
+
+def test_session_count_cap_evicts_least_recently_used():
+    store = SessionStore(ttl_seconds=60, max_history=5, max_sessions=2)
+    store.append("a", "user", "first")
+    store.append("b", "user", "second")
+    store.history("a")  # a is now the most recent
+    store.append("c", "user", "third")
+    assert len(store) == 2
+    assert store.stats()["evicted_count"] == 1
+    assert store.history("a")[0]["content"] == "first"
+    assert store.history("b") == []
+
+
+def test_byte_cap_evicts_oldest_but_keeps_current():
+    big = "x" * 1000
+    one = SESSION_OVERHEAD_BYTES + MESSAGE_OVERHEAD_BYTES + len(big)
+    store = SessionStore(ttl_seconds=60, max_history=5, max_bytes=one + one // 2)
+    store.append("a", "user", big)
+    store.append("b", "user", big)
+    st = store.stats()
+    assert st["sessions"] == 1
+    assert st["evicted_bytes"] == 1
+    assert st["bytes"] <= store.max_bytes
+    assert store.history("b")[0]["content"] == big
+
+    # a single session larger than the cap is still served
+    store.append("b", "user", big)
+    assert len(store.history("b")) == 2
+
+
+# -----------------------------
+# sqlite store
+# -----------------------------
+def test_sqlite_reads_its_own_queued_writes(sqlite_stores):
+    store = sqlite_stores()
+    store.append("a", "user", "hi")
+    store.append("a", "assistant", "hello")
+    assert [m["content"] for m in store.history("a")] == ["hi", "hello"]
+    assert store.stats()["pending_writes"] > 0
+
+
+def test_sqlite_sessions_are_shared_between_instances(sqlite_stores):
+    a, b = sqlite_stores(), sqlite_stores()
+    a.append("s", "user", "In the beginning")
+    a.memory("s")["summary"] = "Genesis chat"
+    a.flush()
+
+    assert b.history("s") == [{"role": "user", "content": "In the beginning"}]
+    assert b.memory("s")["summary"] == "Genesis chat"
+
+    b.append("s", "assistant", "God created")
+    b.flush()
+    assert [m["content"] for m in a.history("s")] == ["In the beginning", "God created"]
+
+    a.drop("s")
+    a.flush()
+    assert b.history("s") == []
+
+
+def test_sqlite_transient_memory_keys_are_not_stored(sqlite_stores):
+    a, b = sqlite_stores(), sqlite_stores()
+    mem = a.memory("s")
+    mem["summary"] = "kept"
+    mem["updating"] = True
+    a.flush()
+    assert dict(b.memory("s")) == {"summary": "kept"}
+
+
+def test_sqlite_history_is_capped(sqlite_stores):
+    store = sqlite_stores(max_history=3)
+    for i in range(5):
+        store.append("a", "user", f"m{i}")
+    store.flush()
+    other = sqlite_stores(max_history=3)
+    assert [m["content"] for m in other.history("a")] == ["m2", "m3", "m4"]
+
+
+def test_sqlite_writes_do_not_wait_for_a_flush(sqlite_stores, tmp_path):
+    store = sqlite_stores()
+    store.append("a", "user", "one")
+    mem = store.memory("a")
+
+    blocker = sqlite3.connect(str(tmp_path / "sessions.db"))
+    blocker.execute("BEGIN IMMEDIATE")  # the flush below waits for this write lock
+    flusher = threading.Thread(target=store.flush)
+    flusher.start()
+    time.sleep(0.1)
+
+    t0 = time.perf_counter()
+    store.append("a", "assistant", "two")
+    mem["summary"] = "counting"
+    assert time.perf_counter() - t0 < 0.5
+    assert flusher.is_alive()
+
+    blocker.rollback()
+    blocker.close()
+    flusher.join()
+    store.flush()
+    other = sqlite_stores()
+    assert [m["content"] for m in other.history("a")] == ["one", "two"]
+    assert other.memory("a")["summary"] == "counting"
+
+
+def test_sqlite_expired_session_is_not_revived(sqlite_stores):
+    store = sqlite_stores(ttl_seconds=0.05)
+    store.append("a", "user", "old")
+    store.flush()
+    time.sleep(0.1)
+    store.append("a", "user", "new")
+    assert [m["content"] for m in store.history("a")] == ["new"]
+    store.flush()
+    assert [m["content"] for m in sqlite_stores(ttl_seconds=0.05).history("a")] == ["new"]
+
+
+def test_sqlite_sweep_removes_expired_sessions(sqlite_stores):
+    store = sqlite_stores(ttl_seconds=0.05)
+    store.append("a", "user", "hello")
+    store.flush()
+    time.sleep(0.1)
+    assert store.sweep() == 1
+    assert store.stats()["swept"] == 1
+    assert store.history("a") == []
+
+
+def test_sqlite_sweep_enforces_session_cap(sqlite_stores):
+    store = sqlite_stores(max_sessions=2)
+    for key in ("a", "b", "c"):
+        store.append(key, "user", key)
+        store.flush()
+        time.sleep(0.01)
+    assert store.sweep() == 1
+    st = store.stats()
+    assert st["sessions"] == 2
+    assert st["evicted_count"] == 1
+    assert store.history("a") == []
+    assert store.history("c")[0]["content"] == "c"
+
+
+def test_sqlite_sweep_enforces_byte_cap(sqlite_stores):
+    big = "x" * 1000
+    one = SESSION_OVERHEAD_BYTES + len("{}") + MESSAGE_OVERHEAD_BYTES + len(big)
+    store = sqlite_stores(max_bytes=one + one // 2)
+    for key in ("a", "b"):
+        store.append(key, "user", big)
+        store.flush()
+        time.sleep(0.01)
+    assert store.sweep() == 1
+    assert store.stats()["evicted_bytes"] == 1
+    assert store.history("b")[0]["content"] == big
+
+
+def test_open_session_store_picks_backend(tmp_path):
+    mem = open_session_store(None, 60, 5, 10, 1024 * 1024)
+    assert isinstance(mem, SessionStore)
+    db = open_session_store(str(tmp_path / "s.db"), 60, 5, 10, 1024 * 1024)
+    try:
+        assert isinstance(db, SqliteSessionStore)
+        assert db.max_sessions == 10
+    finally:
+        db.close()
@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+import webhook_queue
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_QUEUE_DB", str(tmp_path / "webhooks.db"))
+    monkeypatch.setattr(webhook_queue, "_DB", None)
+    monkeypatch.setattr(webhook_queue, "STATS", {k: type(v)() for k, v in webhook_queue.STATS.items()})
+    yield webhook_queue
+    webhook_queue.stop()
+
+
+def _event(event_id, customer, created, etype="customer.subscription.updated"):
+    obj = {"object": "subscription", "id": f"sub_{event_id}", "customer": customer} if customer else {"object": "invoice"}
+    return {"id": event_id, "type": etype, "created": created, "data": {"object": obj}}
+
+
+def _enqueue(q, event):
+    return q.enqueue(event, json.dumps(event).encode("utf-8"))
+
+
+def _retry_now(q):
+    q._db().execute("UPDATE events SET next_attempt=0 WHERE status='pending'")
+    q._db().commit()
+
+
+def test_duplicate_deliveries_are_stored_once(queue):
+    e = _event("evt_1", "cus_1", 100)
+    assert _enqueue(queue, e)
+    assert not _enqueue(queue, e)
+    st = queue.stats()
+    assert st["received"] == 1
+    assert st["duplicates"] == 1
+    assert st["depth"] == 1
+
+
+def test_event_without_id_is_rejected(queue):
+    with pytest.raises(ValueError):
+        _enqueue(queue, {"type": "customer.created"})
+
+
+def test_customer_id_is_taken_from_the_object(queue):
+    assert queue._customer_of(_event("e", "cus_1", 1)) == "cus_1"
+    assert queue._customer_of({"data": {"object": {"object": "customer", "id": "cus_2"}}}) == "cus_2"
+    assert queue._customer_of({"data": {"object": {"customer": {"id": "cus_3"}}}}) == "cus_3"
+    assert queue._customer_of({"data": {"object": {}}}) == ""
+
+
+def test_events_are_handled_oldest_first(queue):
+    # delivered out of order
+    _enqueue(queue, _event("evt_b", "cus_1", 200))
+    _enqueue(queue, _event("evt_a", "cus_1", 100))
+    seen = []
+    while queue.drain_once(lambda e: seen.append(e["id"])):
+        pass
+    assert seen == ["evt_a", "evt_b"]
+    assert queue.stats()["processed"] == 2
+
+
+def test_failed_event_holds_back_its_customer_only(queue):
+    _enqueue(queue, _event("evt_1", "cus_1", 100))
+    _enqueue(queue, _event("evt_2", "cus_1", 200))
+    _enqueue(queue, _event("evt_3", "cus_2", 150))
+    seen = []
+
+    def handler(event):
+        seen.append(event["id"])
+        if event["id"] == "evt_1" and seen.count("evt_1") == 1:
+            raise RuntimeError("boom")
+
+    queue.drain_once(handler)
+    queue.drain_once(handler)
+    assert seen == ["evt_1", "evt_3"]  # evt_2 waits behind cus_1's failed event
+    assert queue.stats()["failures"] == 1
+
+    _retry_now(queue)
+    while queue.drain_once(handler):
+        pass
+    assert seen == ["evt_1", "evt_3", "evt_1", "evt_2"]
+    assert queue.stats()["depth"] == 0
+
+
+def test_customerless_events_do_not_block_each_other(queue):
+    _enqueue(queue, _event("evt_x", "", 100, "invoice.created"))
+    _enqueue(queue, _event("evt_y", "", 200, "invoice.created"))
+    seen = []
+
+    def handler(event):
+        seen.append(event["id"])
+        if event["id"] == "evt_x":
+            raise RuntimeError("boom")
+
+    queue.drain_once(handler)
+    assert seen == ["evt_x", "evt_y"]
+    assert queue.stats()["processed"] == 1
+
+
+def test_dead_event_unblocks_the_customer(queue, monkeypatch):
+    monkeypatch.setattr(queue, "MAX_ATTEMPTS", 1)
+    _enqueue(queue, _event("evt_1", "cus_1", 100))
+    _enqueue(queue, _event("evt_2", "cus_1", 200))
+    seen = []
+
+    def handler(event):
+        seen.append(event["id"])
+        if event["id"] == "evt_1":
+            raise RuntimeError("boom")
+
+    while queue.drain_once(handler):
+        pass
+    assert seen == ["evt_1", "evt_2"]
+    st = queue.stats()
+    assert st["dead"] == 1
+    assert st["processed"] == 1
+
+
+def test_only_the_lease_holder_drains(queue, monkeypatch):
+    _enqueue(queue, _event("evt_1", "cus_1", 100))
+    monkeypatch.setattr(queue, "_OWNER", "other-worker")
+    assert queue.drain_once(lambda e: None) == 1
+    monkeypatch.setattr(queue, "_OWNER", "this-worker")
+    _enqueue(queue, _event("evt_2", "cus_1", 200))
+    assert queue.drain_once(lambda e: None) == 0  # other-worker still holds the lease
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable, List
+
+from state_paths import state_path
+
+log = logging.getLogger(__name__)
+
+# Durable inbox for Stripe webhook events.
+#
+# /stripe/webhook verifies the signature, stores the raw event here (keyed by the
+# event id, so Stripe's redeliveries are no-ops) and answers 200 right away. A
+# background thread drains the table in batches through the handler given to
+# start(). Events of one customer are processed in order (Stripe `created`, then
+# arrival): an event waits while an earlier one of the same customer is still
+# pending, including one that is backing off after a failure. Events without a
+# customer are not ordered. Failed events are
+# retried with jittered exponential backoff up to MAX_ATTEMPTS, then parked as
+# 'dead'. Only the worker holding the lease drains, so several uvicorn workers
+# can share the file.
+
+POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS") or "1")
+BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE") or "50")
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS") or "8")
+RETRY_BASE_SECONDS = 2.0
+RETRY_MAX_SECONDS = 600.0
+LEASE_SECONDS = 30.0
+# Processed events are kept this long for de-duplication (Stripe retries for 3 days).
+KEEP_DONE_SECONDS = 7 * 24 * 3600
+
+_DB_LOCK = threading.Lock()
+_DB: Optional[sqlite3.Connection] = None
+_THREAD: Optional[threading.Thread] = None
+_STOP = threading.Event()
+_WAKE = threading.Event()
+_OWNER = uuid.uuid4().hex
+_LATENCIES: deque = deque(maxlen=500)
+
+STATS = {
+    "received": 0,
+    "duplicates": 0,
+    "processed": 0,
+    "failures": 0,
+    "dead": 0,
+    "batches": 0,
+    "process_ms_total": 0.0,
+}
+
+
+def db_path() -> Path:
+    return state_path("WEBHOOK_QUEUE_DB", "webhooks.db")
+
+
+def _db() -> sqlite3.Connection:
+    global _DB
+    if _DB is None:
+        path = db_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(path), timeout=10, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        # an event we answered 200 for must survive a crash
+        con.execute("PRAGMA synchronous=FULL")
+        con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                id TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                customer_id TEXT NOT NULL,
+                created INTEGER NOT NULL,
+                received REAL NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                processed REAL
+            );
+            CREATE INDEX IF NOT EXISTS events_pending ON events (status, customer_id, created, received);
+            CREATE TABLE IF NOT EXISTS lease (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                until REAL NOT NULL
+            );
+            """
+        )
+        con.commit()
+        _DB = con
+    return _DB
+
+
+def _customer_of(event: Dict[str, Any]) -> str:
+    obj = (event.get("data") or {}).get("object") or {}
+    if obj.get("object") == "customer":
+        return str(obj.get("id") or "")
+    customer = obj.get("customer")
+    return str(customer.get("id") if isinstance(customer, dict) else customer or "")
+
+
+def enqueue(event: Dict[str, Any], payload: bytes) -> bool:
+    """
+    Store a verified event; False if this event id was already stored.
+    Blocking (fsync): call it from a thread pool.
+    """
+    event_id = str(event.get("id") or "")
+    if not event_id:
+        raise ValueError("Stripe event without an id")
+    with _DB_LOCK:
+        con = _db()
+        cur = con.execute(
+            """
+            INSERT OR IGNORE INTO events (id, type, customer_id, created, received, payload)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                event_id,
+                str(event.get("type") or ""),
+                _customer_of(event),
+                int(event.get("created") or 0),
+                time.time(),
+                payload.decode("utf-8"),
+            ),
+        )
+        con.commit()
+        new = cur.rowcount == 1
+    if new:
+        STATS["received"] += 1
+        _WAKE.set()
+    else:
+        STATS["duplicates"] += 1
+    return new
+
+
+def _hold_lease(now: float) -> bool:
+    with _DB_LOCK:
+        con = _db()
+        con.execute(
+            """
+            INSERT INTO lease (name, owner, until) VALUES ('drain', ?, ?)
+            ON CONFLICT (name) DO UPDATE SET owner=excluded.owner, until=excluded.until
+            WHERE lease.owner = excluded.owner OR lease.until < ?
+            """,
+            (_OWNER, now + LEASE_SECONDS, now),
+        )
+        con.commit()
+        row = con.execute("SELECT owner FROM lease WHERE name='drain'").fetchone()
+    return bool(row and row[0] == _OWNER)
+
+
+def _next_batch(now: float) -> List[tuple]:
+    with _DB_LOCK:
+        return _db().execute(
+            """
+            SELECT e.id, e.payload, e.attempts, e.received FROM events e
+            WHERE e.status = 'pending' AND e.next_attempt <= ?
+              AND (
+                e.customer_id = ''  -- no customer, nothing to order against
+                OR NOT EXISTS (
+                  SELECT 1 FROM events p
+                  WHERE p.status = 'pending' AND p.customer_id = e.customer_id
+                    AND (p.created, p.received) < (e.created, e.received)
+                )
+              )
+            ORDER BY e.created, e.received
+            LIMIT ?
+            """,
+            (now, BATCH_SIZE),
+        ).fetchall()
+
+
+def drain_once(handler: Callable[[Dict[str, Any]], Any]) -> int:
+    """
+    Process one batch; returns how many events were handled (successfully or not).
+    """
+    now = time.time()
+    if not _hold_lease(now):
+        return 0
+    batch = _next_batch(now)
+    if not batch:
+        return 0
+
+    t0 = time.perf_counter()
+    done, failed = [], []
+    for event_id, payload, attempts, received in batch:
+        try:
+            handler(json.loads(payload))
+        except Exception as e:
+            attempts += 1
+            dead = attempts >= MAX_ATTEMPTS
+            delay = random.uniform(0.5, 1.0) * min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempts))
+            failed.append(("dead" if dead else "pending", attempts, now + delay, repr(e)[:500], event_id))
+            STATS["failures"] += 1
+            STATS["dead"] += 1 if dead else 0
+            log.warning("webhook %s failed (attempt %d%s): %r", event_id, attempts, ", giving up" if dead else "", e)
+            continue
+        finished = time.time()
+        done.append((finished, event_id))
+        _LATENCIES.append(finished - received)
+
+    with _DB_LOCK:
+        con = _db()
+        con.executemany("UPDATE events SET status='done', processed=?, attempts=attempts+1 WHERE id=?", done)
+        con.executemany(
+            "UPDATE events SET status=?, attempts=?, next_attempt=?, last_error=? WHERE id=?",
+            failed,
+        )
+        con.commit()
+    STATS["processed"] += len(done)
+    STATS["batches"] += 1
+    STATS["process_ms_total"] += (time.perf_counter() - t0) * 1000
+    return len(batch)
+
+
+def _prune() -> None:
+    with _DB_LOCK:
+        _db().execute("DELETE FROM events WHERE status='done' AND processed < ?", (time.time() - KEEP_DONE_SECONDS,))
+        _db().commit()
+
+
+def _loop(handler: Callable[[Dict[str, Any]], Any]) -> None:
+    next_prune = 0.0
+    while not _STOP.is_set():
+        try:
+            while not _STOP.is_set() and drain_once(handler) >= BATCH_SIZE:
+                pass
+            if time.monotonic() >= next_prune:
+                _prune()
+                next_prune = time.monotonic() + 3600
+        except Exception as e:
+            log.error("Webhook queue drain failed: %r", e)
+        _WAKE.wait(POLL_SECONDS)
+        _WAKE.clear()
+
+
+def start(handler: Callable[[Dict[str, Any]], Any]) -> None:
+    global _THREAD
+    if _THREAD is not None and _THREAD.is_alive():
+        return
+    _STOP.clear()
+    _THREAD = threading.Thread(target=_loop, args=(handler,), name="webhook-queue", daemon=True)
+    _THREAD.start()
+
+
+def stop() -> None:
+    global _DB
+    _STOP.set()
+    _WAKE.set()
+    if _THREAD is not None:
+        _THREAD.join(timeout=5)
+    with _DB_LOCK:
+        if _DB is not None:
+            _DB.close()
+            _DB = None
+
+
+def stats() -> Dict[str, Any]:
+    st = dict(STATS)
+    ms = st.pop("process_ms_total")
+    st["batch_ms_avg"] = round(ms / st["batches"], 2) if st["batches"] else 0.0
+    lat = sorted(_LATENCIES)
+    st["latency_ms_avg"] = round(sum(lat) * 1000 / len(lat), 1) if lat else 0.0
+    st["latency_ms_p95"] = round(lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000, 1) if lat else 0.0
+    try:
+        with _DB_LOCK:
+            con = _db()
+            depth, oldest = con.execute("SELECT COUNT(*), MIN(received) FROM events WHERE status='pending'").fetchone()
+            st["dead_total"] = con.execute("SELECT COUNT(*) FROM events WHERE status='dead'").fetchone()[0]
+            lease = con.execute("SELECT owner, until FROM lease WHERE name='drain'").fetchone()
+    except sqlite3.Error:
+        return st
+    st["depth"] = depth
+    st["lag_seconds"] = round(time.time() - oldest, 1) if oldest else 0.0
+    st["draining_here"] = bool(lease and lease[0] == _OWNER and lease[1] > time.time())
+    return st